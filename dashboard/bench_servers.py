@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# load test of the overview views: sends the same requests to each running
+# server and reports p50/p99 latency and requests per second, e.g. the
+# ASGI and WSGI stacks side by side:
+#
+#   uvicorn dashboard.asgi:application --port 8001 --workers 2
+#   gunicorn dashboard.wsgi --bind :8000 --workers 2 --threads 4
+#   python bench_servers.py wsgi=http://127.0.0.1:8000 \
+#       asgi=http://127.0.0.1:8001
+#
+# (daphne -p 8001 dashboard.asgi:application or `manage.py runserver`
+# work as well.)
+import http.client
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import click
+
+PATHS = [
+    '/overview/summary/',
+    '/overview/summary/?start=2021-01-01',
+    '/overview/artists/top/',
+    '/overview/listening/daily/',
+    '/overview/features/trends/',
+]
+
+
+class Client(threading.local):
+    """One keep-alive connection per thread"""
+
+    def __init__(self, host, port):
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+
+    def get(self, path):
+        start = time.perf_counter()
+        self.conn.request('GET', path)
+        response = self.conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f'GET {path}: {response.status}')
+        return time.perf_counter() - start
+
+
+def run(url, paths, requests, concurrency):
+    """Returns (latencies in seconds, wall time) of requests GETs cycling
+    through paths from concurrency threads
+    """
+    parts = urlsplit(url)
+    client = Client(parts.hostname, parts.port or 80)
+    prefix = parts.path.rstrip('/')
+    jobs = [prefix + paths[i % len(paths)] for i in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(client.get, jobs))
+    return latencies, time.perf_counter() - start
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+@click.command()
+@click.argument('servers', nargs=-1, required=True)
+@click.option('--requests', default=2000, show_default=True)
+@click.option('--concurrency', default=16, show_default=True)
+@click.option('--warmup', default=100, show_default=True)
+@click.option('--path', 'paths', multiple=True,
+              help='request path, repeatable (default: the overview views)')
+def main(servers, requests, concurrency, warmup, paths):
+    """ Load tests each of SERVERS, given as label=url. """
+    paths = list(paths) or PATHS
+    print(f'{"server":<10}{"p50 ms":>10}{"p99 ms":>10}{"req/s":>10}')
+    for server in servers:
+        label, url = server, server
+        if '=' in server.split('://')[0]:
+            label, url = server.split('=', 1)
+        run(url, paths, warmup, concurrency)
+        latencies, seconds = run(url, paths, requests, concurrency)
+        print(f'{label:<10}'
+              f'{percentile(latencies, 50) * 1000:>10.1f}'
+              f'{percentile(latencies, 99) * 1000:>10.1f}'
+              f'{requests / seconds:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
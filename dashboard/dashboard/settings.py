@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from dotenv import load_dotenv, find_dotenv
 
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'overview',
 ]
 
 MIDDLEWARE = [
@@ -86,6 +88,21 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# the overview views are cached until the next ingest bumps the data
+# version (see overview.caching), so entries don't need to expire
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dashboard',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -123,3 +140,19 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Project data
+# stored artist graph, its layouts and the track similarity index, as
+# written by `make data` (src.features.graph_store,
+# src.features.graph_layout and src.models.similarity)
+
+ARTIST_GRAPH_DIR = Path(os.environ.get(
+    'ARTIST_GRAPH_DIR', BASE_DIR.parent / 'data' / 'processed' /
+    'artist_graph'))
+ARTIST_LAYOUT_DIR = Path(os.environ.get(
+    'ARTIST_LAYOUT_DIR', BASE_DIR.parent / 'data' / 'processed' /
+    'artist_layout'))
+TRACK_SIMILARITY_INDEX = Path(os.environ.get(
+    'TRACK_SIMILARITY_INDEX', BASE_DIR.parent / 'data' / 'processed' /
+    'track_similarity.npz'))
@@ -1,3 +1,8 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Artist, AudioFeatures, Play, Track
+
+admin.site.register(Artist)
+admin.site.register(Track)
+admin.site.register(AudioFeatures)
+admin.site.register(Play)
@@ -0,0 +1,161 @@
+"""The aggregates behind the overview views
+
+Each function runs its own queries and returns JSON serialisable data,
+so the views can serve them one at a time or, in the summary view,
+concurrently from worker threads.
+"""
+import datetime
+import functools
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .models import (
+    DailyListening, Track, WeeklyArtistListening, WeeklyListening,
+)
+
+FEATURES = ['danceability', 'energy', 'valence', 'tempo']
+TOP_DEGREE_ARTISTS = 10
+
+
+def _date_range(queryset, field, start, end):
+    if start:
+        queryset = queryset.filter(**{f'{field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{field}__lt': end})
+    return queryset
+
+
+def daily_minutes(start=None, end=None):
+    """Plays and minutes per day in [start, end)"""
+    days = _date_range(DailyListening.objects.all(), 'day', start, end)
+    return list(days.values('day', 'plays', 'minutes', 'tracks', 'artists'))
+
+
+def top_artists(week=None, limit=10):
+    """Returns (week, most played artists of the week) for the week
+    holding the date week, the latest week by default
+    """
+    if week is None:
+        latest = WeeklyListening.objects.last()
+        week = latest.week if latest else None
+    else:
+        week -= datetime.timedelta(days=week.weekday())
+    rows = (WeeklyArtistListening.objects.filter(week=week)
+            .order_by('-plays')
+            .values('artist__name', 'artist__spotify_id', 'plays',
+                    'minutes')[:limit])
+    return week, [dict(name=r['artist__name'],
+                       spotify_id=r['artist__spotify_id'],
+                       plays=r['plays'], minutes=r['minutes'])
+                  for r in rows]
+
+
+def feature_trends(start=None, end=None):
+    """Weekly averages of the audio features of played tracks"""
+    weeks = _date_range(WeeklyListening.objects.all(), 'week', start, end)
+    return list(weeks.values('week', *FEATURES))
+
+
+@functools.lru_cache(maxsize=1)
+def _graph_stats(path, mtime):
+    from src.features.graph_store import ArtistGraph
+
+    graph = ArtistGraph.load(path)
+    degree = graph.degree()
+    top = degree.argsort()[::-1][:TOP_DEGREE_ARTISTS]
+    return dict(
+        nodes=graph.n_nodes,
+        edges=graph.n_edges,
+        directed=graph.directed,
+        mean_degree=float(degree.mean()) if graph.n_nodes else 0.0,
+        top_degree=[dict(name=str(graph.names[i]), spotify_id=str(
+            graph.ids[i]), degree=int(degree[i])) for i in top],
+    )
+
+
+def graph_stats(path=None):
+    """Size and best connected artists of the stored artist graph
+    (settings.ARTIST_GRAPH_DIR), or None before it has been built.
+    Recomputed only when the graph is rebuilt.
+    """
+    meta = Path(path or settings.ARTIST_GRAPH_DIR) / 'meta.json'
+    if not meta.exists():
+        return None
+    return _graph_stats(meta.parent, meta.stat().st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=1)
+def _hashed_graph(path, mtime):
+    from src.features.graph_store import ArtistGraph
+    from src.features.reference_graphs import graph_hash
+
+    graph = ArtistGraph.load(path)
+    return graph, graph_hash(graph)
+
+
+@functools.lru_cache(maxsize=1)
+def _layout(path, mtime):
+    from src.features.graph_layout import GraphLayout
+
+    return GraphLayout.load(path)
+
+
+def graph_layout(bbox=None, limit=1000):
+    """The at most limit best connected artists positioned inside bbox
+    (x min, y min, x max, y max; the whole graph by default) by the
+    precomputed layout, and the edges between them as pairs of indices
+    into the artists. None before the graph has been laid out.
+    """
+    meta = Path(settings.ARTIST_GRAPH_DIR) / 'meta.json'
+    if not meta.exists():
+        return None
+    graph, digest = _hashed_graph(meta.parent, meta.stat().st_mtime_ns)
+    meta = Path(settings.ARTIST_LAYOUT_DIR) / digest / 'meta.json'
+    if not meta.exists():
+        return None
+    layout = _layout(meta.parent, meta.stat().st_mtime_ns)
+
+    nodes = layout.query(bbox, limit)
+    local = np.full(graph.n_nodes, -1, dtype='int64')
+    local[nodes] = np.arange(len(nodes))
+    degree = graph.degree()[nodes]
+    sources = np.repeat(np.arange(len(nodes)), degree)
+    targets = local[np.concatenate(
+        [np.empty(0, dtype='int32')] + [graph.neighbors(i) for i in nodes])]
+    # an undirected graph stores each edge both ways
+    keep = targets >= 0 if graph.directed else targets > sources
+    xy = layout.positions[nodes]
+    return dict(
+        bounds=layout.bounds,
+        artists=[dict(spotify_id=str(graph.ids[i]), name=str(graph.names[i]),
+                      x=float(x), y=float(y), degree=int(d))
+                 for i, (x, y), d in zip(nodes, xy, degree)],
+        edges=np.column_stack((sources[keep], targets[keep])).tolist(),
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _similarity_index(path, mtime):
+    from src.models.similarity import SimilarityIndex
+
+    return SimilarityIndex.load(path)
+
+
+def similar_tracks(track_ids, k=10):
+    """{track id: the k tracks most like it by audio features} from the
+    stored similarity index (settings.TRACK_SIMILARITY_INDEX), with None
+    for tracks not in it; None before the index has been built
+    """
+    path = Path(settings.TRACK_SIMILARITY_INDEX)
+    if not path.exists():
+        return None
+    index = _similarity_index(path, path.stat().st_mtime_ns)
+    similar = index.similar(track_ids, k)
+    names = dict(Track.objects.filter(spotify_id__in={
+        other for tracks in similar.values() for other, _ in tracks or []
+    }).values_list('spotify_id', 'name'))
+    return {track_id: None if tracks is None else [
+        dict(track_id=other, name=names.get(other), distance=distance)
+        for other, distance in tracks] for track_id, tracks in similar.items()}
@@ -0,0 +1,74 @@
+"""Caching of the overview views on the ingested data's version
+
+Responses are cached under the request path, its sorted query
+parameters and the data version, a counter stored in RollupState that
+every ingest bumps. An ingest therefore invalidates every cached page at
+once, in every process, without having to know the keys. The same
+digest is the response's ETag, so a conditional GET from a client that
+has the current page is answered with a 304 before the view or the cache
+is touched.
+"""
+import functools
+import hashlib
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+
+from .models import RollupState
+from .rollups import STATE_NAME
+
+KEY_PREFIX = 'overview'
+
+
+def data_version():
+    """Returns the current data version (0 before the first ingest)"""
+    version = RollupState.objects.filter(name=STATE_NAME).values_list(
+        'version', flat=True).first()
+    return version or 0
+
+
+def bump_data_version():
+    """Invalidates every cached overview response"""
+    RollupState.objects.get_or_create(name=STATE_NAME)
+    RollupState.objects.filter(name=STATE_NAME).update(
+        version=F('version') + 1)
+
+
+def _digest(request, version):
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    return hashlib.md5(
+        f'{version}:{request.path}?{query}'.encode()).hexdigest()
+
+
+def cached_view(view):
+    """Serves a GET view from the cache, keyed on its path, query
+    parameters and the data version, and answers If-None-Match with 304.
+    Only 200 responses are cached.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        digest = _digest(request, data_version())
+        etag = quote_etag(digest)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            key = f'{KEY_PREFIX}:{digest}'
+            cached = cache.get(key)
+            if cached is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                cached = (response.content, response['Content-Type'])
+                cache.set(key, cached)
+            response = HttpResponse(cached[0], content_type=cached[1])
+        response['ETag'] = etag
+        # let clients keep the page but revalidate it on every use
+        patch_cache_control(response, no_cache=True)
+        return response
+    return wrapper
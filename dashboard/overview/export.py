@@ -0,0 +1,132 @@
+"""Streaming exports and keyset pagination of the listening history
+
+Exports are generated row by row from a queryset iterator (a server side
+cursor where the database has them), so memory use doesn't grow with the
+number of rows. Pages of plays are selected with
+`(played_at, id) > (cursor)` rather than OFFSET, which the played_at
+index answers at the same cost however deep the page.
+"""
+import base64
+import csv
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from .models import Play, Track
+from .rollups import local_midnight
+
+CHUNK_SIZE = 2000
+
+# output column -> lookup
+PLAY_FIELDS = dict(
+    played_at='played_at',
+    track_id='track__spotify_id',
+    track_name='track__name',
+    artist_id='artist__spotify_id',
+    artist_name='artist__name',
+    duration_ms='track__duration_ms',
+    context_type='context_type',
+    context_uri='context_uri',
+)
+TRACK_FIELDS = dict(
+    track_id='spotify_id',
+    track_name='name',
+    artist_id='artist__spotify_id',
+    artist_name='artist__name',
+    album_name='album_name',
+    duration_ms='duration_ms',
+    popularity='popularity',
+    release_date='release_date',
+    release_date_precision='release_date_precision',
+    **{name: f'features__{name}' for name in (
+        'danceability', 'energy', 'speechiness', 'acousticness',
+        'instrumentalness', 'liveness', 'valence', 'loudness', 'tempo',
+        'time_signature', 'key', 'mode')},
+)
+
+
+def plays(start=None, end=None):
+    """Plays from the local midnight of date start to that of end, oldest
+    first
+    """
+    queryset = Play.objects.order_by('played_at', 'id')
+    if start:
+        queryset = queryset.filter(played_at__gte=local_midnight(start))
+    if end:
+        queryset = queryset.filter(played_at__lt=local_midnight(end))
+    return queryset
+
+
+def tracks():
+    return Track.objects.order_by('id')
+
+
+def iter_rows(queryset, fields):
+    """Yields tuples of the fields' lookups without caching the queryset"""
+    return queryset.values_list(*fields.values()).iterator(
+        chunk_size=CHUNK_SIZE)
+
+
+class _Echo:
+    """File-like object whose write returns the line csv hands it"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, fields):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(list(fields))
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows, fields):
+    names = list(fields)
+    for row in rows:
+        yield json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+FORMATS = dict(
+    csv=(csv_lines, 'text/csv'),
+    ndjson=(ndjson_lines, 'application/x-ndjson'),
+)
+
+
+def encode_cursor(played_at, pk):
+    value = f'{played_at.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns (played_at, id); raises ValueError on a malformed cursor"""
+    try:
+        played_at, pk = base64.urlsafe_b64decode(
+            cursor.encode()).decode().split('|')
+        return datetime.datetime.fromisoformat(played_at), int(pk)
+    except ValueError as e:
+        raise ValueError(f'invalid cursor {cursor!r}') from e
+
+
+def page_after(queryset, cursor, limit):
+    """Returns (rows, next cursor or None) for the limit plays of an
+    (played_at, id) ordered queryset that follow cursor; raises
+    ValueError unless limit is positive
+    """
+    if limit < 1:
+        raise ValueError('limit must be at least 1')
+    if cursor:
+        played_at, pk = decode_cursor(cursor)
+        # the plain played_at bound lets the index seek to the cursor
+        queryset = queryset.filter(played_at__gte=played_at).filter(
+            Q(played_at__gt=played_at) | Q(id__gt=pk))
+    rows = list(queryset.values('id', *PLAY_FIELDS.values())[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if more and rows:
+        next_cursor = encode_cursor(rows[-1]['played_at'], rows[-1]['id'])
+    return [{name: row[lookup] for name, lookup in PLAY_FIELDS.items()}
+            for row in rows], next_cursor
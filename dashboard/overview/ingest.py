@@ -0,0 +1,174 @@
+"""Bulk loading of the project's data stores into the overview models
+
+Rows are written with bulk_create in batches and ignore_conflicts, so
+anything already present (by Spotify id, or by played_at and track for
+plays) is skipped and re-running an ingest is cheap.
+"""
+import pandas as pd
+from django.db import transaction
+
+from .models import Artist, AudioFeatures, Play, Track
+
+BATCH_SIZE = 5000
+# ids per `spotify_id in (...)` lookup, below sqlite's variable limit
+LOOKUP_SIZE = 500
+
+FEATURE_COLUMNS = dict(
+    danceability='danceability',
+    energy='energy',
+    speechiness='speechiness',
+    acousticness='acousticness',
+    instrumentalness='instrumentalness',
+    liveness='liveness',
+    valence='valence',
+    loudness='loudness',
+    tempo='tempo',
+    tempo_confidence='tempo_confidence',
+    time_signature='time_signature',
+    time_signature_confidence='time_sig_conf',
+    key='key',
+    key_confidence='key_confidence',
+    mode='mode',
+    mode_confidence='mode_confidence',
+)
+
+
+def _value(v):
+    """Returns None for missing values and plain python numbers for
+    numpy ones
+    """
+    if v is None or v is pd.NA or (isinstance(v, float) and v != v):
+        return None
+    return v.item() if hasattr(v, 'item') else v
+
+
+def _id_map(model, spotify_ids):
+    """Returns spotify_id -> primary key for the given ids"""
+    spotify_ids = list(spotify_ids)
+    ids = {}
+    for start in range(0, len(spotify_ids), LOOKUP_SIZE):
+        ids.update(model.objects.filter(
+            spotify_id__in=spotify_ids[start:start + LOOKUP_SIZE]
+        ).values_list('spotify_id', 'pk'))
+    return ids
+
+
+def ensure_artists(df, batch_size=BATCH_SIZE, rename=False):
+    """Creates the artists of df's artist_id / artist_name columns that
+    are missing; returns spotify_id -> primary key
+
+    :rename: df's names belong to the artist of the id, so they replace
+        the stored names of existing artists too
+    """
+    artists = df[['artist_id', 'artist_name']].dropna(subset=['artist_id'])
+    artists = artists.drop_duplicates('artist_id', keep='last')
+    Artist.objects.bulk_create(
+        (Artist(spotify_id=a, name=_value(n) or '')
+         for a, n in artists.itertuples(index=False, name=None)),
+        batch_size=batch_size, ignore_conflicts=True,
+    )
+    if rename:
+        _rename_artists(artists, batch_size)
+    return _id_map(Artist, artists['artist_id'])
+
+
+def _rename_artists(artists, batch_size=BATCH_SIZE):
+    names = {a: _value(n) for a, n in artists.itertuples(index=False,
+                                                         name=None)}
+    ids = list(names)
+    renamed = []
+    for start in range(0, len(ids), LOOKUP_SIZE):
+        for artist in Artist.objects.filter(
+                spotify_id__in=ids[start:start + LOOKUP_SIZE]):
+            name = names[artist.spotify_id]
+            if name and artist.name != name:
+                artist.name = name
+                renamed.append(artist)
+    Artist.objects.bulk_update(renamed, ['name'], batch_size=batch_size)
+
+
+def ensure_tracks(df, artist_ids, batch_size=BATCH_SIZE):
+    """Creates the missing tracks of a frame with track_id, track_name,
+    artist_id and optional album_name, duration_ms, popularity,
+    release_date and release_date_precision columns; returns
+    spotify_id -> primary key
+    """
+    df = df.dropna(subset=['track_id', 'artist_id'])
+    df = df.drop_duplicates('track_id', keep='last')
+    columns = ['track_id', 'track_name', 'artist_id', 'album_name',
+               'duration_ms', 'popularity', 'release_date',
+               'release_date_precision']
+    df = df.reindex(columns=columns)
+    for name in ('duration_ms', 'popularity'):
+        df[name] = df[name].astype('float64').astype('Int64')
+    if df['release_date'].notna().any():
+        df['release_date'] = pd.to_datetime(
+            df['release_date'], format='ISO8601', errors='coerce').dt.date
+
+    Track.objects.bulk_create(
+        (Track(spotify_id=t, name=_value(name) or '',
+               artist_id=artist_ids[a], album_name=_value(album) or '',
+               duration_ms=_value(duration), popularity=_value(popularity),
+               release_date=_value(release),
+               release_date_precision=_value(precision) or '')
+         for t, name, a, album, duration, popularity, release, precision
+         in df.itertuples(index=False, name=None)),
+        batch_size=batch_size, ignore_conflicts=True,
+    )
+    return _id_map(Track, df['track_id'])
+
+
+@transaction.atomic
+def ingest_plays(df, batch_size=BATCH_SIZE):
+    """Loads a compacted listening history frame (see
+    src.data.compact_recently_played); returns the number of plays in df
+    """
+    if df.empty:
+        return 0
+    # a play's artist name is that of the track's first artist, the
+    # artist of artist_id
+    artist_ids = ensure_artists(df, batch_size, rename=True)
+    track_ids = ensure_tracks(df, artist_ids, batch_size)
+    df = df.dropna(subset=['track_id', 'artist_id'])
+    Play.objects.bulk_create(
+        (Play(played_at=played_at.to_pydatetime(),
+              track_id=track_ids[t], artist_id=artist_ids[a],
+              context_type=_value(context_type) or '',
+              context_uri=_value(context_uri) or '')
+         for played_at, t, a, context_type, context_uri in df[[
+             'played_at', 'track_id', 'artist_id', 'context_type',
+             'context_uri']].itertuples(index=False, name=None)),
+        batch_size=batch_size, ignore_conflicts=True,
+    )
+    return len(df)
+
+
+@transaction.atomic
+def ingest_tracks(df, batch_size=BATCH_SIZE):
+    """Loads a track_info_df frame (e.g. a combined discover weekly
+    part): tracks, their artists and audio features. Returns the number
+    of tracks in df.
+    """
+    if df.empty:
+        return 0
+    df = df.rename(columns=dict(song_id='track_id', song_name='track_name',
+                                song_length_ms='duration_ms'))
+    # artist_name is the album's first artist while artist_id is the
+    # track's, so it only names artists not known yet, and plays rename
+    # them (compilations would otherwise credit 'Various Artists')
+    artist_ids = ensure_artists(df, batch_size)
+    track_ids = ensure_tracks(df, artist_ids, batch_size)
+    df = df.dropna(subset=['track_id']).drop_duplicates('track_id',
+                                                        keep='last')
+    features = df.reindex(columns=['track_id'] + list(
+        FEATURE_COLUMNS.values()))
+    for name in ('key', 'mode', 'time_signature'):
+        features[name] = features[name].astype('float64').astype('Int64')
+    AudioFeatures.objects.bulk_create(
+        (AudioFeatures(track_id=track_ids[row[0]], **{
+            field: _value(v) for field, v in zip(FEATURE_COLUMNS, row[1:])})
+         for row in features.itertuples(index=False, name=None)
+         if row[0] in track_ids),
+        batch_size=batch_size, ignore_conflicts=True,
+    )
+    return len(df)
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from overview import caching, ingest, rollups
+from overview.models import Play
+
+
+class Command(BaseCommand):
+    help = ('Loads the compacted listening history and the combined '
+            'discover weekly tracks into the overview models, skipping '
+            'rows already present')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since', help='load plays from this date on (default: the '
+                            'month of the latest stored play)')
+        parser.add_argument('--no-plays', action='store_true')
+        parser.add_argument('--no-tracks', action='store_true')
+        parser.add_argument('--batch-size', type=int,
+                            default=ingest.BATCH_SIZE)
+        parser.add_argument('--full-rollups', action='store_true',
+                            help='rebuild the rollups from scratch, e.g. '
+                                 'after a backfill of older plays')
+
+    def handle(self, *args, **options):
+        # the data stores live in the project's src package
+        from src.data.combine_discover_weekly import CombinedDiscoverWeekly
+        from src.data.compact_recently_played import load_history
+
+        start = time.perf_counter()
+        batch_size = options['batch_size']
+        if not options['no_tracks']:
+            n = sum(ingest.ingest_tracks(df, batch_size)
+                    for df in CombinedDiscoverWeekly().iter_frames())
+            self.stdout.write(f'{n} discover weekly tracks ingested')
+
+        if not options['no_plays']:
+            since = options['since']
+            if since is None:
+                latest = Play.objects.aggregate(Max('played_at'))
+                latest = latest['played_at__max']
+                since = latest and latest.strftime('%Y-%m-01')
+            n = ingest.ingest_plays(load_history(start=since), batch_size)
+            self.stdout.write(f'{n} plays since {since or "the start"} '
+                              'ingested')
+
+        watermark = rollups.refresh(full=options['full_rollups'])
+        self.stdout.write(f'rollups refreshed up to {watermark}')
+        caching.bump_data_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'ingest finished in {time.perf_counter() - start:.1f}s'))
@@ -0,0 +1,104 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Artist',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_id', models.CharField(max_length=22, unique=True)),
+                ('name', models.CharField(db_index=True, max_length=200)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Track',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_id', models.CharField(max_length=22, unique=True)),
+                ('name', models.CharField(max_length=300)),
+                ('album_name', models.CharField(blank=True, max_length=300)),
+                ('duration_ms', models.IntegerField(null=True)),
+                ('popularity', models.SmallIntegerField(null=True)),
+                ('release_date', models.DateField(null=True)),
+                ('release_date_precision', models.CharField(blank=True, max_length=5)),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tracks', to='overview.artist')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AudioFeatures',
+            fields=[
+                ('track', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='features', serialize=False, to='overview.track')),
+                ('danceability', models.FloatField(null=True)),
+                ('energy', models.FloatField(null=True)),
+                ('speechiness', models.FloatField(null=True)),
+                ('acousticness', models.FloatField(null=True)),
+                ('instrumentalness', models.FloatField(null=True)),
+                ('liveness', models.FloatField(null=True)),
+                ('valence', models.FloatField(null=True)),
+                ('loudness', models.FloatField(null=True)),
+                ('tempo', models.FloatField(null=True)),
+                ('tempo_confidence', models.FloatField(null=True)),
+                ('time_signature', models.SmallIntegerField(null=True)),
+                ('time_signature_confidence', models.FloatField(null=True)),
+                ('key', models.SmallIntegerField(null=True)),
+                ('key_confidence', models.FloatField(null=True)),
+                ('mode', models.SmallIntegerField(null=True)),
+                ('mode_confidence', models.FloatField(null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'audio features',
+            },
+        ),
+        migrations.CreateModel(
+            name='Play',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('played_at', models.DateTimeField()),
+                ('context_type', models.CharField(blank=True, max_length=20)),
+                ('context_uri', models.CharField(blank=True, max_length=100)),
+                ('artist', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='plays', to='overview.artist')),
+                ('track', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='plays', to='overview.track')),
+            ],
+            options={
+                'ordering': ['-played_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='play',
+            index=models.Index(fields=['artist', 'played_at'], name='overview_pl_artist__e82ab1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='play',
+            index=models.Index(fields=['track', 'played_at'], name='overview_pl_track_i_726c1a_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='play',
+            constraint=models.UniqueConstraint(fields=('played_at', 'track'), name='unique_play'),
+        ),
+        migrations.AddIndex(
+            model_name='audiofeatures',
+            index=models.Index(fields=['danceability'], name='overview_au_danceab_06c4e2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='audiofeatures',
+            index=models.Index(fields=['energy'], name='overview_au_energy_a661b3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='audiofeatures',
+            index=models.Index(fields=['valence'], name='overview_au_valence_2224b7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='audiofeatures',
+            index=models.Index(fields=['tempo'], name='overview_au_tempo_86ab5f_idx'),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('overview', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyListening',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plays', models.IntegerField()),
+                ('minutes', models.FloatField()),
+                ('tracks', models.IntegerField()),
+                ('artists', models.IntegerField()),
+                ('danceability', models.FloatField(null=True)),
+                ('energy', models.FloatField(null=True)),
+                ('valence', models.FloatField(null=True)),
+                ('tempo', models.FloatField(null=True)),
+                ('day', models.DateField(unique=True)),
+            ],
+            options={
+                'ordering': ['day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('watermark', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WeeklyListening',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plays', models.IntegerField()),
+                ('minutes', models.FloatField()),
+                ('tracks', models.IntegerField()),
+                ('artists', models.IntegerField()),
+                ('danceability', models.FloatField(null=True)),
+                ('energy', models.FloatField(null=True)),
+                ('valence', models.FloatField(null=True)),
+                ('tempo', models.FloatField(null=True)),
+                ('week', models.DateField(unique=True)),
+            ],
+            options={
+                'ordering': ['week'],
+            },
+        ),
+        migrations.CreateModel(
+            name='WeeklyArtistListening',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plays', models.IntegerField()),
+                ('minutes', models.FloatField()),
+                ('week', models.DateField()),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='overview.artist')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyArtistListening',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plays', models.IntegerField()),
+                ('minutes', models.FloatField()),
+                ('day', models.DateField()),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='overview.artist')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='weeklyartistlistening',
+            index=models.Index(fields=['week', '-plays'], name='overview_we_week_dd73e5_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='weeklyartistlistening',
+            constraint=models.UniqueConstraint(fields=('week', 'artist'), name='unique_weekly_artist'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyartistlistening',
+            index=models.Index(fields=['day', '-plays'], name='overview_da_day_375dfd_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyartistlistening',
+            constraint=models.UniqueConstraint(fields=('day', 'artist'), name='unique_daily_artist'),
+        ),
+    ]
@@ -1,3 +1,167 @@
 from django.db import models
 
-# Create your models here.
+
+class Artist(models.Model):
+    """A Spotify artist; looked up by id when ingesting and by name from
+    the dashboard
+    """
+    spotify_id = models.CharField(max_length=22, unique=True)
+    name = models.CharField(max_length=200, db_index=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Track(models.Model):
+    spotify_id = models.CharField(max_length=22, unique=True)
+    name = models.CharField(max_length=300)
+    artist = models.ForeignKey(Artist, on_delete=models.CASCADE,
+                               related_name='tracks')
+    album_name = models.CharField(max_length=300, blank=True)
+    duration_ms = models.IntegerField(null=True)
+    popularity = models.SmallIntegerField(null=True)
+    release_date = models.DateField(null=True)
+    release_date_precision = models.CharField(max_length=5, blank=True)
+
+    def __str__(self):
+        return f'{self.name} - {self.artist}'
+
+
+class AudioFeatures(models.Model):
+    """Audio features and analysis summary of a track (the
+    track_info_df columns)
+    """
+    track = models.OneToOneField(Track, on_delete=models.CASCADE,
+                                 primary_key=True,
+                                 related_name='features')
+    danceability = models.FloatField(null=True)
+    energy = models.FloatField(null=True)
+    speechiness = models.FloatField(null=True)
+    acousticness = models.FloatField(null=True)
+    instrumentalness = models.FloatField(null=True)
+    liveness = models.FloatField(null=True)
+    valence = models.FloatField(null=True)
+    loudness = models.FloatField(null=True)
+    tempo = models.FloatField(null=True)
+    tempo_confidence = models.FloatField(null=True)
+    time_signature = models.SmallIntegerField(null=True)
+    time_signature_confidence = models.FloatField(null=True)
+    key = models.SmallIntegerField(null=True)
+    key_confidence = models.FloatField(null=True)
+    mode = models.SmallIntegerField(null=True)
+    mode_confidence = models.FloatField(null=True)
+
+    class Meta:
+        verbose_name_plural = 'audio features'
+        # the features the dashboard filters and ranks tracks by
+        indexes = [
+            models.Index(fields=['danceability']),
+            models.Index(fields=['energy']),
+            models.Index(fields=['valence']),
+            models.Index(fields=['tempo']),
+        ]
+
+
+class Play(models.Model):
+    """One listen from the recently played history
+
+    artist is copied from the track so per-artist aggregates over a
+    played_at range are served by the (artist, played_at) index without
+    a join.
+    """
+    played_at = models.DateTimeField()
+    # indexed through the composite indexes below
+    track = models.ForeignKey(Track, on_delete=models.CASCADE,
+                              related_name='plays', db_index=False)
+    artist = models.ForeignKey(Artist, on_delete=models.CASCADE,
+                               related_name='plays', db_index=False)
+    context_type = models.CharField(max_length=20, blank=True)
+    context_uri = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        ordering = ['-played_at']
+        constraints = [
+            # also the index for played_at ranges
+            models.UniqueConstraint(fields=['played_at', 'track'],
+                                    name='unique_play'),
+        ]
+        indexes = [
+            models.Index(fields=['artist', 'played_at']),
+            models.Index(fields=['track', 'played_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.played_at:%Y-%m-%d %H:%M} {self.track}'
+
+
+# pre-aggregated listening, kept up to date by overview.rollups.refresh
+# after each ingest. days and weeks are in the dashboard's TIME_ZONE and
+# weeks start on Monday.
+
+class ListeningRollup(models.Model):
+    plays = models.IntegerField()
+    minutes = models.FloatField()
+    tracks = models.IntegerField()
+    artists = models.IntegerField()
+    danceability = models.FloatField(null=True)
+    energy = models.FloatField(null=True)
+    valence = models.FloatField(null=True)
+    tempo = models.FloatField(null=True)
+
+    class Meta:
+        abstract = True
+
+
+class DailyListening(ListeningRollup):
+    day = models.DateField(unique=True)
+
+    class Meta:
+        ordering = ['day']
+
+
+class WeeklyListening(ListeningRollup):
+    week = models.DateField(unique=True)
+
+    class Meta:
+        ordering = ['week']
+
+
+class ArtistRollup(models.Model):
+    artist = models.ForeignKey(Artist, on_delete=models.CASCADE,
+                               related_name='+')
+    plays = models.IntegerField()
+    minutes = models.FloatField()
+
+    class Meta:
+        abstract = True
+
+
+class DailyArtistListening(ArtistRollup):
+    day = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'artist'],
+                                    name='unique_daily_artist'),
+        ]
+        indexes = [models.Index(fields=['day', '-plays'])]
+
+
+class WeeklyArtistListening(ArtistRollup):
+    week = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['week', 'artist'],
+                                    name='unique_weekly_artist'),
+        ]
+        indexes = [models.Index(fields=['week', '-plays'])]
+
+
+class RollupState(models.Model):
+    """Latest played_at included in the rollups, and a counter bumped by
+    every ingest that the view caches are keyed on
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    watermark = models.DateTimeField(null=True)
+    version = models.PositiveIntegerField(default=0)
@@ -0,0 +1,115 @@
+"""Incremental refresh of the listening rollups
+
+Each refresh re-aggregates only the days (and weeks) from the one
+holding the watermark, the latest played_at already rolled up, so its
+cost follows the plays added since the last refresh rather than the
+whole history. Plays ingested with a played_at older than the watermark
+(a backfill) need refresh(full=True).
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Avg, Count, DateField, Max, Sum
+from django.db.models.functions import TruncDate, TruncWeek
+from django.utils import timezone
+
+from .models import (
+    DailyArtistListening, DailyListening, Play, RollupState,
+    WeeklyArtistListening, WeeklyListening,
+)
+
+STATE_NAME = 'listening'
+MS_PER_MINUTE = 60000
+BATCH_SIZE = 5000
+
+# (rollup model, period field, truncation, per-artist rollup model)
+PERIODS = [
+    (DailyListening, 'day', TruncDate, DailyArtistListening),
+    (WeeklyListening, 'week', TruncWeek, WeeklyArtistListening),
+]
+
+
+def _period_start(watermark, period):
+    """Returns the local date of the day or week holding watermark"""
+    day = timezone.localtime(watermark).date()
+    if period == 'week':
+        day -= datetime.timedelta(days=day.weekday())
+    return day
+
+
+def local_midnight(day):
+    """Returns the aware datetime starting the local date day"""
+    return timezone.make_aware(
+        datetime.datetime.combine(day, datetime.time()))
+
+
+def _truncated(trunc, plays):
+    return plays.annotate(period=trunc(
+        'played_at', output_field=DateField(),
+        tzinfo=timezone.get_current_timezone()))
+
+
+def _refresh_period(model, field, trunc, artist_model, start):
+    plays = Play.objects.all()
+    stale = {} if start is None else {f'{field}__gte': start}
+    model.objects.filter(**stale).delete()
+    artist_model.objects.filter(**stale).delete()
+    if start is not None:
+        plays = plays.filter(played_at__gte=local_midnight(start))
+
+    totals = _truncated(trunc, plays).values('period').annotate(
+        n_plays=Count('id'),
+        ms=Sum('track__duration_ms'),
+        n_tracks=Count('track', distinct=True),
+        n_artists=Count('artist', distinct=True),
+        avg_danceability=Avg('track__features__danceability'),
+        avg_energy=Avg('track__features__energy'),
+        avg_valence=Avg('track__features__valence'),
+        avg_tempo=Avg('track__features__tempo'),
+    ).order_by()
+    model.objects.bulk_create((model(**{
+        field: row['period'],
+        'plays': row['n_plays'],
+        'minutes': (row['ms'] or 0) / MS_PER_MINUTE,
+        'tracks': row['n_tracks'],
+        'artists': row['n_artists'],
+        'danceability': row['avg_danceability'],
+        'energy': row['avg_energy'],
+        'valence': row['avg_valence'],
+        'tempo': row['avg_tempo'],
+    }) for row in totals), batch_size=BATCH_SIZE)
+
+    per_artist = _truncated(trunc, plays).values('period', 'artist').annotate(
+        n_plays=Count('id'), ms=Sum('track__duration_ms')).order_by()
+    artist_model.objects.bulk_create((artist_model(**{
+        field: row['period'],
+        'artist_id': row['artist'],
+        'plays': row['n_plays'],
+        'minutes': (row['ms'] or 0) / MS_PER_MINUTE,
+    }) for row in per_artist), batch_size=BATCH_SIZE)
+
+
+@transaction.atomic
+def refresh(full=False):
+    """Brings the rollups up to date with Play. Returns the new
+    watermark (None when there are no plays).
+
+    :full: rebuild every rollup row instead of starting from the
+        watermark
+    """
+    state, _ = RollupState.objects.select_for_update().get_or_create(
+        name=STATE_NAME)
+    latest = Play.objects.aggregate(Max('played_at'))['played_at__max']
+    if not full and state.watermark is not None \
+            and latest == state.watermark:
+        return state.watermark
+
+    for model, field, trunc, artist_model in PERIODS:
+        start = None
+        if not full and state.watermark is not None:
+            start = _period_start(state.watermark, field)
+        _refresh_period(model, field, trunc, artist_model, start)
+
+    state.watermark = latest
+    state.save()
+    return latest
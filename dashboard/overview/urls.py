@@ -3,5 +3,16 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
-        path('', views.i_exist, name='i_exist')
+        path('', views.i_exist, name='i_exist'),
+        path('summary/', views.summary, name='summary'),
+        path('listening/daily/', views.daily_listening,
+             name='daily_listening'),
+        path('artists/top/', views.top_artists, name='top_artists'),
+        path('features/trends/', views.feature_trends,
+             name='feature_trends'),
+        path('graph/layout/', views.graph_layout, name='graph_layout'),
+        path('tracks/similar/', views.similar_tracks, name='similar_tracks'),
+        path('export/plays/', views.export_plays, name='export_plays'),
+        path('export/tracks/', views.export_tracks, name='export_tracks'),
+        path('api/plays/', views.plays_page, name='plays_page'),
 ]
@@ -1,8 +1,204 @@
-from django.shortcuts import render
-from django.http import HttpResponse
+import asyncio
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, JsonResponse,
+    StreamingHttpResponse,
+)
+
+from . import aggregates, export
+from .caching import cached_view
+
+MAX_TOP_ARTISTS = 100
+MAX_PAGE_SIZE = 1000
+MAX_LAYOUT_ARTISTS = 5000
+MAX_SIMILAR_QUERIES = 100
+MAX_SIMILAR_TRACKS = 100
 
 
 def i_exist(request):
     return HttpResponse('Indeed, this view exists')
 
 
+def _date_param(request, name):
+    """Returns the ISO date query parameter name, or None; raises
+    ValueError on a malformed date
+    """
+    value = request.GET.get(name)
+    return datetime.date.fromisoformat(value) if value else None
+
+
+def _count_param(request, name, default, maximum):
+    """Returns the integer query parameter name capped at maximum;
+    raises ValueError unless it is a positive integer
+    """
+    value = int(request.GET.get(name, default))
+    if value < 1:
+        raise ValueError(f'{name} must be at least 1')
+    return min(value, maximum)
+
+
+@cached_view
+def daily_listening(request):
+    """Plays and minutes per day between ?start= and ?end= (ISO dates,
+    end exclusive), read from the daily rollup
+    """
+    try:
+        start = _date_param(request, 'start')
+        end = _date_param(request, 'end')
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return JsonResponse({'days': aggregates.daily_minutes(start, end)})
+
+
+@cached_view
+def top_artists(request):
+    """Most played artists of the week holding ?week= (default the
+    latest week), at most ?limit= of them
+    """
+    try:
+        week = _date_param(request, 'week')
+        limit = _count_param(request, 'limit', 10, MAX_TOP_ARTISTS)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    week, artists = aggregates.top_artists(week, limit)
+    return JsonResponse({'week': week, 'artists': artists})
+
+
+@cached_view
+def feature_trends(request):
+    """Weekly averages of the audio features of played tracks between
+    ?start= and ?end=
+    """
+    try:
+        start = _date_param(request, 'start')
+        end = _date_param(request, 'end')
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return JsonResponse({'weeks': aggregates.feature_trends(start, end)})
+
+
+def _in_thread(func, *args):
+    """Runs func in a worker thread of its own, so several can query at
+    once, closing the thread's connection as a request would
+    """
+    def run():
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)()
+
+
+async def summary(request):
+    """Top artists, daily minutes, feature trends (between ?start= and
+    ?end=) and artist graph stats in one response, queried concurrently
+    """
+    try:
+        start = _date_param(request, 'start')
+        end = _date_param(request, 'end')
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    (week, artists), days, weeks, graph = await asyncio.gather(
+        _in_thread(aggregates.top_artists),
+        _in_thread(aggregates.daily_minutes, start, end),
+        _in_thread(aggregates.feature_trends, start, end),
+        _in_thread(aggregates.graph_stats),
+    )
+    return JsonResponse({
+        'top_artists': {'week': week, 'artists': artists},
+        'days': days,
+        'weeks': weeks,
+        'graph': graph,
+    })
+
+
+def graph_layout(request):
+    """The best connected artists (at most ?limit=) of the precomputed
+    artist graph layout inside ?bbox=x0,y0,x1,y1, with their positions
+    and the edges between them
+    """
+    try:
+        bbox = request.GET.get('bbox')
+        if bbox:
+            bbox = tuple(float(v) for v in bbox.split(','))
+            if len(bbox) != 4:
+                raise ValueError('bbox must be x0,y0,x1,y1')
+        limit = _count_param(request, 'limit', 1000, MAX_LAYOUT_ARTISTS)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    layout = aggregates.graph_layout(bbox or None, limit)
+    if layout is None:
+        return HttpResponseNotFound('the artist graph has not been laid out '
+                                    'yet')
+    return JsonResponse(layout)
+
+
+def similar_tracks(request):
+    """The ?k= tracks most like each ?id= (spotify track id, repeatable)
+    by audio features
+    """
+    track_ids = request.GET.getlist('id')[:MAX_SIMILAR_QUERIES]
+    try:
+        k = _count_param(request, 'k', 10, MAX_SIMILAR_TRACKS)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    if not track_ids:
+        return HttpResponseBadRequest('no track id given')
+    similar = aggregates.similar_tracks(track_ids, k)
+    if similar is None:
+        return HttpResponseNotFound('the track similarity index has not '
+                                    'been built yet')
+    return JsonResponse({'similar': similar})
+
+
+def _stream(rows, fields, request, filename):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return HttpResponseBadRequest(
+            f'format must be one of {", ".join(export.FORMATS)}')
+    lines, content_type = export.FORMATS[fmt]
+    response = StreamingHttpResponse(lines(rows, fields),
+                                     content_type=content_type)
+    response['Content-Disposition'] = \
+        f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+
+def export_plays(request):
+    """Streams the plays between ?start= and ?end= as ?format=csv (the
+    default) or ndjson
+    """
+    try:
+        start = _date_param(request, 'start')
+        end = _date_param(request, 'end')
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    rows = export.iter_rows(export.plays(start, end), export.PLAY_FIELDS)
+    return _stream(rows, export.PLAY_FIELDS, request, 'plays')
+
+
+def export_tracks(request):
+    """Streams every track with its audio features as ?format=csv (the
+    default) or ndjson
+    """
+    rows = export.iter_rows(export.tracks(), export.TRACK_FIELDS)
+    return _stream(rows, export.TRACK_FIELDS, request, 'tracks')
+
+
+@cached_view
+def plays_page(request):
+    """A page of at most ?limit= plays between ?start= and ?end=, oldest
+    first, following the page whose next cursor is ?after=
+    """
+    try:
+        start = _date_param(request, 'start')
+        end = _date_param(request, 'end')
+        limit = _count_param(request, 'limit', 100, MAX_PAGE_SIZE)
+        plays, cursor = export.page_after(
+            export.plays(start, end), request.GET.get('after'), limit)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return JsonResponse({'plays': plays, 'next': cursor})
@@ -1,49 +1,38 @@
 # %%
-import json
-
 import networkx as nx
 import pandas as pd
 import numpy as np
+
+from src.features.edge_list import build_edge_list
 # import matplotlib.pyplot as plt
 # %%
-with open('../data/raw/followed_artists.json') as f:
-    artists = json.load(f)
+# stream the crawl into integer edges plus an artist table; names stay
+# plain data so no escaping is needed
+edges = build_edge_list('../data/raw/followed_artists.jsonl')
+df = edges.artists
 # %%
-artists_dict = {}
-artists_dict['id'] = [i['id'] for i in artists]
-artists_dict['artist'] = [i['name'] for i in artists]
-artists_dict['followers'] = [i['followers']['total'] for i in artists]
-artists_dict['popularity'] = [i['popularity'] for i in artists]
-# artists_dict['image_url'] =  [i['images'][0]['url'] for i in artists]
-artists_dict['related_artist'] = [i['related_artists'] for i in artists]
-# artists_dict['related_id'] = [i['related_ids'] for i in artists]
+# one row per (artist, related artist) pair
+r = edges.to_frame()
 # %%
-df = pd.DataFrame.from_dict(artists_dict)
-# %%
-# "melt" name list into individual rows
-# https://stackoverflow.com/questions/27263805/pandas-column-of-lists-create-a-row-for-each-list-element
+# draw the whole graph from its precomputed layout (cached by graph hash
+# under data/processed/artist_layout) instead of a spring layout of a 500
+# edge sample
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 
-lst_col = 'related_artist'
+from src.features.edge_list import read_records
+from src.features.graph_layout import layout_graph
+from src.features.graph_store import ArtistGraph
 
-r = pd.DataFrame({
-      col:np.repeat(df[col].values, df[lst_col].str.len())
-      for col in df.columns.drop(lst_col)}
-    ).assign(**{lst_col:np.concatenate(df[lst_col].values)})[df.columns]
-# %%
-# temp fix to remove special characters from name (Joey Bada$$ was throwing an error)
-r['artist'] = r['artist'].str.replace('$', 'S')
-r['related_artist'] = r['related_artist'].str.replace('$', 'S')
-# %%
-r.loc[r['related_artist'].str.contains('\$')]
-# %%
-r_graph = r.sample(500)
-G = nx.from_pandas_edgelist(r_graph, 
-                            source='artist',
-                            target='related_artist',
-                            # edge_attr='followers',
-                            create_using=nx.DiGraph())
-# %%
-nx.draw_networkx(G, with_labels=False, node_size=10, width=0.5)
+graph = ArtistGraph.from_records(
+    read_records('../data/raw/followed_artists.jsonl'))
+xy = layout_graph(graph).positions
+sources, targets = graph.edges()
+fig, ax = plt.subplots(figsize=(10, 10))
+ax.add_collection(LineCollection(np.stack([xy[sources], xy[targets]], 1),
+                                 linewidths=0.2, alpha=0.2))
+ax.scatter(xy[:, 0], xy[:, 1], s=2)
+ax.autoscale()
 # %%
 # I think this looks like a Small world network. Check properties to see how well it conforms or not
 
@@ -100,7 +89,7 @@ s
 o = (l_r / l) - (c / c_l)
 o
 # %%
-swi = ((l - l_l) / (l_r - l_l)) / ((c - c_r) / (c_l - c_r))
+swi = ((l - l_l) / (l_r - l_l)) * ((c - c_r) / (c_l - c_r))
 swi
 # %%
 nx.degree_assortativity_coefficient(G)
@@ -1,63 +1,84 @@
-import os
-import requests
+# crawl the related-artist network around the artists I follow
+import asyncio
 import json
+from pathlib import Path
 
-from dotenv import load_dotenv, find_dotenv
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-from spotipy.oauth2 import SpotifyClientCredentials
-
-
-# find .env automagically by walking up directories until it's found
-dotenv_path = find_dotenv()
-# load up the entries as environment variables
-load_dotenv(dotenv_path)
-
-username = 'colinspear1'
-scope = 'user-follow-read'
-client_id = os.environ.get("CLIENT_ID")
-client_secret = os.environ.get("CLIENT_SECRET")
-redirect_uri = os.environ.get("REDIRECT_URI")
-
-
-def instantiate_client(username, client_id, client_secret, redirect_uri, scope):
-    sp = spotipy.Spotify(
-        auth_manager = SpotifyOAuth(
-            client_id = client_id,
-            client_secret = client_secret,
-            redirect_uri = redirect_uri,
-            scope = scope
-            )
-        )
-
-    return sp
-
-def followed_artists():
-    sp = instantiate_client(username, client_id, client_secret, redirect_uri, scope='user-follow-read')
-    artists = []
-    follow = sp.current_user_followed_artists(limit=50, after=None)
-    while len(follow['artists']['items']) > 0:
-        artists = artists + follow['artists']['items']
-        last_artist_id = follow['artists']['items'][-1]['id']
-        follow = sp.current_user_followed_artists(limit=50, after=last_artist_id)
-    
-    return artists
-
-def related_artists():
-    sp = spotipy.Spotify(
-        client_credentials_manager=SpotifyClientCredentials(
-            client_id=client_id,
-            client_secret=client_secret
-        )
-    )
-    artist_list = followed_artists()
-    for i in range(len(artist_list)):
-        related_resp = sp.artist_related_artists(artist_list[i]['uri'])
-        artist_list[i]['related_artists'] = [i['name'] for i in related_resp['artists']]
-        artist_list[i]['related_ids'] = [i['id'] for i in related_resp['artists']]
-
-    return artist_list
-
-
-with open('data/raw/followed_artists.json', 'w') as fp:
-    json.dump(related_artists(), fp, sort_keys=True, indent=4)
+from src.data.paging import iter_items
+from src.data.spotify_client import (
+    AsyncSpotify, instantiate_app_client, instantiate_client, token_provider
+)
+
+project_dir = Path(__file__).resolve().parents[2]
+FOLLOWED_ARTISTS_PATH = project_dir / 'data/raw/followed_artists.jsonl'
+
+
+def followed_artists(sp=None):
+    """Returns the list of artists the current user follows
+
+    :sp: optional spotipy instance authorized for user-follow-read
+    """
+    sp = sp or instantiate_client(scope='user-follow-read')
+    first_page = sp.current_user_followed_artists(limit=50)
+
+    return list(iter_items(sp, first_page, key='artists'))
+
+
+def related_artist_record(artist, related_resp):
+    """Returns the artist dict with the names and ids of its related
+    artists added
+
+    :artist: artist object from the spotify api
+    :related_resp: artist_related_artists response for that artist
+    """
+    record = dict(artist)
+    record['related_artists'] = [i['name'] for i in related_resp['artists']]
+    record['related_ids'] = [i['id'] for i in related_resp['artists']]
+
+    return record
+
+
+async def crawl_related_artists(client, artists, fp):
+    """Fetches the related artists of every artist concurrently and
+    writes each record to fp as a JSON line as soon as it arrives, so
+    records are never all held in memory. Returns the number written.
+
+    :client: open AsyncSpotify
+    :artists: list of artist objects
+    :fp: text file open for writing
+    """
+    async def fetch(artist):
+        related_resp = await client.artist_related_artists(artist['id'])
+        return related_artist_record(artist, related_resp)
+
+    written = 0
+    for next_record in asyncio.as_completed([fetch(a) for a in artists]):
+        fp.write(json.dumps(await next_record, sort_keys=True) + '\n')
+        written += 1
+
+    return written
+
+
+def related_artists(path=FOLLOWED_ARTISTS_PATH, max_concurrency=100):
+    """Crawls the related artists of every followed artist into a JSON
+    Lines file at path. Returns the number of artists written.
+
+    :path: output .jsonl file
+    :max_concurrency: maximum related-artist requests in flight
+    """
+    artists = followed_artists()
+    get_token = token_provider(instantiate_app_client().auth_manager)
+
+    async def crawl(fp):
+        async with AsyncSpotify(get_token,
+                                max_concurrency=max_concurrency) as client:
+            return await crawl_related_artists(client, artists, fp)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as fp:
+        return asyncio.run(crawl(fp))
+
+
+if __name__ == '__main__':
+    n = related_artists()
+    print(f'{n} artists written to {FOLLOWED_ARTISTS_PATH}')
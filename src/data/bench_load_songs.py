@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# synthetic benchmark of the songs loader: row by row inserts as in the
+# create_musicdb notebook against the batched upsert, on a fresh table and
+# again with every song_id already present.
+import tempfile
+import time
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+import load_songs as ls
+
+
+def synthetic_songs(n, seed=0):
+    """Returns a DataFrame of n distinct songs shaped like track_info_df
+    output
+    """
+    rng = np.random.default_rng(seed)
+    floats = {name: rng.random(n).astype('float32')
+              for name, sql_type in ls.SONGS_COLUMNS if sql_type == 'real'}
+    return pd.DataFrame(dict(
+        time_added=pd.Timestamp('2021-01-04', tz='UTC')
+        + pd.to_timedelta(rng.integers(0, 365, n), unit='D'),
+        release_date='2020-01-01',
+        release_date_precision='day',
+        artist_name=[f'Artist {i}' for i in rng.integers(0, 20000, n)],
+        artist_id=[f'artist{i}' for i in rng.integers(0, 20000, n)],
+        song_id=[f'song{i:08d}' for i in range(n)],
+        song_length_ms=rng.integers(90000, 400000, n).astype('int32'),
+        song_name=[f'Song {i}' for i in range(n)],
+        popularity=rng.integers(0, 100, n).astype('int16'),
+        time_signature=rng.integers(3, 6, n).astype('int8'),
+        key=pd.Categorical(rng.integers(0, 12, n), categories=range(12)),
+        mode=pd.Categorical(rng.integers(0, 2, n), categories=[0, 1]),
+        **floats,
+    ))[ls.COLUMNS]
+
+
+def row_by_row(conn, df):
+    """One execute per row, committed at the end, as in the notebook"""
+    sql = 'insert into songs values ({})'.format(
+        ', '.join('?' * len(ls.COLUMNS)))
+    cur = conn.cursor()
+    for row in ls.song_rows(df):
+        cur.execute(sql, row)
+    conn.commit()
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option('--rows', default=1000000, show_default=True)
+@click.option('--baseline-rows', default=100000, show_default=True,
+              help='rows for the row by row baseline')
+@click.option('--postgres', 'dsn', default=None,
+              help='also time load_postgres against this database')
+def main(rows, baseline_rows, dsn):
+    """ Times loading synthetic songs into sqlite (and postgres). """
+    df = synthetic_songs(rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = ls.connect_sqlite(Path(tmp) / 'baseline.sqlite')
+        s = timed(row_by_row, conn, df.iloc[:baseline_rows])
+        print(f'row by row: {baseline_rows} rows in {s:.2f}s '
+              f'({baseline_rows / s:,.0f} rows/s)')
+
+        conn = ls.connect_sqlite(Path(tmp) / 'bulk.sqlite')
+        s = timed(ls.load_sqlite, conn, df)
+        print(f'sqlite bulk insert: {rows} rows in {s:.2f}s '
+              f'({rows / s:,.0f} rows/s)')
+        s = timed(ls.load_sqlite, conn, df)
+        print(f'sqlite bulk upsert: {rows} rows in {s:.2f}s '
+              f'({rows / s:,.0f} rows/s)')
+        assert conn.execute('select count(*) from songs').fetchone()[0] \
+            == rows
+
+    if dsn:
+        conn = ls.connect_postgres(dsn)
+        with conn, conn.cursor() as cur:
+            cur.execute('truncate songs')
+        for label in ('insert', 'upsert'):
+            s = timed(ls.load_postgres, conn, df)
+            print(f'postgres COPY {label}: {rows} rows in {s:.2f}s '
+                  f'({rows / s:,.0f} rows/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# synthetic benchmark of the parquet storage layer against pickle: file
+# size, full load time, and load time of a column projection and of a
+# date range.
+import tempfile
+import time
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+import bench_track_info as btt
+import discover_weekly as dw
+import storage
+
+
+def synthetic_tracks(n, weeks=52, seed=0):
+    """Returns a track_info_df-like frame of n tracks spread over weeks
+    weekly playlists
+    """
+    sp = btt.FakeSpotify()
+    df = dw.track_info_df(sp, btt.synthetic_song_list(n, 0, seed))
+    start = pd.Timestamp('2021-01-04', tz='UTC')
+    offsets = np.sort(np.random.default_rng(seed).integers(0, weeks, len(df)))
+    df['time_added'] = start + pd.to_timedelta(offsets, unit='W')
+    return df
+
+
+def timed(func, *args, repeat=3, **kwargs):
+    """Returns (result, best of repeat seconds)"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+@click.command()
+@click.option('--sizes', default='10000,100000',
+              help='comma separated numbers of tracks')
+def main(sizes):
+    """ Compares pickle and parquet file size and load times on
+        synthetic discover weekly data.
+    """
+    columns = ['song_id', 'time_added', 'danceability']
+    row = '{:>8} {:>8} {:>8} {:>8} {:>8} {:>9} {:>9} {:>9}'
+    print(row.format('tracks', 'pkl MB', 'pq MB', 'pkl s', 'pq s',
+                     'pkl cols', 'pq cols', 'pq month'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in (int(s) for s in sizes.split(',')):
+            # older pickles hold float64 features
+            df = synthetic_tracks(n)
+            legacy = df.astype({c: 'float64' for c in df.columns
+                                if df[c].dtype == 'float32'})
+            pkl = Path(tmp) / f'{n}.pkl'
+            pq_path = Path(tmp) / f'{n}.parquet'
+            legacy.to_pickle(pkl)
+            storage.write_frame(df, pq_path, 'tracks')
+
+            _, pkl_s = timed(pd.read_pickle, pkl)
+            _, pq_s = timed(storage.read_frame, pq_path)
+            _, pkl_cols = timed(lambda: pd.read_pickle(pkl)[columns])
+            _, pq_cols = timed(storage.read_frame, pq_path, columns)
+            month, pq_month = timed(storage.read_frame, pq_path,
+                                    start='2021-06-01', end='2021-07-01')
+            assert len(month) < len(df)
+
+            print(row.format(
+                len(df), f'{pkl.stat().st_size / 1e6:.1f}',
+                f'{pq_path.stat().st_size / 1e6:.1f}', f'{pkl_s:.3f}',
+                f'{pq_s:.3f}', f'{pkl_cols:.3f}', f'{pq_cols:.3f}',
+                f'{pq_month:.3f}',
+            ))
+
+
+if __name__ == '__main__':
+    main()
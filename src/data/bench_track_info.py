@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# synthetic benchmark of the columnar track_info_df against the original
+# dict-of-lists builder. no network: the spotify client is faked.
+import random
+import time
+import tracemalloc
+
+import click
+import pandas as pd
+
+import discover_weekly as dw
+
+
+class FakeSpotify:
+    """Answers audio analysis/features requests from deterministic
+    synthetic data, memoized so that timings measure the builders rather
+    than the fake
+    """
+
+    def __init__(self):
+        self._analysis = {}
+        self._features = {}
+
+    def audio_analysis(self, track_id):
+        if track_id not in self._analysis:
+            self._analysis[track_id] = self._make_analysis(track_id)
+        return self._analysis[track_id]
+
+    def audio_features(self, track_ids):
+        if isinstance(track_ids, str):
+            track_ids = [track_ids]
+        for track_id in track_ids:
+            if track_id not in self._features:
+                self._features[track_id] = self._make_features(track_id)
+        return [self._features[track_id] for track_id in track_ids]
+
+    @staticmethod
+    def _make_analysis(track_id):
+        r = random.Random(track_id)
+        return {'track': dict(
+            loudness=-60 * r.random(),
+            tempo=60 + 140 * r.random(),
+            tempo_confidence=r.random(),
+            time_signature=r.choice([3, 4, 5]),
+            time_signature_confidence=r.random(),
+            key=r.randrange(12),
+            key_confidence=r.random(),
+            mode=r.randrange(2),
+            mode_confidence=r.random(),
+        )}
+
+    @staticmethod
+    def _make_features(track_id):
+        r = random.Random(track_id)
+        return dict(
+            id=track_id,
+            danceability=r.random(),
+            energy=r.random(),
+            speechiness=r.random(),
+            acousticness=r.random(),
+            instrumentalness=r.random(),
+            liveness=r.random(),
+            valence=r.random(),
+        )
+
+
+def synthetic_song_list(n, duplicate_rate=0.2, seed=0):
+    """Returns n playlist items drawn from n * (1 - duplicate_rate)
+    distinct tracks
+    """
+    r = random.Random(seed)
+    distinct = max(1, int(n * (1 - duplicate_rate)))
+    songs = []
+    for _ in range(n):
+        track_id = f'track{r.randrange(distinct):07d}'
+        artist = {'id': f'artist{r.randrange(5000)}', 'name': 'An Artist'}
+        songs.append({
+            'added_at': '2022-02-21T08:00:00Z',
+            'track': {
+                'id': track_id,
+                'name': f'Song {track_id}',
+                'duration_ms': r.randrange(90000, 400000),
+                'popularity': r.randrange(100),
+                'artists': [artist],
+                'album': {
+                    'release_date': '2020-01-01',
+                    'release_date_precision': 'day',
+                    'artists': [artist],
+                },
+            },
+        })
+    return songs
+
+
+def legacy_track_info_df(sp, song_list):
+    """The original dict-of-lists track_info_df, kept for comparison"""
+    song_dict = {name: [] for name, *_ in dw.TRACK_FIELDS}
+    for i, song in enumerate(song_list):
+        if song_list[i]['track']['id'] in song_dict['song_id']:
+            continue
+        track = song_list[i]['track']
+        song_dict['time_added'].append(song_list[i]['added_at'])
+        song_dict['release_date'].append(track['album']['release_date'])
+        song_dict['release_date_precision'].append(
+            track['album']['release_date_precision'])
+        song_dict['artist_name'].append(track['album']['artists'][0]['name'])
+        song_dict['artist_id'].append(track['artists'][0]['id'])
+        song_dict['song_id'].append(track['id'])
+        song_dict['song_length_ms'].append(track['duration_ms'])
+        song_dict['song_name'].append(track['name'])
+        song_dict['popularity'].append(track['popularity'])
+
+        analysis = sp.audio_analysis(track['id'])['track']
+        song_dict['loudness'].append(analysis['loudness'])
+        song_dict['tempo'].append(analysis['tempo'])
+        song_dict['tempo_confidence'].append(analysis['tempo_confidence'])
+        song_dict['time_signature'].append(analysis['time_signature'])
+        song_dict['time_sig_conf'].append(
+            analysis['time_signature_confidence'])
+        song_dict['key_confidence'].append(analysis['key_confidence'])
+        song_dict['mode'].append(analysis.get('mode'))
+        song_dict['key'].append(analysis.get('key'))
+        song_dict['mode_confidence'].append(analysis['mode_confidence'])
+
+        features = sp.audio_features(track['id'])[0]
+        for name in ('danceability', 'energy', 'speechiness', 'acousticness',
+                     'instrumentalness', 'liveness', 'valence'):
+            song_dict[name].append(features[name])
+
+    return pd.DataFrame(song_dict)
+
+
+def measure(func, *args):
+    """Returns (result, seconds, peak traced MB) of func(*args). The
+    timing and the memory trace come from separate runs because tracing
+    slows allocation heavy code down several fold.
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, elapsed, peak / 1e6
+
+
+@click.command()
+@click.option('--sizes', default='1000,10000,50000',
+              help='comma separated numbers of playlist items')
+def main(sizes):
+    """ Times the original and columnar track_info_df builders on
+        synthetic playlists.
+    """
+    sp = FakeSpotify()
+    row = '{:>8} {:>8} {:>8} {:>8} {:>12} {:>12} {:>10} {:>10}'
+    print(row.format('items', 'old s', 'new s', 'speedup', 'old peak MB',
+                     'new peak MB', 'old df MB', 'new df MB'))
+    for n in (int(s) for s in sizes.split(',')):
+        songs = synthetic_song_list(n)
+        # warm the fake so neither builder pays for generating responses
+        legacy_track_info_df(sp, songs[:1])
+        dw.track_info_df(sp, songs)
+
+        old, old_s, old_peak = measure(legacy_track_info_df, sp, songs)
+        new, new_s, new_peak = measure(dw.track_info_df, sp, songs)
+        assert len(old) == len(new)
+        print(row.format(
+            n, f'{old_s:.2f}', f'{new_s:.2f}', f'{old_s / new_s:.1f}x',
+            f'{old_peak:.1f}', f'{new_peak:.1f}',
+            f'{old.memory_usage(deep=True).sum() / 1e6:.1f}',
+            f'{new.memory_usage(deep=True).sum() / 1e6:.1f}',
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# incremental version of build_combined_dw_df from the make_raw_data_full
+# notebook: weekly discover weekly files are ingested once each, and rows
+# are deduped against a sqlite index of row hashes instead of re-reading
+# and re-deduping every week ever downloaded.
+import json
+import logging
+import os
+import sqlite3
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data import storage
+
+project_dir = Path(__file__).resolve().parents[2]
+RAW_DIR = project_dir / 'data/raw'
+COMBINED_DIR = project_dir / 'data/interim/dw_combined'
+COMBINED_PICKLE = RAW_DIR / 'dw_combined.pkl'
+# weekly files are parquet; older weeks may still be pickles
+WEEKLY_GLOBS = ('*discover-weekly.parquet', '*discover-weekly.pkl')
+# popularity can change between weeks, so it is not part of a row's
+# identity (as in the notebook)
+IGNORED_COLUMNS = ['popularity']
+# hashes looked up per sqlite query
+LOOKUP_BATCH = 500
+
+logger = logging.getLogger(__name__)
+
+
+def row_hashes(df):
+    """Returns a uint64 hash of every row over all columns except
+    IGNORED_COLUMNS
+    """
+    cols = df.columns.drop(IGNORED_COLUMNS, errors='ignore')
+    return pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+
+
+class CombinedDiscoverWeekly:
+    """Deduplicated union of the weekly discover weekly files
+
+    Stored in combined_dir as one parquet part per weekly file holding
+    only that week's new rows, a manifest of the weekly files already
+    ingested (by name without suffix, so a week migrated from pickle to
+    parquet is not ingested twice) and a sqlite table of the hash of
+    every stored row, keyed by hash. A new week only looks up and inserts
+    its own hashes; nothing already stored is read or rewritten. Rows
+    are hashed after conforming to the tracks schema, so pickled and
+    parquet weeks hash alike.
+
+    :combined_dir: directory of parts, manifest and hash index
+    """
+
+    def __init__(self, combined_dir=COMBINED_DIR):
+        self.combined_dir = Path(combined_dir)
+        self.parts_dir = self.combined_dir / 'parts'
+        self.manifest_path = self.combined_dir / 'manifest.json'
+        self.index_path = self.combined_dir / 'row_hashes.sqlite'
+
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+        self.conn = sqlite3.connect(str(self.index_path))
+        self.conn.executescript('''
+            create table if not exists row_hashes(
+                hash integer primary key,
+                week text
+            );
+            create index if not exists row_hashes_week
+                on row_hashes(week);
+        ''')
+        self._import_npy()
+
+    def _import_npy(self):
+        """Moves hashes from the .npy index of earlier versions (one
+        row_hashes.npy, or a shard per week under hashes/) into sqlite
+        """
+        paths = sorted((self.combined_dir / 'hashes').glob('*.npy'))
+        legacy = self.combined_dir / 'row_hashes.npy'
+        if legacy.exists():
+            paths.append(legacy)
+        for path in paths:
+            week = None if path == legacy else path.stem
+            self._insert(np.load(path), week)
+        self.conn.commit()
+        for path in paths:
+            path.unlink()
+        if (self.combined_dir / 'hashes').exists():
+            (self.combined_dir / 'hashes').rmdir()
+
+    def close(self):
+        self.conn.close()
+
+    @property
+    def n_rows(self):
+        """Number of rows stored"""
+        return self.conn.execute(
+            'select count(*) from row_hashes').fetchone()[0]
+
+    def _known(self, hashes):
+        """Returns a mask of the hashes already in the index"""
+        # sqlite integers are signed
+        keys = np.asarray(hashes, dtype='uint64').view('int64')
+        found = set()
+        for start in range(0, len(keys), LOOKUP_BATCH):
+            batch = keys[start:start + LOOKUP_BATCH].tolist()
+            found.update(row[0] for row in self.conn.execute(
+                'select hash from row_hashes where hash in ({})'.format(
+                    ', '.join('?' * len(batch))), batch))
+        return np.isin(keys, np.fromiter(found, dtype='int64',
+                                         count=len(found)))
+
+    def _insert(self, hashes, week):
+        keys = np.asarray(hashes, dtype='uint64').view('int64')
+        self.conn.executemany(
+            'insert or ignore into row_hashes(hash, week) values (?, ?)',
+            ((key, week) for key in keys.tolist()))
+
+    def add_week(self, path):
+        """Ingests one weekly file; returns the number of new rows"""
+        path = Path(path)
+        df = storage.conform(storage.read_frame(path), 'tracks')
+        hashes = row_hashes(df)
+        # hashes left by an interrupted run are redone, not trusted
+        self.conn.execute('delete from row_hashes where week = ?',
+                          (path.stem,))
+        first = ~pd.Series(hashes).duplicated().to_numpy()
+        new = first & ~self._known(hashes)
+
+        # write the part before recording its hashes: an interrupted run
+        # rewrites the same part rather than losing rows
+        if new.any():
+            part = self.parts_dir / f'{path.stem}.parquet'
+            storage.write_frame(df[new], part, 'tracks')
+            self._insert(hashes[new], path.stem)
+        self.conn.commit()
+        self.manifest[path.stem] = int(new.sum())
+        return int(new.sum())
+
+    def commit(self):
+        """Saves the manifest; parts and hashes are written as each week
+        is added
+        """
+        tmp = self.manifest_path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=4, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def update(self, raw_dir=RAW_DIR):
+        """Ingests every weekly file in raw_dir not in the manifest.
+        Returns (files ingested, rows added).
+        """
+        # a parquet week replaces a pickle of the same name
+        weeks = {}
+        for pattern in reversed(WEEKLY_GLOBS):
+            for path in Path(raw_dir).glob(pattern):
+                weeks[path.stem] = path
+        paths = [weeks[stem] for stem in sorted(weeks)
+                 if stem not in self.manifest]
+        added = 0
+        for path in paths:
+            n = self.add_week(path)
+            logger.info('%s: %d new rows', path.name, n)
+            added += n
+        if paths:
+            self.commit()
+        return len(paths), added
+
+    def iter_frames(self, columns=None, start=None, end=None):
+        """Yields the combined data one weekly part at a time
+
+        :columns: optional list of columns to read
+        :start: optional inclusive lower bound on time_added
+        :end: optional exclusive upper bound on time_added
+        """
+        for part in sorted(self.parts_dir.glob('*.parquet')):
+            yield storage.read_frame(part, columns, start, end)
+
+    def load(self, columns=None, start=None, end=None):
+        """Returns the combined DataFrame; arguments as in iter_frames"""
+        frames = list(self.iter_frames(columns, start, end))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+
+def load_combined(columns=None, start=None, end=None,
+                  combined_dir=COMBINED_DIR):
+    """Returns the combined discover weekly DataFrame"""
+    return CombinedDiscoverWeekly(combined_dir).load(columns, start, end)
+
+
+@click.command()
+@click.option('--pickle', 'export_pickle', is_flag=True,
+              help='also write ../raw/dw_combined.pkl for the notebooks')
+def main(export_pickle):
+    """ Adds new weekly files from ../raw to the combined discover weekly
+        dataset in ../interim/dw_combined.
+    """
+    combined = CombinedDiscoverWeekly()
+    n_files, n_rows = combined.update()
+    logger.info('ingested %d weekly files, %d new rows, %d rows total',
+                n_files, n_rows, combined.n_rows)
+    if export_pickle:
+        combined.load().to_pickle(COMBINED_PICKLE)
+    combined.close()
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
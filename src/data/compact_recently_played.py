@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# compact the recently played downloads (the old one-pickle-per-poll
+# snapshots and the JSON Lines play log) into one flattened, deduplicated
+# parquet file per month. a manifest records which inputs have been
+# compacted so each run only reads new or grown files.
+import json
+import logging
+import os
+import pickle
+import time
+from pathlib import Path
+
+import click
+import pandas as pd
+
+from src.data import storage
+
+project_dir = Path(__file__).resolve().parents[2]
+# recently_played.data_dir, not imported so readers of the history do
+# not load the spotify client
+data_dir = project_dir / 'data/raw/recently_played'
+HISTORY_DIR = project_dir / 'data/interim/recently_played'
+MANIFEST_NAME = 'manifest.json'
+# a play is the same play if it has the same time and track
+PLAY_KEY = ['played_at', 'track_id']
+COLUMNS = ['played_at', 'track_id', 'track_name', 'artist_id',
+           'artist_name', 'album_id', 'album_name', 'duration_ms',
+           'popularity', 'explicit', 'context_type', 'context_uri']
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_paths(raw_dir=data_dir):
+    """Returns the pickle snapshots and play log files under raw_dir"""
+    raw_dir = Path(raw_dir)
+    return (sorted(raw_dir.glob('*-recently_played.pkl'))
+            + sorted(raw_dir.glob('plays/date=*/plays.jsonl')))
+
+
+def read_items(path):
+    """Returns the play objects of a pickled API response or a play
+    log file
+    """
+    path = Path(path)
+    if path.suffix == '.pkl':
+        with open(path, 'rb') as h:
+            return pickle.load(h)['items']
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def flatten_play(item):
+    """Returns one row of the history table for a play object"""
+    track = item['track']
+    artist = track['artists'][0] if track.get('artists') else {}
+    album = track.get('album') or {}
+    context = item.get('context') or {}
+    return dict(
+        played_at=item['played_at'],
+        track_id=track['id'],
+        track_name=track.get('name'),
+        artist_id=artist.get('id'),
+        artist_name=artist.get('name'),
+        album_id=album.get('id'),
+        album_name=album.get('name'),
+        duration_ms=track.get('duration_ms'),
+        popularity=track.get('popularity'),
+        explicit=track.get('explicit'),
+        context_type=context.get('type'),
+        context_uri=context.get('uri'),
+    )
+
+
+def plays_frame(rows):
+    """Returns flattened play rows as a DataFrame with the dtypes of the
+    plays schema
+    """
+    return storage.conform(pd.DataFrame(rows, columns=COLUMNS), 'plays')
+
+
+def load_manifest(history_dir=HISTORY_DIR):
+    try:
+        with open(Path(history_dir) / MANIFEST_NAME) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest, history_dir=HISTORY_DIR):
+    path = Path(history_dir) / MANIFEST_NAME
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def month_path(month, history_dir=HISTORY_DIR):
+    return Path(history_dir) / f'month={month}' / 'plays.parquet'
+
+
+def compact(raw_dir=data_dir, history_dir=HISTORY_DIR):
+    """Merges snapshots not yet in the manifest into the monthly parquet
+    files. Only the months that received plays are rewritten. Returns
+    (files read, new plays).
+    """
+    history_dir = Path(history_dir)
+    history_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(history_dir)
+
+    # play log files are appended to during their day, so a file is
+    # read again whenever its size has changed
+    new = {}
+    for path in snapshot_paths(raw_dir):
+        key = str(path.relative_to(raw_dir))
+        size = path.stat().st_size
+        if manifest.get(key) != size:
+            new[key] = (path, size)
+    if not new:
+        return 0, 0
+
+    rows = [flatten_play(item) for path, _ in new.values()
+            for item in read_items(path)]
+    added = 0
+    if rows:
+        df = plays_frame(rows)
+        months = df['played_at'].dt.strftime('%Y-%m')
+        for month, part in df.groupby(months):
+            path = month_path(month, history_dir)
+            if path.exists():
+                old = storage.read_frame(path)
+                before = len(old)
+                part = pd.concat([old, part], ignore_index=True)
+            else:
+                before = 0
+            part = (part.drop_duplicates(PLAY_KEY)
+                        .sort_values('played_at', ignore_index=True))
+            added += len(part) - before
+            storage.write_frame(part, path, 'plays')
+
+    # the manifest is only updated once every partition is written, so
+    # an interrupted run compacts the same inputs again
+    manifest.update({key: size for key, (_, size) in new.items()})
+    save_manifest(manifest, history_dir)
+    return len(new), added
+
+
+def load_history(columns=None, start=None, end=None,
+                 history_dir=HISTORY_DIR):
+    """Returns the compacted listening history. Months entirely outside
+    [start, end) are not opened.
+
+    :columns: optional list of columns to read
+    :start: optional inclusive lower bound on played_at
+    :end: optional exclusive upper bound on played_at
+    """
+    first = pd.Timestamp(start).strftime('%Y-%m') if start else ''
+    last = pd.Timestamp(end).strftime('%Y-%m') if end else '9999-99'
+    paths = [p for p in sorted(Path(history_dir).glob('month=*/plays.parquet'))
+             if first <= p.parent.name[len('month='):] <= last]
+    if not paths:
+        return plays_frame([])[columns or COLUMNS]
+    return pd.concat([storage.read_frame(p, columns, start, end)
+                      for p in paths], ignore_index=True)
+
+
+def scan_report(raw_dir=data_dir, history_dir=HISTORY_DIR):
+    """Times a full history read from the raw snapshots against a read
+    of the compacted store. Returns a dict of seconds and row counts.
+    """
+    start = time.perf_counter()
+    raw = [flatten_play(item) for path in snapshot_paths(raw_dir)
+           for item in read_items(path)]
+    raw_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    history = load_history(history_dir=history_dir)
+    compacted_seconds = time.perf_counter() - start
+
+    return dict(raw_rows=len(raw), raw_seconds=raw_seconds,
+                compacted_rows=len(history),
+                compacted_seconds=compacted_seconds,
+                speedup=raw_seconds / max(compacted_seconds, 1e-9))
+
+
+@click.command()
+@click.option('--report', is_flag=True,
+              help='time a full scan of the raw files against the '
+                   'compacted store')
+def main(report):
+    """ Compacts ../raw/recently_played into monthly parquet files in
+        ../interim/recently_played.
+    """
+    n_files, n_plays = compact()
+    logger.info('compacted %d new files, %d new plays', n_files, n_plays)
+    if report:
+        r = scan_report()
+        logger.info('raw scan: %(raw_rows)d rows in %(raw_seconds).3fs, '
+                    'compacted scan: %(compacted_rows)d rows in '
+                    '%(compacted_seconds).3fs (%(speedup).1fx faster)', r)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
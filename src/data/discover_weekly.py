@@ -2,90 +2,334 @@
 # and save to disk
 
 # import required modules
-import sys
+import collections
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
+from spotipy.exceptions import SpotifyException
 
-def track_info_df(sp, song_list):
+from src.data.paging import iter_items
+from src.data.spotify_client import (
+    instantiate_client, run_concurrently, token_provider
+)
+from src.data.track_fields import CATEGORIES, TRACK_FIELDS
+
+# the audio-features endpoint accepts up to 100 ids per request
+AUDIO_FEATURES_BATCH_SIZE = 100
+# audio analysis is one track per request, so fan it out over a pool
+ANALYSIS_WORKERS = 8
+# requests queued per worker; bounds the pending futures on long lists
+ANALYSIS_QUEUE_PER_WORKER = 4
+MAX_RETRIES = 5
+# playlist ids resolved on earlier runs, keyed by '<username>/<name>'
+PLAYLIST_IDS_PATH = (Path(__file__).resolve().parents[2]
+                     / 'data/interim/playlist_ids.json')
+
+
+def chunked(seq, size):
+    """Yields successive slices of seq of length size
+
+    :seq: list to slice
+    :size: maximum length of each slice
+    """
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+
+class RetryAfterGate:
+    """Shared back-off for a pool of workers hitting the same API.
+
+    When any worker receives a 429 every worker waits out the
+    Retry-After period before sending its next request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def wait(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def block(self, seconds):
+        with self._lock:
+            self._resume_at = max(self._resume_at,
+                                  time.monotonic() + seconds)
+
+
+def call_with_retry(func, *args, gate=None, max_retries=MAX_RETRIES):
+    """Calls a spotipy method, retrying rate limited (429) requests
+    after the period given in the Retry-After header
+
+    :func: bound spotipy method
+    :gate: optional RetryAfterGate shared between workers
+    :max_retries: number of retries before the error is raised
+    """
+    gate = gate or RetryAfterGate()
+    for attempt in range(max_retries + 1):
+        gate.wait()
+        try:
+            return func(*args)
+        except SpotifyException as e:
+            if e.http_status != 429 or attempt == max_retries:
+                raise
+            headers = e.headers or {}
+            gate.block(float(headers.get('Retry-After', 2 ** attempt)))
+
+
+def fetch_audio_features(sp, track_ids, batch_size=AUDIO_FEATURES_BATCH_SIZE,
+                         cache=None):
+    """Returns a dict of track id -> audio features, requesting
+    batch_size ids per call
+
+    :sp: spotipy instantiation
+    :track_ids: list of unique track ids
+    :cache: optional TrackCache consulted before the network
+    """
+    features = cache.get_many('features', track_ids) if cache else {}
+    missing = [i for i in track_ids if i not in features]
+
+    fetched = {}
+    for batch in chunked(missing, batch_size):
+        response = call_with_retry(sp.audio_features, batch)
+        fetched.update(zip(batch, response))
+
+    if cache:
+        cache.put_many('features', fetched)
+    features.update(fetched)
+
+    return features
+
+
+def bounded_map(pool, func, items, window):
+    """Like pool.map, but with at most window calls submitted at a time,
+    so memory doesn't grow with the number of items
+    """
+    pending = collections.deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(pool.submit(func, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+async def _analysis_summary(client, track_id):
+    return (await client.audio_analysis(track_id))['track']
+
+
+def fetch_audio_analysis(sp, track_ids, max_workers=ANALYSIS_WORKERS,
+                         cache=None, use_async=False):
+    """Returns a dict of track id -> the 'track' section of its audio
+    analysis, fetched by a bounded pool of worker threads or, with
+    use_async, by the shared AsyncSpotify client
+
+    Only the track level summary is kept; the segment, beat and tatum
+    arrays are large and never used downstream.
+
+    :sp: spotipy instantiation
+    :track_ids: list of unique track ids
+    :max_workers: maximum number of requests in flight; with use_async
+        this can be in the hundreds
+    :cache: optional TrackCache consulted before the network
+    :use_async: fetch over one pooled asyncio connection
+    """
+    analyses = cache.get_many('analysis', track_ids) if cache else {}
+    missing = [i for i in track_ids if i not in analyses]
+
+    if use_async:
+        summaries = run_concurrently(token_provider(sp.auth_manager),
+                                     _analysis_summary, missing,
+                                     max_concurrency=max_workers)
+        fetched = dict(zip(missing, summaries))
+    else:
+        gate = RetryAfterGate()
+
+        def fetch(track_id):
+            return call_with_retry(sp.audio_analysis, track_id,
+                                   gate=gate)['track']
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            fetched = dict(zip(missing, bounded_map(
+                pool, fetch, missing,
+                max_workers * ANALYSIS_QUEUE_PER_WORKER)))
+
+    if cache:
+        cache.put_many('analysis', fetched)
+    analyses.update(fetched)
+
+    return analyses
+
+
+# nullable integer dtypes, as unavailable tracks come back with fields
+# missing
+NULLABLE_INTS = dict(int32='Int32', int16='Int16', int8='Int8')
+
+
+def extract(response, path, default=None):
+    """Follows a path of keys and list indices into a json response,
+    returning default if any step is missing
+    """
+    for step in path:
+        try:
+            response = response[step]
+        except (KeyError, IndexError, TypeError):
+            return default
+    return response
+
+
+def build_track_columns(sources):
+    """Builds a dict of column name -> typed array using TRACK_FIELDS
+
+    :sources: dict of source name ('item', 'analysis', 'features') ->
+        list of responses, aligned so that index i is the same track in
+        every list
+    """
+    n = len(sources['item'])
+    columns = {}
+    for name, source, path, dtype in TRACK_FIELDS:
+        values = (extract(response, path) for response in sources[source])
+        if dtype == 'datetime':
+            column = pd.to_datetime(np.fromiter(values, object, n), utc=True)
+        elif dtype == 'category':
+            codes = np.fromiter((np.nan if v is None else v for v in values),
+                                'float64', n)
+            unknown = ~np.isin(codes, CATEGORIES[name]) & ~np.isnan(codes)
+            if unknown.any():
+                raise ValueError(f'unexpected {name} values '
+                                 f'{sorted(set(codes[unknown]))}')
+            column = pd.Categorical(codes, categories=CATEGORIES[name])
+        elif dtype == 'float32':
+            column = np.fromiter(
+                (np.nan if v is None else v for v in values), dtype, n)
+        elif dtype in NULLABLE_INTS:
+            column = pd.array(np.fromiter(
+                (np.nan if v is None else v for v in values), 'float64', n),
+                dtype=NULLABLE_INTS[dtype])
+        else:
+            column = np.fromiter(values, dtype, n)
+        columns[name] = column
+
+    return columns
+
+
+def track_info_df(sp, song_list, max_workers=ANALYSIS_WORKERS, cache=None,
+                  use_async=False):
     """
     Takes a list of dictionaries returned from spotipy json
     responses and creates a pandas data frame of its
     characteristics
 
+    Duplicate tracks are dropped (keeping the first occurrence), audio
+    features are requested in batches of 100 tracks and audio analyses
+    concurrently by max_workers threads. Audio features are float32,
+    key and mode categorical and time_added a UTC datetime.
+
     :sp: spotipy instantiation
-    :song_list: list of dictionaries of track characteristics
+    :song_list: iterable of dictionaries of track characteristics
+    :max_workers: maximum number of audio analysis requests in flight
+    :cache: optional TrackCache of previously fetched responses
+    :use_async: fetch audio analyses with the shared AsyncSpotify client
     """
-    # initiate song dictionary
-    song_dict = dict(
-        time_added=[],
-        release_date=[],
-        release_date_precision=[],
-        artist_name=[],
-        artist_id=[],
-        song_id=[],
-        song_length_ms=[],
-        song_name=[],
-        popularity=[],
-        loudness = [],
-        tempo = [],
-        tempo_confidence = [],
-        time_signature = [],
-        time_sig_conf = [],
-        key = [],
-        key_confidence = [],
-        mode = [],
-        mode_confidence = [],
-        danceability = [],
-        energy = [],
-        speechiness = [],
-        acousticness = [],
-        instrumentalness = [],
-        liveness = [],
-        valence = [],
+    # keep the first occurrence of each track
+    unique_songs = {}
+    for song in song_list:
+        unique_songs.setdefault(song['track']['id'], song)
+    track_ids = list(unique_songs)
+
+    analyses = fetch_audio_analysis(sp, track_ids, max_workers=max_workers,
+                                    cache=cache, use_async=use_async)
+    features = fetch_audio_features(sp, track_ids, cache=cache)
+
+    sources = dict(
+        item=list(unique_songs.values()),
+        analysis=[analyses[track_id] for track_id in track_ids],
+        features=[features[track_id] for track_id in track_ids],
     )
 
-    # collect saved track data
-    for i, song in enumerate(song_list):
-        if song_list[i]['track']['id'] in song_dict['song_id']:
-            continue
-        else:
-            song_dict['time_added'].append(song_list[i]['added_at'])
-            song_dict['release_date'].append(song_list[i]['track']['album']['release_date'])
-            song_dict['release_date_precision'].append(song_list[i]['track']['album']['release_date_precision'])
-            song_dict['artist_name'].append(song_list[i]['track']['album']['artists'][0]['name'])
-            song_dict['artist_id'].append(song_list[i]['track']['artists'][0]['id'])
-            song_dict['song_id'].append(song_list[i]['track']['id'])
-            song_dict['song_length_ms'].append(song_list[i]['track']['duration_ms'])
-            song_dict['song_name'].append(song_list[i]['track']['name'])
-            song_dict['popularity'].append(song_list[i]['track']['popularity'])
-
-            audio_analysis = sp.audio_analysis(song_list[i]['track']['id'])
-            song_dict['loudness'].append(audio_analysis['track']['loudness'])
-            song_dict['tempo'].append(audio_analysis['track']['tempo'])
-            song_dict['tempo_confidence'].append(audio_analysis['track']['tempo_confidence'])
-            song_dict['time_signature'].append(audio_analysis['track']['time_signature'])
-            song_dict['time_sig_conf'].append(audio_analysis['track']['time_signature_confidence'])
-            song_dict['key_confidence'].append(audio_analysis['track']['key_confidence'])
-            try:
-                song_dict['mode'].append(audio_analysis['track']['mode'])
-                song_dict['key'].append(audio_analysis['track']['key'])
-            except KeyError:
-                song_dict['mode'].append(None)
-                song_dict['key'].append(None)
-            song_dict['mode_confidence'].append(audio_analysis['track']['mode_confidence'])
-
-            audio_features = sp.audio_features(song_list[i]['track']['id'])
-            song_dict['danceability'].append(audio_features[0]['danceability'])
-            song_dict['energy'].append(audio_features[0]['energy'])
-            song_dict['speechiness'].append(audio_features[0]['speechiness'])
-            song_dict['acousticness'].append(audio_features[0]['acousticness'])
-            song_dict['instrumentalness'].append(audio_features[0]['instrumentalness'])
-            song_dict['liveness'].append(audio_features[0]['liveness'])
-            song_dict['valence'].append(audio_features[0]['valence'])
-
-    return pd.DataFrame(song_dict)
+    return pd.DataFrame(build_track_columns(sources))
+
+
+def load_playlist_ids(path=PLAYLIST_IDS_PATH):
+    """Returns the dict of '<username>/<playlist name>' -> playlist id
+    resolved on earlier runs
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_playlist_ids(playlist_ids, path=PLAYLIST_IDS_PATH):
+    """Atomically writes the resolved playlist ids"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(playlist_ids, f, sort_keys=True, indent=4)
+    os.replace(tmp_path, path)
+
+
+def find_playlist_id(sp, username, name):
+    """Returns the id of the first of the user's playlists called name,
+    or None. Pages are requested only until the playlist is found.
+
+    :sp: authorized spotipy instance
+    :username: spotify username
+    :name: playlist name
+    """
+    first_page = sp.user_playlists(username, limit=50)
+    for playlist in iter_items(sp, first_page):
+        if playlist['name'] == name:
+            return playlist['id']
+
+    return None
+
+
+def iter_playlist_tracks(sp, username, name='Discover Weekly',
+                         ids_path=PLAYLIST_IDS_PATH):
+    """Yields every item of the user's playlist called name, fetching
+    pages of tracks lazily
+
+    The playlist id is remembered in ids_path so later runs skip the
+    playlist search; a remembered id that no longer resolves is looked
+    up again.
+
+    :sp: authorized spotipy instance
+    :username: spotify username
+    :name: playlist name
+    :ids_path: json file of previously resolved playlist ids
+    """
+    playlist_ids = load_playlist_ids(ids_path)
+    key = f'{username}/{name}'
+
+    first_page = None
+    if key in playlist_ids:
+        try:
+            first_page = sp.user_playlist_tracks(
+                username, playlist_id=playlist_ids[key])
+        except SpotifyException as e:
+            if e.http_status != 404:
+                raise
+
+    if first_page is None:
+        playlist_id = find_playlist_id(sp, username, name)
+        if playlist_id is None:
+            return
+        playlist_ids[key] = playlist_id
+        save_playlist_ids(playlist_ids, ids_path)
+        first_page = sp.user_playlist_tracks(username, playlist_id=playlist_id)
+
+    yield from iter_items(sp, first_page)
+
 
 def discover_weekly_track_list(sp, username):
     """Returns list of Discover Weekly song
@@ -94,40 +338,20 @@ def discover_weekly_track_list(sp, username):
     :sp: authorized spotipy instance
     :username: spotify username
     """
-    offset = 0
-    playlists = []
-    dw_tracks = []
-    while offset < 100:
-        playlists.append(sp.user_playlists(username, offset=offset))
-        offset += 50
-
-    for i in playlists:
-        for pl in i['items']:
-            name = pl['name']
-            if name == 'Discover Weekly':
-                playlist_id = pl['id']
-                dw_tracks = sp.user_playlist_tracks(username, playlist_id=playlist_id)
-            else:
-                continue
-
-    return dw_tracks['items']
-
-def collect_and_append_new_dw(username, client_id, client_secret, 
-            redirect_uri, scope):
+    return list(iter_playlist_tracks(sp, username, 'Discover Weekly'))
+
+
+def collect_and_append_new_dw(username, client_id, client_secret,
+                              redirect_uri, scope, cache=None):
     """Collects current Discover Weekly track information
     and appends to previously existing track info
+
+    :cache: optional TrackCache of previously fetched responses
     """
 
-    sp = spotipy.Spotify(
-        auth_manager = SpotifyOAuth(
-            client_id = client_id,
-            client_secret = client_secret,
-            redirect_uri = redirect_uri,
-            scope = scope
-            )
-        )
-
-    current_tracks = discover_weekly_track_list(sp, username)
-    current_tracks_df = track_info_df(sp, current_tracks)
+    sp = instantiate_client(scope, client_id, client_secret, redirect_uri)
+
+    current_tracks = iter_playlist_tracks(sp, username, 'Discover Weekly')
+    current_tracks_df = track_info_df(sp, current_tracks, cache=cache)
 
     return current_tracks_df
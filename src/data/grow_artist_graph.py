@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# grow the related-artist graph breadth first from a set of seed artists.
+# the visited set and frontier live in sqlite so an interrupted crawl
+# resumes where it stopped without refetching anything.
+import asyncio
+import json
+import logging
+import sqlite3
+from pathlib import Path
+
+import click
+
+from src.data.artist_networks import followed_artists, related_artist_record
+from src.data.spotify_client import (
+    AsyncSpotify, instantiate_app_client, token_provider
+)
+from src.features.edge_list import read_records
+from src.features.incremental_metrics import IncrementalGraphMetrics
+
+project_dir = Path(__file__).resolve().parents[2]
+STATE_PATH = project_dir / 'data/interim/artist_graph_crawl.sqlite'
+OUTPUT_PATH = project_dir / 'data/raw/artist_graph.jsonl'
+METRICS_PATH = project_dir / 'data/interim/artist_graph_metrics.jsonl'
+# artists fetched between checkpoints
+BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+class ArtistGraphGrower:
+    """Breadth first crawl of the related-artist graph
+
+    Every discovered artist is stored with its depth (hops from the
+    seeds) and whether its related artists have been fetched. The
+    related artists of every fetched artist are stored, even beyond
+    max_depth, so a finished crawl rerun with a larger max_depth carries
+    on from its deepest layer. Artists are fetched layer by layer, up to
+    batch_size at a time concurrently, and each fetched artist is
+    appended to output_path as a JSON line in the format written by
+    artist_networks. After each batch the output file offset and the
+    fetched flags are committed together; on restart anything written
+    after the last commit is truncated and refetched.
+
+    :state_path: sqlite file holding the visited set and frontier
+    :output_path: JSON Lines file the crawl records are appended to
+    :max_depth: deepest layer whose related artists are fetched
+    :max_nodes: stop discovering artists once this many are known
+    :batch_size: artists fetched concurrently between checkpoints
+    """
+
+    def __init__(self, state_path=STATE_PATH, output_path=OUTPUT_PATH,
+                 max_depth=3, max_nodes=100000, batch_size=BATCH_SIZE):
+        self.state_path = Path(state_path)
+        self.output_path = Path(output_path)
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.batch_size = batch_size
+
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.state_path))
+        self.conn.executescript('''
+            create table if not exists artists(
+                id text primary key,
+                depth integer,
+                fetched integer default 0,
+                artist text
+            );
+            create index if not exists artists_frontier
+                on artists(fetched, depth);
+            create table if not exists meta(
+                key text primary key,
+                value text
+            );
+        ''')
+        self.conn.commit()
+        self.visited = {row[0] for row in
+                        self.conn.execute('select id from artists')}
+
+    def close(self):
+        self.conn.close()
+
+    def seed(self, artists):
+        """Adds artist objects to the frontier at depth 0, ignoring any
+        that are already known
+        """
+        self._discover(artists, depth=0)
+        self.conn.commit()
+
+    def stats(self):
+        """Returns counts of known, fetched and pending artists"""
+        known, fetched = self.conn.execute(
+            'select count(*), coalesce(sum(fetched), 0) from artists'
+        ).fetchone()
+        pending = self.conn.execute(
+            'select count(*) from artists where fetched = 0 and depth <= ?',
+            (self.max_depth,)
+        ).fetchone()[0]
+        return dict(known=known, fetched=fetched, pending=pending)
+
+    def _discover(self, artists, depth):
+        new = []
+        for artist in artists:
+            if len(self.visited) >= self.max_nodes:
+                break
+            if artist['id'] not in self.visited:
+                self.visited.add(artist['id'])
+                new.append((artist['id'], depth, json.dumps(artist)))
+        self.conn.executemany(
+            'insert or ignore into artists(id, depth, artist) '
+            'values (?, ?, ?)',
+            new
+        )
+
+    def _frontier_batch(self):
+        """Returns up to batch_size unfetched artists, all from the
+        shallowest unfinished layer
+        """
+        return self.conn.execute(
+            'select id, depth, artist from artists '
+            'where fetched = 0 and depth <= ? and depth = '
+            '(select min(depth) from artists where fetched = 0) '
+            'order by rowid limit ?',
+            (self.max_depth, self.batch_size)
+        ).fetchall()
+
+    def _committed_offset(self):
+        row = self.conn.execute(
+            "select value from meta where key = 'output_offset'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _restore_output(self):
+        """Drops records written after the last checkpoint"""
+        offset = self._committed_offset()
+        if not self.output_path.exists():
+            self.output_path.touch()
+        if self.output_path.stat().st_size > offset:
+            logger.info('truncating %s to last checkpoint', self.output_path)
+            with open(self.output_path, 'r+b') as fp:
+                fp.truncate(offset)
+
+    def _store_neighbours(self):
+        """Discovers the related artists of fetched artists from the
+        output, once, for crawl state written before neighbours beyond
+        max_depth were stored. Such artists only have an id and a name.
+        """
+        done = self.conn.execute(
+            "select 1 from meta where key = 'neighbours_stored'").fetchone()
+        if done:
+            return
+        depths = dict(self.conn.execute(
+            'select id, depth from artists where fetched = 1'))
+        # records are in crawl order, so each artist gets its
+        # shallowest depth
+        for record in read_records(self.output_path):
+            depth = depths.get(record['id'])
+            if depth is not None:
+                self._discover(
+                    [dict(id=i, name=name) for i, name in zip(
+                        record['related_ids'], record['related_artists'])],
+                    depth + 1)
+        self.conn.execute(
+            "insert into meta values ('neighbours_stored', '1')")
+        self.conn.commit()
+
+    async def grow(self, client, on_batch=None):
+        """Fetches the frontier until it is empty or beyond max_depth.
+        Returns the number of artists fetched by this call.
+
+        :client: open AsyncSpotify
+        :on_batch: optional function called with each batch's list of
+            records and its depth after it has been checkpointed
+        """
+        self._restore_output()
+        self._store_neighbours()
+        fetched = 0
+        with open(self.output_path, 'a') as out:
+            while True:
+                batch = self._frontier_batch()
+                if not batch:
+                    break
+
+                responses = await client.map(client.artist_related_artists,
+                                             [row[0] for row in batch])
+
+                records = []
+                for (artist_id, depth, artist), related_resp in zip(
+                        batch, responses):
+                    record = related_artist_record(json.loads(artist),
+                                                   related_resp)
+                    out.write(json.dumps(record, sort_keys=True) + '\n')
+                    records.append(record)
+                    self._discover(related_resp['artists'], depth + 1)
+                out.flush()
+
+                self.conn.executemany(
+                    'update artists set fetched = 1 where id = ?',
+                    [(row[0],) for row in batch]
+                )
+                self.conn.execute(
+                    "insert or replace into meta values ('output_offset', ?)",
+                    (str(out.tell()),)
+                )
+                self.conn.commit()
+
+                fetched += len(batch)
+                logger.info('fetched %d artists (depth %d), %s', fetched,
+                            batch[-1][1], self.stats())
+                if on_batch is not None:
+                    on_batch(records, batch[-1][1])
+
+        return fetched
+
+
+@click.command()
+@click.option('--seed', 'seeds', multiple=True,
+              help='spotify artist id to start from (repeatable)')
+@click.option('--followed', is_flag=True,
+              help='seed with the artists the current user follows')
+@click.option('--max-depth', default=3, show_default=True)
+@click.option('--max-nodes', default=100000, show_default=True)
+@click.option('--max-concurrency', default=100, show_default=True)
+def main(seeds, followed, max_depth, max_nodes, max_concurrency):
+    """ Grows the related-artist graph breadth first, resuming any
+        interrupted crawl.
+    """
+    grower = ArtistGraphGrower(max_depth=max_depth, max_nodes=max_nodes)
+    get_token = token_provider(instantiate_app_client().auth_manager)
+
+    # metrics are updated per batch and written once per completed layer
+    metrics = IncrementalGraphMetrics()
+    if OUTPUT_PATH.exists():
+        metrics.add_records(read_records(OUTPUT_PATH))
+    layer = dict(depth=None)
+
+    def write_snapshot():
+        snapshot = dict(depth=layer['depth'], **metrics.snapshot())
+        logger.info('layer %(depth)s: %(nodes)d nodes, %(edges)d edges, '
+                    'clustering %(average_clustering).4f', snapshot)
+        with open(METRICS_PATH, 'a') as f:
+            f.write(json.dumps(snapshot) + '\n')
+
+    def on_batch(records, depth):
+        if layer['depth'] is not None and depth != layer['depth']:
+            write_snapshot()
+        layer['depth'] = depth
+        metrics.add_records(records)
+
+    async def crawl():
+        async with AsyncSpotify(get_token,
+                                max_concurrency=max_concurrency) as client:
+            seed_artists = followed_artists() if followed else []
+            for start in range(0, len(seeds), 50):
+                seed_artists += await client.artists(
+                    list(seeds[start:start + 50]))
+            grower.seed(seed_artists)
+            return await grower.grow(client, on_batch=on_batch)
+
+    try:
+        n = asyncio.run(crawl())
+    finally:
+        grower.close()
+    if layer['depth'] is not None:
+        write_snapshot()
+    logger.info('crawl finished, %d artists fetched this run', n)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
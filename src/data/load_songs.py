@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# bulk load track_info_df output into the songs table defined in the
+# create_musicdb notebook. sqlite gets batched executemany upserts and
+# postgres COPY into a staging table followed by one upsert per batch,
+# all inside a single transaction either way.
+import io
+import logging
+import os
+import sqlite3
+from pathlib import Path
+
+import click
+import pandas as pd
+from dotenv import find_dotenv, load_dotenv
+
+from src.data.combine_discover_weekly import CombinedDiscoverWeekly
+
+project_dir = Path(__file__).resolve().parents[2]
+SQLITE_PATH = project_dir / 'data/processed/music.sqlite'
+BATCH_SIZE = 50000
+
+# column name and sql type, in the order of the notebook's table (the
+# same names and order as TRACK_FIELDS)
+SONGS_COLUMNS = [
+    ('time_added', 'timestamp'),
+    ('release_date', 'date'),
+    ('release_date_precision', 'varchar'),
+    ('artist_name', 'varchar'),
+    ('artist_id', 'varchar'),
+    ('song_id', 'varchar PRIMARY KEY'),
+    ('song_length_ms', 'integer'),
+    ('song_name', 'varchar'),
+    ('popularity', 'integer'),
+    ('loudness', 'real'),
+    ('tempo', 'real'),
+    ('tempo_confidence', 'real'),
+    ('time_signature', 'integer'),
+    ('time_sig_conf', 'real'),
+    ('key', 'integer'),
+    ('key_confidence', 'real'),
+    ('mode', 'integer'),
+    ('mode_confidence', 'real'),
+    ('danceability', 'real'),
+    ('energy', 'real'),
+    ('speechiness', 'real'),
+    ('acousticness', 'real'),
+    ('instrumentalness', 'real'),
+    ('liveness', 'real'),
+    ('valence', 'real'),
+]
+COLUMNS = [name for name, _ in SONGS_COLUMNS]
+
+CREATE_SONGS = 'create table if not exists songs(\n{}\n)'.format(
+    ',\n'.join(f'    {name} {sql_type}' for name, sql_type in SONGS_COLUMNS))
+# a repeated song_id replaces the stored row, like the popularity updates
+# of a later week
+UPSERT = ('insert into songs({cols}) {source} '
+          'on conflict (song_id) do update set {updates}').format(
+    cols=', '.join(COLUMNS),
+    source='{source}',
+    updates=', '.join(f'{c} = excluded.{c}' for c in COLUMNS
+                      if c != 'song_id'),
+)
+
+logger = logging.getLogger(__name__)
+
+
+def iter_batches(source, batch_size=BATCH_SIZE):
+    """Yields DataFrames of at most batch_size rows
+
+    :source: a DataFrame or an iterable of DataFrames (e.g. the weekly
+        parts of the combined dataset)
+    """
+    frames = [source] if isinstance(source, pd.DataFrame) else source
+    for df in frames:
+        for start in range(0, len(df), batch_size):
+            yield df.iloc[start:start + batch_size]
+
+
+def _format_dates(column, fmt, **to_datetime_kwargs):
+    """Returns column's dates as strings (None when missing), parsing and
+    formatting each distinct value once; weeks of tracks share a handful
+    of time_added values
+    """
+    codes, uniques = pd.factorize(column)
+    formatted = pd.to_datetime(pd.Series(uniques), **to_datetime_kwargs)
+    formatted = formatted.dt.strftime(fmt).to_numpy(dtype=object)
+    formatted[pd.isna(formatted)] = None
+    values = formatted[codes] if len(formatted) else codes.astype(object)
+    values[codes == -1] = None
+    return values.tolist()
+
+
+def song_rows(df):
+    """Returns the rows of a track DataFrame as tuples of plain python
+    values in COLUMNS order. Later rows win over earlier rows with the
+    same song_id. Timestamps become naive UTC strings, as the notebook
+    stored them, and missing values None.
+    """
+    df = df.drop_duplicates('song_id', keep='last')
+    columns = []
+    for name, sql_type in SONGS_COLUMNS:
+        column = df[name]
+        if name == 'time_added':
+            columns.append(_format_dates(column, '%Y-%m-%d %H:%M:%S',
+                                         utc=True))
+            continue
+        if name == 'release_date':
+            # year or month precision dates become the first day
+            columns.append(_format_dates(column, '%Y-%m-%d',
+                                         format='ISO8601', errors='coerce'))
+            continue
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            column = column.astype('float64')
+        values = column.tolist()
+        missing = column.isna().to_numpy()
+        if sql_type == 'integer':
+            values = [None if m else int(v) for v, m in zip(values, missing)]
+        elif missing.any():
+            values = [None if m else v for v, m in zip(values, missing)]
+        columns.append(values)
+    return list(zip(*columns))
+
+
+def connect_sqlite(path=SQLITE_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path))
+    conn.execute(CREATE_SONGS)
+    return conn
+
+
+def load_sqlite(conn, source, batch_size=BATCH_SIZE):
+    """Upserts track rows into songs with one executemany per batch, all
+    in a single transaction. Returns the number of rows written.
+
+    :conn: sqlite3 connection
+    :source: DataFrame or iterable of DataFrames
+    """
+    sql = UPSERT.format(source='values ({})'.format(
+        ', '.join('?' * len(COLUMNS))))
+    n = 0
+    with conn:
+        conn.execute(CREATE_SONGS)
+        for batch in iter_batches(source, batch_size):
+            rows = song_rows(batch)
+            conn.executemany(sql, rows)
+            n += len(rows)
+    return n
+
+
+def connect_postgres(dsn=None):
+    """Connects with psycopg2 (only needed for postgres loads) using dsn
+    or the DATABASE_URL environment variable
+    """
+    import psycopg2
+
+    load_dotenv(find_dotenv())
+    conn = psycopg2.connect(dsn or os.environ['DATABASE_URL'])
+    with conn, conn.cursor() as cur:
+        cur.execute(CREATE_SONGS)
+    return conn
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, str):
+        return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+    return str(value)
+
+
+def copy_buffer(rows):
+    """Returns rows in COPY text format"""
+    return io.StringIO(''.join(
+        '\t'.join(map(_copy_value, row)) + '\n' for row in rows))
+
+
+def load_postgres(conn, source, batch_size=BATCH_SIZE):
+    """Upserts track rows into songs: each batch is COPYed into a
+    temporary staging table and merged with a single insert ... on
+    conflict, all in one transaction. Returns the number of rows
+    written.
+
+    :conn: psycopg2 connection
+    :source: DataFrame or iterable of DataFrames
+    """
+    sql = UPSERT.format(
+        source='select {} from songs_stage'.format(', '.join(COLUMNS)))
+    n = 0
+    with conn, conn.cursor() as cur:
+        cur.execute('create temporary table songs_stage '
+                    '(like songs including defaults) on commit drop')
+        for batch in iter_batches(source, batch_size):
+            rows = song_rows(batch)
+            cur.copy_from(copy_buffer(rows), 'songs_stage', sep='\t',
+                          null='\\N', columns=COLUMNS)
+            cur.execute(sql)
+            cur.execute('truncate songs_stage')
+            n += len(rows)
+    return n
+
+
+@click.command()
+@click.option('--sqlite', 'sqlite_path', type=click.Path(),
+              help='sqlite database to load (default ../processed/'
+                   'music.sqlite)')
+@click.option('--postgres', 'dsn',
+              help='postgres connection string; DATABASE_URL if empty')
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True)
+def main(sqlite_path, dsn, batch_size):
+    """ Loads the combined discover weekly data (../interim/dw_combined)
+        into the songs table.
+    """
+    frames = CombinedDiscoverWeekly().iter_frames()
+    if dsn is not None:
+        conn = connect_postgres(dsn or None)
+        n = load_postgres(conn, frames, batch_size)
+    else:
+        conn = connect_sqlite(sqlite_path or SQLITE_PATH)
+        n = load_sqlite(conn, frames, batch_size)
+    conn.close()
+    logger.info('upserted %d songs', n)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -1,28 +1,287 @@
 # -*- coding: utf-8 -*-
 import click
+import hashlib
+import json
 import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
 from pathlib import Path
 from dotenv import find_dotenv, load_dotenv
 
+project_dir = Path(__file__).resolve().parents[2]
+STATE_PATH = project_dir / 'data/interim/pipeline_state.json'
+
+
+class Stage:
+    """One step of the data pipeline, run as a subprocess from the
+    project directory
+
+    A stage is skipped when its key is unchanged since its last
+    successful run. The key hashes the content of its input files, the
+    source of its code files, its command and, for stages that pull from
+    the Spotify API, the current period, so those run at most once per
+    day or week.
+
+    :name: stage name
+    :command: argument list after the python interpreter
+    :inputs: glob patterns, relative to the project directory, of the
+        files the stage reads
+    :outputs: glob patterns of files the stage writes; a stage whose
+        outputs are missing always runs
+    :code: source files whose changes invalidate the stage
+    :deps: names of stages that must finish first
+    :period: 'hour', 'day' or 'week' for stages fetching remote data
+    """
+
+    def __init__(self, name, command, inputs=(), outputs=(), code=(),
+                 deps=(), period=None):
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.code = code
+        self.deps = deps
+        self.period = period
+
+    @property
+    def remote(self):
+        return self.period is not None
+
+
+PERIODS = dict(hour='%Y-%m-%dT%H', day='%Y-%m-%d', week='%G-W%V')
+
+STAGES = [
+    Stage('discover_weekly', ['src/data/make_raw_dataset.py'],
+          outputs=['data/raw/*discover-weekly.parquet'],
+          code=['src/data/make_raw_dataset.py', 'src/data/discover_weekly.py',
+                'src/data/storage.py', 'src/data/track_fields.py',
+                'src/data/track_cache.py',
+                'src/data/paging.py', 'src/data/spotify_client.py'],
+          period='week'),
+    Stage('recently_played', ['-m', 'src.data.recently_played'],
+          code=['src/data/recently_played.py', 'src/data/discover_weekly.py',
+                'src/data/spotify_client.py'],
+          period='hour'),
+    Stage('artist_crawl', ['-m', 'src.data.grow_artist_graph', '--followed'],
+          outputs=['data/raw/artist_graph.jsonl'],
+          code=['src/data/grow_artist_graph.py',
+                'src/data/artist_networks.py', 'src/data/paging.py',
+                'src/data/spotify_client.py', 'src/features/edge_list.py',
+                'src/features/incremental_metrics.py'],
+          period='week'),
+    Stage('combine_discover_weekly',
+          ['-m', 'src.data.combine_discover_weekly'],
+          inputs=['data/raw/*discover-weekly.parquet',
+                  'data/raw/*discover-weekly.pkl'],
+          outputs=['data/interim/dw_combined/manifest.json'],
+          code=['src/data/combine_discover_weekly.py',
+                'src/data/storage.py', 'src/data/track_fields.py'],
+          deps=['discover_weekly']),
+    Stage('compact_recently_played',
+          ['-m', 'src.data.compact_recently_played'],
+          inputs=['data/raw/recently_played/*-recently_played.pkl',
+                  'data/raw/recently_played/plays/date=*/plays.jsonl'],
+          outputs=['data/interim/recently_played/manifest.json'],
+          code=['src/data/compact_recently_played.py',
+                'src/data/storage.py', 'src/data/track_fields.py'],
+          deps=['recently_played']),
+    Stage('artist_graph',
+          ['-m', 'src.features.graph_store', 'data/raw/artist_graph.jsonl',
+           'data/processed/artist_graph', '--undirected'],
+          inputs=['data/raw/artist_graph.jsonl'],
+          outputs=['data/processed/artist_graph/meta.json'],
+          code=['src/features/graph_store.py', 'src/features/edge_list.py'],
+          deps=['artist_crawl']),
+    Stage('artist_layout',
+          ['-m', 'src.features.graph_layout', 'data/processed/artist_graph'],
+          inputs=['data/processed/artist_graph/*.npy'],
+          outputs=['data/processed/artist_layout/*/meta.json'],
+          code=['src/features/graph_layout.py'],
+          deps=['artist_graph']),
+    Stage('track_similarity', ['-m', 'src.models.similarity'],
+          inputs=['data/interim/dw_combined/manifest.json'],
+          outputs=['data/processed/track_similarity.npz'],
+          code=['src/models/similarity.py'],
+          deps=['combine_discover_weekly']),
+]
+
+
+class FileHashes:
+    """sha256 of files, recomputed only when size or mtime changed"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def __call__(self, path):
+        st = path.stat()
+        key = str(path.relative_to(project_dir))
+        entry = self.cache.get(key)
+        if entry and entry[:2] == [st.st_size, st.st_mtime_ns]:
+            return entry[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        self.cache[key] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        return h.hexdigest()
+
+
+def expand(patterns):
+    """Returns the sorted files matching glob patterns"""
+    return sorted({p for pattern in patterns
+                   for p in project_dir.glob(pattern) if p.is_file()})
+
+
+def stage_key(stage, file_hash, now=None):
+    """Returns the hash deciding whether stage needs to run"""
+    h = hashlib.sha256()
+    h.update(json.dumps(stage.command).encode())
+    for path in expand(stage.inputs) + expand(stage.code):
+        h.update(str(path.relative_to(project_dir)).encode())
+        h.update(file_hash(path).encode())
+    if stage.period:
+        now = now or datetime.now(timezone.utc)
+        h.update(now.strftime(PERIODS[stage.period]).encode())
+    return h.hexdigest()
+
+
+class Pipeline:
+    """Runs stages in dependency order, independent stages in parallel,
+    skipping those whose key matches the last successful run
+
+    :stages: list of Stage
+    :state_path: json file of stage keys and file hashes
+    :jobs: maximum stages running at once
+    """
+
+    def __init__(self, stages=STAGES, state_path=STATE_PATH, jobs=4):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_path = Path(state_path)
+        self.jobs = jobs
+        self.lock = threading.Lock()
+        try:
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = {}
+        self.state.setdefault('stages', {})
+        self.file_hash = FileHashes(self.state.setdefault('files', {}))
+        self.logger = logging.getLogger(__name__)
+
+    def save_state(self):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=4, sort_keys=True)
+        os.replace(tmp, self.state_path)
+
+    def select(self, only=(), offline=False):
+        """Returns the names of the stages to consider: only and their
+        dependencies if given, without remote stages when offline
+        """
+        names = set()
+        pending = list(only or self.stages)
+        while pending:
+            name = pending.pop()
+            if name not in names:
+                names.add(name)
+                pending.extend(self.stages[name].deps)
+        if offline:
+            names = {n for n in names if not self.stages[n].remote}
+        return names
+
+    def run_stage(self, stage, force=False):
+        """Runs stage if its key changed; returns 'ran' or 'skipped'"""
+        if stage.inputs and not expand(stage.inputs):
+            self.logger.info('%s: no inputs yet', stage.name)
+            return 'skipped'
+        with self.lock:
+            key = stage_key(stage, self.file_hash)
+            outputs_exist = all(expand([p]) for p in stage.outputs)
+            if not force and outputs_exist \
+                    and self.state['stages'].get(stage.name) == key:
+                return 'skipped'
+
+        self.logger.info('running %s', stage.name)
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + stage.command, cwd=project_dir,
+                       check=True)
+        self.logger.info('%s finished in %.1fs', stage.name,
+                         time.perf_counter() - start)
+
+        with self.lock:
+            # the key from before the run: inputs that changed while the
+            # stage ran make it run again next time
+            self.state['stages'][stage.name] = key
+            self.save_state()
+        return 'ran'
+
+    def run(self, only=(), offline=False, force=False):
+        """Runs the selected stages. Returns a dict of stage name ->
+        'ran', 'skipped', 'failed' or 'blocked' (a dependency failed).
+        """
+        names = self.select(only, offline)
+        results = {}
+        running = {}
+        with ThreadPoolExecutor(self.jobs) as pool:
+            while len(results) < len(names):
+                for name in sorted(names - results.keys() - running.keys()):
+                    deps = [d for d in self.stages[name].deps if d in names]
+                    if any(results.get(d) in ('failed', 'blocked')
+                           for d in deps):
+                        results[name] = 'blocked'
+                    elif all(d in results for d in deps):
+                        running[name] = pool.submit(
+                            self.run_stage, self.stages[name], force)
+                if not running:
+                    continue
+                done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+                for name, future in list(running.items()):
+                    if future in done:
+                        del running[name]
+                        try:
+                            results[name] = future.result()
+                        except (subprocess.CalledProcessError, OSError) as e:
+                            self.logger.error('%s failed: %s', name, e)
+                            results[name] = 'failed'
+        with self.lock:
+            self.save_state()
+        return results
+
 
 @click.command()
-@click.argument('input_filepath', type=click.Path(exists=True))
-@click.argument('output_filepath', type=click.Path())
-def main(input_filepath, output_filepath):
-    """ Runs data processing scripts to turn raw data from (../raw) into
-        cleaned data ready to be analyzed (saved in ../processed).
+@click.option('--only', multiple=True, type=click.Choice(
+    [stage.name for stage in STAGES]),
+    help='run just this stage and its dependencies (repeatable)')
+@click.option('--offline', is_flag=True,
+              help='skip stages that fetch from the Spotify API')
+@click.option('--force', is_flag=True,
+              help='run stages even if their inputs are unchanged')
+@click.option('--jobs', default=4, show_default=True,
+              help='stages run in parallel')
+def main(only, offline, force, jobs):
+    """ Runs the data pipeline: downloads raw data into (../raw) and
+        builds the combined and compacted datasets from it, running only
+        stages whose inputs or code changed.
     """
     logger = logging.getLogger(__name__)
     logger.info('making final data set from raw data')
+    results = Pipeline(jobs=jobs).run(only, offline, force)
+    for name, result in sorted(results.items()):
+        logger.info('%s: %s', name, result)
+    if any(r in ('failed', 'blocked') for r in results.values()):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     logging.basicConfig(level=logging.INFO, format=log_fmt)
 
-    # not used in this stub but often useful for finding various files
-    project_dir = Path(__file__).resolve().parents[2]
-
     # find .env automagically by walking up directories until it's found, then
     # load up the .env entries as environment variables
     load_dotenv(find_dotenv())
@@ -5,11 +5,15 @@ from datetime import datetime
 from pathlib import Path
 
 import discover_weekly as dw
+import storage
+from track_cache import TrackCache
 
 print('Downloading Discover Weekly song data...')
 today = datetime.today().strftime('%Y-%m-%d')
-pickle_str = ('data/raw/' + today + '-discover-weekly.pkl')
-pickle_path = Path(__file__).resolve().parent.parent.parent / pickle_str
+parquet_str = ('data/raw/' + today + '-discover-weekly.parquet')
+project_dir = Path(__file__).resolve().parent.parent.parent
+parquet_path = project_dir / parquet_str
+cache_path = project_dir / 'data/interim/spotify_cache.sqlite'
 
 # find .env automagically by walking up directories until it's found
 dotenv_path = find_dotenv()
@@ -23,14 +27,19 @@ client_id = os.environ.get("CLIENT_ID")
 client_secret = os.environ.get("CLIENT_SECRET")
 redirect_uri = os.environ.get("REDIRECT_URI")
 
-all_tracks = dw.collect_and_append_new_dw(
-    username,
-    client_id,
-    client_secret,
-    redirect_uri,
-    scope
-)
+with TrackCache(cache_path) as cache:
+    all_tracks = dw.collect_and_append_new_dw(
+        username,
+        client_id,
+        client_secret,
+        redirect_uri,
+        scope,
+        cache=cache
+    )
+    stats = cache.stats()
 
-all_tracks.to_pickle(pickle_path)
+print(f"Track cache: {stats['hits']} hits, {stats['misses']} misses")
+
+storage.write_frame(all_tracks, parquet_path, 'tracks')
 
 print('Download complete!')
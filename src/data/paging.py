@@ -0,0 +1,29 @@
+# lazy iteration over paged spotify responses
+def iter_pages(sp, page, key=None):
+    """Yields each page of a paged spotify response, requesting the
+    next page only once the previous one has been consumed
+
+    Works for both offset and cursor based paging since it follows the
+    'next' url spotify includes with every page.
+
+    :sp: spotipy instantiation
+    :page: first page, as returned by the initial request
+    :key: optional key the paging object is nested under, e.g. 'artists'
+        for current_user_followed_artists
+    """
+    while page:
+        if key is not None:
+            page = page[key]
+        yield page
+        page = sp.next(page) if page.get('next') else None
+
+
+def iter_items(sp, page, key=None):
+    """Yields the items of every page of a paged spotify response
+
+    :sp: spotipy instantiation
+    :page: first page, as returned by the initial request
+    :key: optional key the paging object is nested under
+    """
+    for p in iter_pages(sp, page, key=key):
+        yield from p['items']
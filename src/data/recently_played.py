@@ -1,81 +1,181 @@
+# -*- coding: utf-8 -*-
+# download recently played tracks. run once (e.g. from cron) or with
+# --daemon to keep polling with an interval adapted to how fast plays
+# come in. plays are appended to a JSON Lines log partitioned by date and
+# the 'after' cursor is replaced atomically once they are on disk.
+import json
+import logging
 import os
 import pickle
-from dotenv import load_dotenv, find_dotenv
+import time
 from pathlib import Path
-from datetime import datetime
 
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-
-data_dir = Path('../../data/raw/recently_played')
-
-now = datetime.now().strftime('%Y-%m-%d-%H%M%S')
-log_now = datetime.now().strftime('%Y-%m-%d-%H:%M:%S')
-
-print(f'{log_now} : start download')
-
-dotenv_path = find_dotenv()
-load_dotenv(dotenv_path)
-
-with open(data_dir / 'after.pkl', 'rb') as h:
-    after = pickle.load(h)
-
-client_id = os.environ.get("CLIENT_ID")
-client_secret = os.environ.get("CLIENT_SECRET")
-redirect_uri = os.environ.get("REDIRECT_URI")
-username = 'colinspear1'
-scope = 'user-read-recently-played' #, 'user-read-playback-position', 'user-read-playback-state', 'user-read-currently-playing', 'user-library-read']
-
-sp = spotipy.Spotify(
-    auth_manager = SpotifyOAuth(
-        # username=username,
-        client_id = client_id,
-        client_secret = client_secret,
-        redirect_uri = redirect_uri,
-        scope = scope
-        )
-    )
-
-data = sp.current_user_recently_played(after=after)
-n = len(data['items'])
-
-try:
-    after = data['cursors']['after']
-except TypeError:
-    print(f'{log_now} : {n} songs downloaded. Next download will start after {after}') 
-
-if n > 0: 
-    with open(data_dir / f'{now}-recently_played.pkl', 'wb') as h:
-        pickle.dump(data, h)
-
-    with open(data_dir / 'after.pkl', 'wb') as h:
+import click
+from requests.exceptions import RequestException
+from spotipy.exceptions import SpotifyException
+
+from src.data.discover_weekly import call_with_retry
+from src.data.spotify_client import instantiate_client
+
+project_dir = Path(__file__).resolve().parents[2]
+data_dir = project_dir / 'data/raw/recently_played'
+CURSOR_PATH = data_dir / 'after.pkl'
+PLAYS_DIR = data_dir / 'plays'
+
+SCOPE = 'user-read-recently-played'
+# the endpoint returns at most 50 plays, older ones are lost if we poll
+# too rarely; aim to collect about half a page per poll
+PAGE_LIMIT = 50
+TARGET_PLAYS_PER_POLL = 25
+MIN_INTERVAL = 60
+MAX_INTERVAL = 3600
+# weight of the latest poll in the play rate estimate
+RATE_SMOOTHING = 0.3
+
+logger = logging.getLogger(__name__)
+
+
+def load_cursor(path=CURSOR_PATH):
+    """Returns the saved 'after' cursor (unix ms), or None"""
+    try:
+        with open(path, 'rb') as h:
+            return pickle.load(h)
+    except FileNotFoundError:
+        return None
+
+
+def save_cursor(after, path=CURSOR_PATH):
+    """Replaces the cursor file atomically, so a crash never leaves a
+    truncated cursor behind
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'wb') as h:
         pickle.dump(after, h)
-    print(f'{log_now} : {n} songs downloaded. Next download will start after {after}')
-
-
-# FAILED REQUESTS ATTEMPT
-
-# import requests
-# from requests_oauthlib import OAuth2Session
-# from requests.auth import HTTPBasicAuth
-
-
-# request_url = "https://accounts.spotify.com/authorize" #"https://api.spotify.com/v1/me/player/recently-played"
-# token_url = "https://accounts.spotify.com/api/token"
-# # response_type = 'code'
-
-# oauth = OAuth2Session(client_id, redirect_uri=redirect_uri, scope=scope)
-# authorization_url, state = oauth.authorization_url(request_url)
-
-# print(f'Please go to {authorization_url} and authorize access.')
-
-# authorization_response = input('Enter the full callback URL')
-
-# token = oauth.fetch_token(
-#         'https://accounts.google.com/o/oauth2/token',
-#         authorization_response=authorization_response,
-#         # Google specific extra parameter used for client
-#         # authentication
-#         client_secret=client_secret)
-
-# r = oauth.get('https://www.googleapis.com/oauth2/v1/userinfo')
+        h.flush()
+        os.fsync(h.fileno())
+    os.replace(tmp, path)
+
+
+def partition_path(played_at, plays_dir=PLAYS_DIR):
+    """Returns the log file for a play, one per UTC day of played_at"""
+    return Path(plays_dir) / f'date={played_at[:10]}' / 'plays.jsonl'
+
+
+def append_plays(items, plays_dir=PLAYS_DIR):
+    """Appends play objects to their date partitions and syncs them to
+    disk. Returns the number of plays written.
+    """
+    by_path = {}
+    for item in items:
+        by_path.setdefault(partition_path(item['played_at'], plays_dir),
+                           []).append(item)
+
+    for path, plays in by_path.items():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'a') as f:
+            for item in sorted(plays, key=lambda x: x['played_at']):
+                f.write(json.dumps(item, sort_keys=True) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+    return len(items)
+
+
+def poll(sp, cursor_path=CURSOR_PATH, plays_dir=PLAYS_DIR):
+    """Fetches the plays after the saved cursor, appends them to the log
+    and then commits the new cursor. Returns the number of new plays.
+
+    A crash between the append and the cursor commit means the same
+    plays are fetched and appended again on the next poll; readers
+    dedupe on (played_at, track id).
+    """
+    after = load_cursor(cursor_path)
+    data = call_with_retry(sp.current_user_recently_played, PAGE_LIMIT,
+                           after)
+    n = append_plays(data['items'], plays_dir)
+    # cursors is null when there is nothing new
+    if n and data.get('cursors'):
+        save_cursor(data['cursors']['after'], cursor_path)
+    return n
+
+
+class PollInterval:
+    """Poll interval from a smoothed estimate of the play rate
+
+    The interval is chosen so a poll is expected to find target plays,
+    clamped to [min_interval, max_interval]. A full page means plays may
+    have been missed, so the next poll comes as soon as allowed; empty
+    polls let the rate estimate decay towards max_interval.
+    """
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 target=TARGET_PLAYS_PER_POLL, smoothing=RATE_SMOOTHING):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target = target
+        self.smoothing = smoothing
+        # plays per second
+        self.rate = 0.0
+
+    def update(self, n_plays, elapsed):
+        """Records a poll that found n_plays over elapsed seconds and
+        returns the seconds to wait before the next one
+        """
+        if elapsed > 0:
+            observed = n_plays / elapsed
+            self.rate += self.smoothing * (observed - self.rate)
+        if n_plays >= PAGE_LIMIT:
+            return self.min_interval
+        if self.rate <= 0:
+            return self.max_interval
+        return min(max(self.target / self.rate, self.min_interval),
+                   self.max_interval)
+
+
+def run_daemon(sp, interval, cursor_path=CURSOR_PATH, plays_dir=PLAYS_DIR):
+    """Polls forever with one client, sleeping interval.update(...)
+    seconds between polls. API and network errors are logged and the
+    poll retried after min_interval.
+    """
+    last = time.monotonic()
+    while True:
+        try:
+            n = poll(sp, cursor_path, plays_dir)
+        except (SpotifyException, RequestException) as e:
+            logger.warning('poll failed: %s', e)
+            time.sleep(interval.min_interval)
+            continue
+        now = time.monotonic()
+        wait = interval.update(n, now - last)
+        last = now
+        logger.info('%d plays downloaded, %.2f plays/hour, next poll in '
+                    '%.0fs', n, interval.rate * 3600, wait)
+        time.sleep(wait)
+
+
+@click.command()
+@click.option('--daemon', is_flag=True,
+              help='keep polling instead of downloading once')
+@click.option('--min-interval', default=MIN_INTERVAL, show_default=True,
+              help='shortest wait between polls, in seconds')
+@click.option('--max-interval', default=MAX_INTERVAL, show_default=True,
+              help='longest wait between polls, in seconds')
+def main(daemon, min_interval, max_interval):
+    """ Downloads recently played tracks into
+        ../raw/recently_played/plays/date=<day>/plays.jsonl.
+    """
+    sp = instantiate_client(SCOPE)
+    if daemon:
+        run_daemon(sp, PollInterval(min_interval, max_interval))
+    else:
+        n = poll(sp)
+        logger.info('%d songs downloaded. Next download will start after '
+                    '%s', n, load_cursor())
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -1,22 +1,9 @@
-import sys
-import spotipy
-import spotipy.util as util
+from src.data.spotify_client import instantiate_client
 
 scope = 'user-library-read'
 
-if len(sys.argv) > 1:
-    username = sys.argv[1]
-else:
-    print("Usage: %s username" % (sys.argv[0],))
-    sys.exit()
-
-token = util.prompt_for_user_token(username, scope)
-
-if token:
-    sp = spotipy.Spotify(auth=token)
-    results = sp.current_user_saved_tracks()
-    for item in results['items']:
-        track = item['track']
-        print(rack['name'] + ' - ' + track['artists'][0]['name'])
-else:
-    print("Can't get token for", username)
+sp = instantiate_client(scope)
+results = sp.current_user_saved_tracks()
+for item in results['items']:
+    track = item['track']
+    print(track['name'] + ' - ' + track['artists'][0]['name'])
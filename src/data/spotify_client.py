@@ -0,0 +1,268 @@
+# spotify clients shared by the ingestion scripts in src/data
+import asyncio
+import os
+import random
+import time
+
+import aiohttp
+import spotipy
+from dotenv import load_dotenv, find_dotenv
+from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
+
+# find .env automagically by walking up directories until it's found
+load_dotenv(find_dotenv())
+
+SPOTIFY_API = 'https://api.spotify.com/v1'
+# requests in flight at once, and the sustained request rate allowed by
+# the token bucket (bursts up to RATE_BURST)
+MAX_CONCURRENCY = 100
+RATE_PER_SECOND = 30.0
+RATE_BURST = 60
+MAX_RETRIES = 5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def instantiate_client(scope, client_id=None, client_secret=None,
+                       redirect_uri=None):
+    """Returns a spotipy client authorized for the current user
+
+    Credentials default to the CLIENT_ID, CLIENT_SECRET and
+    REDIRECT_URI environment variables.
+
+    :scope: spotify authorization scope(s)
+    """
+    return spotipy.Spotify(
+        auth_manager=SpotifyOAuth(
+            client_id=client_id or os.environ.get('CLIENT_ID'),
+            client_secret=client_secret or os.environ.get('CLIENT_SECRET'),
+            redirect_uri=redirect_uri or os.environ.get('REDIRECT_URI'),
+            scope=scope
+        )
+    )
+
+
+def instantiate_app_client(client_id=None, client_secret=None):
+    """Returns a spotipy client using the client credentials flow, for
+    endpoints that need no user authorization
+    """
+    return spotipy.Spotify(
+        client_credentials_manager=SpotifyClientCredentials(
+            client_id=client_id or os.environ.get('CLIENT_ID'),
+            client_secret=client_secret or os.environ.get('CLIENT_SECRET')
+        )
+    )
+
+
+def token_provider(auth_manager):
+    """Returns a function get_token(refresh=False) that produces a current
+    access token from a spotipy auth manager, refreshing it when it has
+    expired
+
+    With refresh the cached token is bypassed, for when spotify has
+    rejected it before its expiry: a user token is renewed with its
+    refresh token and a client credentials token requested anew.
+    """
+    def get_token(refresh=False):
+        if not refresh:
+            return auth_manager.get_access_token(as_dict=False)
+        token_info = None
+        if hasattr(auth_manager, 'refresh_access_token'):
+            token_info = auth_manager.cache_handler.get_cached_token()
+        if token_info and token_info.get('refresh_token'):
+            token_info = auth_manager.refresh_access_token(
+                token_info['refresh_token'])
+            return token_info['access_token']
+        return auth_manager.get_access_token(as_dict=False,
+                                             check_cache=False)
+
+    return get_token
+
+
+class TokenBucket:
+    """Async token bucket limiting the sustained request rate
+
+    :rate: tokens added per second
+    :capacity: maximum burst size
+    """
+
+    def __init__(self, rate=RATE_PER_SECOND, capacity=RATE_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                elapsed = now - self.updated_at
+                self.tokens = min(self.capacity,
+                                  self.tokens + elapsed * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Empties the bucket so no request goes out for roughly seconds,
+        used when spotify answers 429 with a Retry-After
+        """
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class AsyncSpotify:
+    """Asyncio spotify web api client sharing one pooled keep-alive
+    connection between many concurrent requests
+
+    Requests are limited to max_concurrency in flight and to the token
+    bucket's rate. 429s wait out Retry-After and pause the whole client;
+    5xx and connection errors are retried with exponential backoff.
+    Use as an async context manager:
+
+        async with AsyncSpotify(token_provider(auth_manager)) as client:
+            analyses = await client.map(client.audio_analysis, track_ids)
+
+    :get_token: function returning a current access token, asked before
+        every request, and a freshly issued one when called with
+        refresh=True after a 401 (see token_provider)
+    :base_url: api root, overridable to point at a local fake server
+    :max_concurrency: maximum requests in flight
+    :rate: sustained requests per second
+    :burst: maximum burst of requests above the sustained rate
+    :max_retries: retries per request before the error is raised
+    """
+
+    def __init__(self, get_token, base_url=SPOTIFY_API,
+                 max_concurrency=MAX_CONCURRENCY, rate=RATE_PER_SECOND,
+                 burst=RATE_BURST, max_retries=MAX_RETRIES):
+        self.get_token = get_token
+        self.base_url = base_url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.session = None
+        self.token = None
+        self._token_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency,
+                                         keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=30)
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def _current_token(self):
+        # get_token is asked for every request: spotipy caches the token
+        # and renews it near expiry, which the lock keeps to one thread
+        async with self._token_lock:
+            self.token = await asyncio.to_thread(self.get_token)
+            return self.token
+
+    async def _refresh(self, rejected):
+        """Replaces the token spotify rejected, unless a concurrent
+        request already has
+        """
+        async with self._token_lock:
+            if self.token == rejected:
+                self.token = await asyncio.to_thread(self.get_token,
+                                                     refresh=True)
+
+    async def get(self, path, params=None):
+        """Returns the json response to GET path, which is either
+        relative to base_url or a full url such as a paging 'next'
+        """
+        url = path if path.startswith('http') else self.base_url + path
+        refreshed = False
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.bucket.acquire()
+                token = await self._current_token()
+                headers = {'Authorization': f'Bearer {token}'}
+                try:
+                    async with self.session.get(url, params=params,
+                                                headers=headers) as resp:
+                        if (resp.status == 401 and not refreshed
+                                and attempt < self.max_retries):
+                            await self._refresh(token)
+                            refreshed = True
+                            continue
+                        if (resp.status in RETRY_STATUSES
+                                and attempt < self.max_retries):
+                            delay = self._retry_delay(resp, attempt)
+                        else:
+                            resp.raise_for_status()
+                            return await resp.json()
+                except (aiohttp.ClientConnectionError,
+                        asyncio.TimeoutError):
+                    if attempt == self.max_retries:
+                        raise
+                    delay = _backoff(attempt)
+                # sleep after the response is released so the pooled
+                # connection can serve other requests meanwhile
+                await asyncio.sleep(delay)
+
+    def _retry_delay(self, resp, attempt):
+        if resp.status == 429:
+            delay = float(resp.headers.get('Retry-After', _backoff(attempt)))
+            self.bucket.pause(delay)
+            return delay
+        return _backoff(attempt)
+
+    async def map(self, func, args):
+        """Returns [await func(arg) for arg in args], running the calls
+        concurrently (bounded by max_concurrency)
+        """
+        return await asyncio.gather(*(func(arg) for arg in args))
+
+    async def next(self, page):
+        """Returns the page after page, or None on the last page"""
+        if page.get('next'):
+            return await self.get(page['next'])
+        return None
+
+    async def audio_analysis(self, track_id):
+        return await self.get(f'/audio-analysis/{track_id}')
+
+    async def audio_features(self, track_ids):
+        response = await self.get('/audio-features',
+                                  params={'ids': ','.join(track_ids)})
+        return response['audio_features']
+
+    async def artist_related_artists(self, artist_id):
+        return await self.get(f'/artists/{artist_id}/related-artists')
+
+    async def artists(self, artist_ids):
+        """Returns the artist objects for up to 50 artist ids"""
+        response = await self.get('/artists',
+                                  params={'ids': ','.join(artist_ids)})
+        return response['artists']
+
+
+def run_concurrently(get_token, func, args, **client_kwargs):
+    """Synchronous entry point for the ingestion scripts: awaits
+    func(client, arg) once per arg, concurrently, and returns the
+    results in the order of args
+
+    :get_token: function returning a current access token
+    :func: coroutine function taking an AsyncSpotify and one arg
+    :args: list of arguments
+    :client_kwargs: passed to AsyncSpotify
+    """
+    async def main():
+        async with AsyncSpotify(get_token, **client_kwargs) as client:
+            return await client.map(lambda arg: func(client, arg), args)
+
+    return asyncio.run(main())
+
+
+def _backoff(attempt):
+    """Exponential backoff with jitter, in seconds"""
+    return min(30, 2 ** attempt) * (0.5 + random.random() / 2)
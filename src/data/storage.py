@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# parquet storage for the project's datasets. each dataset has an explicit
+# arrow schema (dictionary encoded strings, float32 features, UTC
+# timestamps) so files are small and load with the right dtypes, and
+# reads can select columns and filter on the dataset's date column
+# without loading the rest of the file.
+import logging
+import os
+from pathlib import Path
+
+import click
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.data.track_fields import CATEGORIES, TRACK_FIELDS
+
+project_dir = Path(__file__).resolve().parents[2]
+# rows per row group: the unit the date filter can skip
+ROW_GROUP_SIZE = 65536
+COMPRESSION = 'zstd'
+# object columns with fewer distinct values than this fraction of rows
+# are stored dictionary encoded when no schema covers them
+CATEGORY_RATIO = 0.5
+
+TIMESTAMP = pa.timestamp('us', tz='UTC')
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+_ARROW_TYPES = {
+    'datetime': TIMESTAMP,
+    object: pa.string(),
+    'int32': pa.int32(),
+    'int16': pa.int16(),
+    'int8': pa.int8(),
+    'float32': pa.float32(),
+    # parquet keeps dictionaries of strings only; key and mode are stored
+    # as numbers and read_frame restores the categories
+    'category': pa.int8(),
+}
+# repeated strings in track_info_df output
+_TRACK_CATEGORIES = {'release_date_precision', 'artist_name', 'artist_id'}
+
+SCHEMAS = dict(
+    tracks=pa.schema([
+        (name, CATEGORY if name in _TRACK_CATEGORIES else _ARROW_TYPES[dtype])
+        for name, _, _, dtype in TRACK_FIELDS
+    ]),
+    plays=pa.schema([
+        ('played_at', TIMESTAMP),
+        ('track_id', pa.string()),
+        ('track_name', pa.string()),
+        ('artist_id', CATEGORY),
+        ('artist_name', CATEGORY),
+        ('album_id', CATEGORY),
+        ('album_name', CATEGORY),
+        ('duration_ms', pa.int32()),
+        ('popularity', pa.int16()),
+        ('explicit', pa.bool_()),
+        ('context_type', CATEGORY),
+        ('context_uri', CATEGORY),
+    ]),
+)
+# column the start / end filters of read_frame apply to
+DATE_COLUMNS = dict(tracks='time_added', plays='played_at')
+
+logger = logging.getLogger(__name__)
+
+
+def _infer_field(name, series):
+    """Returns a compact arrow field for a column no schema covers"""
+    if pd.api.types.is_float_dtype(series):
+        return pa.field(name, pa.float32())
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return pa.field(name, TIMESTAMP)
+    if pd.api.types.is_string_dtype(series) \
+            and series.nunique() < CATEGORY_RATIO * len(series):
+        return pa.field(name, CATEGORY)
+    return pa.Schema.from_pandas(series.to_frame(), preserve_index=False)[0]
+
+
+def schema_for(df, dataset=None):
+    """Returns the arrow schema df is stored with: the dataset's schema
+    for the columns it defines, inferred compact types for the rest
+    """
+    known = SCHEMAS[dataset] if dataset else pa.schema([])
+    fields = [known.field(name) for name in known.names if name in df]
+    fields += [_infer_field(name, df[name]) for name in df.columns
+               if name not in known.names]
+    metadata = {b'dataset': dataset.encode()} if dataset else None
+    return pa.schema(fields, metadata=metadata)
+
+
+def to_table(df, dataset=None):
+    """Converts df to an arrow table with the dataset's schema"""
+    schema = schema_for(df, dataset)
+    df = df[schema.names].copy()
+    for field in schema:
+        column = df[field.name]
+        if field.type == TIMESTAMP:
+            df[field.name] = pd.to_datetime(column, utc=True)
+        elif dataset == 'tracks' and field.name in CATEGORIES:
+            df[field.name] = column.astype('float64').astype('Int8')
+        elif pa.types.is_dictionary(field.type):
+            df[field.name] = column.astype('category')
+        elif pa.types.is_floating(field.type):
+            df[field.name] = column.astype('float32')
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def conform(df, dataset=None):
+    """Returns df with the dtypes it would have after a write and read,
+    so frames from pickles and parquet files compare and hash alike
+    """
+    return _restore_categories(to_table(df, dataset).to_pandas(), dataset)
+
+
+def _restore_categories(df, dataset):
+    if dataset == 'tracks':
+        for name in CATEGORIES.keys() & set(df.columns):
+            df[name] = pd.Categorical(df[name].astype('float64'),
+                                      categories=CATEGORIES[name])
+    return df
+
+
+def write_frame(df, path, dataset=None):
+    """Writes df to a parquet file, replacing any existing file
+    atomically
+
+    :dataset: name of the schema in SCHEMAS to apply, if any
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    pq.write_table(to_table(df, dataset), tmp, compression=COMPRESSION,
+                   row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp, path)
+
+
+def dataset_of(path):
+    """Returns the dataset name stored in a parquet file, or None"""
+    metadata = pq.read_schema(path).metadata or {}
+    name = metadata.get(b'dataset')
+    return name.decode() if name else None
+
+
+def _utc(value):
+    """Returns a date bound as a UTC Timestamp, taking naive values to
+    be UTC already
+    """
+    ts = pd.Timestamp(value)
+    return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+
+def read_frame(path, columns=None, start=None, end=None, date_column=None):
+    """Reads a parquet file (or a legacy pickle) into a DataFrame
+
+    Only the requested columns are read, and with start / end only row
+    groups whose date statistics overlap [start, end) are read before
+    rows are filtered exactly.
+
+    :columns: optional list of columns
+    :start: optional inclusive lower bound on the date column; naive
+        dates and datetimes are taken to be UTC
+    :end: optional exclusive upper bound on the date column
+    :date_column: column the bounds apply to; defaults to the dataset's
+        DATE_COLUMNS entry, or for files without one the first
+        DATE_COLUMNS value among the file's columns
+    """
+    path = Path(path)
+    if path.suffix == '.pkl':
+        df = pd.read_pickle(path)
+        if start is not None or end is not None:
+            date_column = date_column or _guess_date_column(df, path)
+            dates = pd.to_datetime(df[date_column], utc=True)
+            keep = pd.Series(True, index=df.index)
+            if start is not None:
+                keep &= dates >= _utc(start)
+            if end is not None:
+                keep &= dates < _utc(end)
+            df = df[keep]
+        return df[columns] if columns else df
+
+    dataset = dataset_of(path)
+    filters = []
+    if start is not None or end is not None:
+        if date_column is None and dataset in DATE_COLUMNS:
+            date_column = DATE_COLUMNS[dataset]
+        elif date_column is None:
+            date_column = _guess_date_column(pq.read_schema(path).names,
+                                             path)
+        if start is not None:
+            filters.append((date_column, '>=', _utc(start)))
+        if end is not None:
+            filters.append((date_column, '<', _utc(end)))
+    table = pq.read_table(path, columns=columns, filters=filters or None)
+    return _restore_categories(table.to_pandas(), dataset)
+
+
+def _guess_date_column(columns, path):
+    for name in DATE_COLUMNS.values():
+        if name in columns:
+            return name
+    raise ValueError(f'{path}: no date column to filter on; pass '
+                     'date_column')
+
+
+def guess_dataset(path):
+    """Returns the schema name for one of the project's pickles"""
+    name = Path(path).name
+    if name.endswith('discover-weekly.pkl') or name in (
+            'dw_combined.pkl', 'starred_songs.pkl'):
+        return 'tracks'
+    return None
+
+
+def migrate(paths, remove=False):
+    """Converts DataFrame pickles to parquet files next to them. Pickles
+    that do not hold a DataFrame (raw API responses) are skipped.
+    Returns a list of (pickle, parquet, pickle bytes, parquet bytes).
+
+    :remove: delete each pickle once its parquet file reads back with
+        the same number of rows
+    """
+    migrated = []
+    for path in map(Path, paths):
+        df = pd.read_pickle(path)
+        if not isinstance(df, pd.DataFrame):
+            logger.info('skipping %s: not a DataFrame', path)
+            continue
+        target = path.with_suffix('.parquet')
+        write_frame(df, target, guess_dataset(path))
+        if pq.read_metadata(target).num_rows != len(df):
+            raise ValueError(f'{target} does not match {path}')
+        migrated.append((path, target, path.stat().st_size,
+                         target.stat().st_size))
+        logger.info('%s -> %s (%.1f -> %.1f MB)', path.name, target.name,
+                    migrated[-1][2] / 1e6, migrated[-1][3] / 1e6)
+        if remove:
+            path.unlink()
+    return migrated
+
+
+@click.command()
+@click.argument('paths', nargs=-1, type=click.Path(exists=True))
+@click.option('--remove', is_flag=True,
+              help='delete pickles once converted')
+def main(paths, remove):
+    """ Converts DataFrame pickles (default: every pickle in ../raw) to
+        parquet files.
+    """
+    paths = paths or sorted((project_dir / 'data/raw').glob('*.pkl'))
+    migrate(paths, remove=remove)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
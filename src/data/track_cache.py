@@ -0,0 +1,134 @@
+# an on-disk cache of per-track spotify responses so that tracks seen
+# in earlier pulls are not fetched again
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+# seconds before a cached response of each kind is considered stale.
+# audio analysis and features never change once a track is released.
+# popularity drifts week to week, but it comes with every playlist item,
+# so it is always read fresh and never cached.
+DEFAULT_TTL = {
+    'analysis': None,
+    'features': None,
+}
+DEFAULT_MAX_ENTRIES = 500000
+
+
+class TrackCache:
+    """SQLite backed cache of spotify responses keyed by (kind, track id)
+
+    Entries whose kind has a ttl are treated as misses once they are
+    older than the ttl. When the cache grows past max_entries the least
+    recently used entries are evicted.
+
+    :path: location of the sqlite database
+    :ttl: dict of kind -> seconds, overriding DEFAULT_TTL
+    :max_entries: maximum number of cached responses
+    """
+
+    def __init__(self, path, ttl=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = dict(DEFAULT_TTL, **(ttl or {}))
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute('''
+            create table if not exists responses(
+                kind text,
+                track_id text,
+                payload text,
+                fetched_at real,
+                accessed_at real,
+                primary key (kind, track_id)
+            )
+        ''')
+        self.conn.execute('''
+            create index if not exists responses_accessed_at
+            on responses(accessed_at)
+        ''')
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_many(self, kind, track_ids):
+        """Returns a dict of track id -> cached response for the fresh
+        entries among track_ids
+        """
+        now = time.time()
+        ttl = self.ttl.get(kind)
+        found = {}
+        for batch in _chunked(list(track_ids), 500):
+            marks = ','.join('?' * len(batch))
+            rows = self.conn.execute(
+                'select track_id, payload, fetched_at from responses '
+                f'where kind = ? and track_id in ({marks})',
+                [kind, *batch]
+            )
+            for track_id, payload, fetched_at in rows:
+                if ttl is None or now - fetched_at < ttl:
+                    found[track_id] = json.loads(payload)
+
+        if found:
+            self.conn.executemany(
+                'update responses set accessed_at = ? '
+                'where kind = ? and track_id = ?',
+                [(now, kind, track_id) for track_id in found]
+            )
+            self.conn.commit()
+
+        self.hits += len(found)
+        self.misses += len(track_ids) - len(found)
+
+        return found
+
+    def put_many(self, kind, responses):
+        """Stores a dict of track id -> response, skipping empty
+        responses (unknown tracks come back as None)
+        """
+        now = time.time()
+        self.conn.executemany(
+            'insert or replace into responses values (?, ?, ?, ?, ?)',
+            [(kind, track_id, json.dumps(response), now, now)
+             for track_id, response in responses.items()
+             if response is not None]
+        )
+        self.conn.commit()
+        self.evict()
+
+    def evict(self):
+        """Deletes the least recently used entries beyond max_entries"""
+        (count,) = self.conn.execute(
+            'select count(*) from responses').fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                'delete from responses where rowid in ('
+                'select rowid from responses order by accessed_at limit ?)',
+                (excess,)
+            )
+            self.conn.commit()
+
+    def stats(self):
+        """Returns hit and miss counts since the cache was opened"""
+        lookups = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+        )
+
+    def close(self):
+        self.conn.close()
+
+
+def _chunked(seq, size):
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
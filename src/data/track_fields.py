@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# the columns of track_info_df output, kept free of api dependencies so
+# storage and the dashboard can read the schema without importing the
+# spotify clients.
+
+# column name, response it is read from, key path into that response, dtype.
+# 'item' is the playlist item, 'analysis' the track section of the audio
+# analysis and 'features' the audio features
+TRACK_FIELDS = [
+    ('time_added', 'item', ('added_at',), 'datetime'),
+    ('release_date', 'item', ('track', 'album', 'release_date'), object),
+    ('release_date_precision', 'item',
+        ('track', 'album', 'release_date_precision'), object),
+    ('artist_name', 'item', ('track', 'album', 'artists', 0, 'name'), object),
+    ('artist_id', 'item', ('track', 'artists', 0, 'id'), object),
+    ('song_id', 'item', ('track', 'id'), object),
+    ('song_length_ms', 'item', ('track', 'duration_ms'), 'int32'),
+    ('song_name', 'item', ('track', 'name'), object),
+    ('popularity', 'item', ('track', 'popularity'), 'int16'),
+    ('loudness', 'analysis', ('loudness',), 'float32'),
+    ('tempo', 'analysis', ('tempo',), 'float32'),
+    ('tempo_confidence', 'analysis', ('tempo_confidence',), 'float32'),
+    ('time_signature', 'analysis', ('time_signature',), 'int8'),
+    ('time_sig_conf', 'analysis', ('time_signature_confidence',), 'float32'),
+    ('key', 'analysis', ('key',), 'category'),
+    ('key_confidence', 'analysis', ('key_confidence',), 'float32'),
+    ('mode', 'analysis', ('mode',), 'category'),
+    ('mode_confidence', 'analysis', ('mode_confidence',), 'float32'),
+    ('danceability', 'features', ('danceability',), 'float32'),
+    ('energy', 'features', ('energy',), 'float32'),
+    ('speechiness', 'features', ('speechiness',), 'float32'),
+    ('acousticness', 'features', ('acousticness',), 'float32'),
+    ('instrumentalness', 'features', ('instrumentalness',), 'float32'),
+    ('liveness', 'features', ('liveness',), 'float32'),
+    ('valence', 'features', ('valence',), 'float32'),
+]
+
+# pitch classes 0 (C) through 11 (B), or -1 when no key was detected;
+# mode is 0 (minor) or 1 (major)
+CATEGORIES = dict(key=list(range(-1, 12)), mode=[0, 1])
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# streaming edge list builder for the related-artist crawl output: reads
+# one record at a time and emits integer (source, target) edges plus a
+# separate artist table, so no crawl has to fit in memory as json.
+import json
+from array import array
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class EdgeListBuilder:
+    """Accumulates crawl records into int32 edge columns
+
+    Artists get an integer id in order of first appearance. Names are
+    kept in a separate table, filled from the crawled artist itself or,
+    for artists only seen as someone's related artist, from the related
+    artist names; followers and popularity are -1 for those.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.names = []
+        self.followers = array('q')
+        self.popularity = array('h')
+        self.sources = array('i')
+        self.targets = array('i')
+
+    def _node(self, artist_id, name):
+        i = self.index.get(artist_id)
+        if i is None:
+            i = self.index[artist_id] = len(self.names)
+            self.names.append(name)
+            self.followers.append(-1)
+            self.popularity.append(-1)
+        return i
+
+    def add_record(self, record):
+        source = self._node(record['id'], record['name'])
+        self.names[source] = record['name']
+        self.followers[source] = record.get('followers', {}).get('total', -1)
+        self.popularity[source] = record.get('popularity', -1)
+        for related_id, name in zip(record['related_ids'],
+                                    record['related_artists']):
+            self.sources.append(source)
+            self.targets.append(self._node(related_id, name))
+
+    def add_records(self, records):
+        for record in records:
+            self.add_record(record)
+        return self
+
+    def build(self):
+        """Returns the accumulated EdgeList"""
+        return EdgeList(
+            sources=np.frombuffer(self.sources, dtype='int32').copy(),
+            targets=np.frombuffer(self.targets, dtype='int32').copy(),
+            artists=pd.DataFrame(dict(
+                id=list(self.index),
+                name=self.names,
+                followers=np.frombuffer(self.followers, dtype='int64'),
+                popularity=np.frombuffer(self.popularity, dtype='int16'),
+            )),
+        )
+
+
+class EdgeList:
+    """Integer edge list with its artist table
+
+    :sources: int32 array of edge sources, indexing artists
+    :targets: int32 array of edge targets, indexing artists
+    :artists: DataFrame of id, name, followers and popularity, one row
+        per integer id
+    """
+
+    def __init__(self, sources, targets, artists):
+        self.sources = sources
+        self.targets = targets
+        self.artists = artists
+
+    def __len__(self):
+        return len(self.sources)
+
+    def to_frame(self, names=True):
+        """Returns a DataFrame with one row per edge; artist names in
+        columns artist / related_artist, as the notebooks used, or the
+        integer ids in source / target
+        """
+        if not names:
+            return pd.DataFrame(dict(source=self.sources,
+                                     target=self.targets))
+        name = self.artists['name'].to_numpy()
+        return pd.DataFrame(dict(artist=name[self.sources],
+                                 related_artist=name[self.targets]))
+
+    def to_graph(self, directed=True):
+        """Returns the edges as an ArtistGraph"""
+        from src.features.graph_store import ArtistGraph
+
+        return ArtistGraph.from_index_edges(
+            self.sources, self.targets, self.artists['id'].to_numpy(str),
+            directed=directed,
+            names=self.artists['name'].to_numpy(str),
+            followers=self.artists['followers'].to_numpy(),
+            popularity=self.artists['popularity'].to_numpy(),
+        )
+
+    def save(self, path):
+        """Writes edges.parquet and artists.parquet to the directory path"""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        pq.write_table(pa.table(dict(source=self.sources,
+                                     target=self.targets)),
+                       path / 'edges.parquet')
+        pq.write_table(
+            pa.Table.from_pandas(self.artists, preserve_index=False),
+            path / 'artists.parquet'
+        )
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        edges = pq.read_table(path / 'edges.parquet')
+        return cls(
+            sources=edges['source'].to_numpy(),
+            targets=edges['target'].to_numpy(),
+            artists=pq.read_table(path / 'artists.parquet').to_pandas(),
+        )
+
+
+def read_records(path):
+    """Yields the records of a crawl output one at a time. JSON Lines
+    files are streamed; the older single-list .json files have to be
+    parsed whole.
+    """
+    with open(path) as f:
+        if Path(path).suffix == '.json':
+            yield from json.load(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def build_edge_list(path):
+    """Returns the EdgeList of a crawl output file"""
+    return EdgeListBuilder().add_records(read_records(path)).build()
+
+
+@click.command()
+@click.argument('crawl_filepath', type=click.Path(exists=True))
+@click.argument('output_dir', type=click.Path())
+def main(crawl_filepath, output_dir):
+    """ Streams crawl output (../raw/followed_artists.jsonl or
+        ../raw/artist_graph.jsonl) into an edge list in ../interim.
+    """
+    edges = build_edge_list(crawl_filepath)
+    edges.save(output_dir)
+    print(f'{len(edges.artists)} artists, {len(edges)} edges written to '
+          f'{output_dir}')
+
+
+if __name__ == '__main__':
+    main()
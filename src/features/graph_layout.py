@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+# precomputed 2d layout of the artist graph for the dashboard: a multilevel
+# force directed layout whose repulsion is evaluated on a grid with ffts,
+# so an iteration costs O(n + edges + grid log grid) instead of the O(n^2)
+# of networkx's spring layout. layouts are cached on disk under a content
+# hash of the graph and come with a grid index for level of detail
+# bounding box queries.
+import json
+import math
+import time
+from pathlib import Path
+
+import click
+import numpy as np
+from scipy import fft
+
+from src.features.graph_store import ArtistGraph
+from src.features.reference_graphs import graph_hash
+
+project_dir = Path(__file__).resolve().parents[2]
+CACHE_DIR = project_dir / 'data/processed/artist_layout'
+LAYOUT_ARRAYS = ('positions', 'rank', 'order', 'cell_ptr')
+
+# stop coarsening at this many nodes, or when a level shrinks by less
+# than MIN_SHRINK
+COARSEST_SIZE = 50
+MIN_SHRINK = 0.9
+MATCH_ROUNDS = 3
+COARSEST_ITERATIONS = 100
+LEVEL_ITERATIONS = 30
+COOLING = 0.92
+# repulsion grid: about one cell per ideal edge length, capped
+MIN_GRID = 16
+MAX_GRID = 256
+# cells per side of the bounding box query index
+INDEX_GRID = 64
+
+
+def _edge_pairs(graph):
+    """Returns (u, v) int64 arrays with every edge of graph once, u < v,
+    whether or not graph is directed
+    """
+    sources, targets = graph.edges()
+    u = np.minimum(sources, targets).astype('int64')
+    v = np.maximum(sources, targets).astype('int64')
+    keep = u != v
+    pairs = np.unique(u[keep] * graph.n_nodes + v[keep])
+    return pairs // graph.n_nodes, pairs % graph.n_nodes
+
+
+def _coarsen(u, v, n, rng):
+    """Returns (cluster of each node, number of clusters) for one level
+    of coarsening: leaves join their neighbour, then the remaining nodes
+    are paired along locally heaviest random edges
+    """
+    parent = np.arange(n)
+    degree = np.bincount(u, minlength=n) + np.bincount(v, minlength=n)
+    # leaves hanging off a hub can't all be matched to it, so absorb them
+    leaf_u = (degree[u] == 1) & (degree[v] > 1)
+    leaf_v = (degree[v] == 1) & (degree[u] > 1)
+    parent[u[leaf_u]] = v[leaf_u]
+    parent[v[leaf_v]] = u[leaf_v]
+    matched = parent != np.arange(n)
+    matched[parent[matched]] = True
+
+    for _ in range(MATCH_ROUNDS):
+        free = ~matched[u] & ~matched[v]
+        eu, ev = u[free], v[free]
+        if not len(eu):
+            break
+        w = rng.random(len(eu))
+        best = np.zeros(n)
+        np.maximum.at(best, eu, w)
+        np.maximum.at(best, ev, w)
+        mutual = (best[eu] == w) & (best[ev] == w)
+        parent[ev[mutual]] = eu[mutual]
+        matched[eu[mutual]] = matched[ev[mutual]] = True
+
+    roots, cluster = np.unique(parent, return_inverse=True)
+    return cluster, len(roots)
+
+
+def _repulsion_kernel(grid):
+    """Returns the ffts of the x and y components of r / |r|^2 on a
+    2 grid x 2 grid lattice of cell offsets, for zero padded convolution
+    """
+    offsets = fft.fftfreq(2 * grid, 1 / (2 * grid))
+    dx, dy = np.meshgrid(offsets, offsets, indexing='ij')
+    r2 = dx ** 2 + dy ** 2
+    r2[0, 0] = np.inf
+    return fft.rfft2(dx / r2), fft.rfft2(dy / r2)
+
+
+def _repulsion(pos, mass, k, grid, kernel):
+    """Returns the repulsive force k^2 * sum_j mass_j / d_ij on every node,
+    with the masses binned on a grid x grid mesh over the layout
+    """
+    lo = pos.min(0)
+    h = max((pos.max(0) - lo).max(), 1e-9) * (1 + 1e-6) / grid
+    cells = ((pos - lo) / h).astype('int64')
+    flat = cells[:, 0] * grid + cells[:, 1]
+    rho = np.zeros((2 * grid, 2 * grid))
+    rho[:grid, :grid] = np.bincount(
+        flat, weights=mass, minlength=grid * grid).reshape(grid, grid)
+    rho = fft.rfft2(rho, workers=-1)
+    force = np.empty_like(pos)
+    for axis in (0, 1):
+        field = fft.irfft2(rho * kernel[axis], s=(2 * grid, 2 * grid),
+                           workers=-1)
+        force[:, axis] = field[:grid, :grid].ravel()[flat]
+    return force * (k ** 2 / h)
+
+
+def _force_layout(u, v, mass, pos, k, iterations, temperature):
+    """Fruchterman-Reingold iterations (attraction d^2 / k along edges,
+    repulsion k^2 / d between all nodes) updating pos in place
+    """
+    n = len(pos)
+    # n nodes at about k apart fill a square of side sqrt(n) * k
+    grid = int(np.clip(math.sqrt(n), MIN_GRID, MAX_GRID))
+    kernel = _repulsion_kernel(grid)
+    for _ in range(iterations):
+        disp = _repulsion(pos, mass, k, grid, kernel)
+        d = pos[v] - pos[u]
+        pull = d * (np.hypot(d[:, 0], d[:, 1]) / k)[:, None]
+        for axis in (0, 1):
+            disp[:, axis] += (np.bincount(u, pull[:, axis], n)
+                              - np.bincount(v, pull[:, axis], n))
+        length = np.maximum(np.hypot(disp[:, 0], disp[:, 1]), 1e-12)
+        pos += disp * (np.minimum(length, temperature) / length)[:, None]
+        temperature *= COOLING
+    return pos
+
+
+def multilevel_layout(graph, seed=0, k=1.0):
+    """Returns an (n_nodes, 2) float32 array of node positions
+
+    The graph is coarsened level by level down to COARSEST_SIZE nodes,
+    the coarsest graph is laid out from random positions and each finer
+    level starts from its clusters' positions, so the full graph only
+    needs a few refining iterations.
+
+    :graph: ArtistGraph, directed or not
+    :k: ideal edge length
+    """
+    rng = np.random.default_rng(seed)
+    n = graph.n_nodes
+    u, v = _edge_pairs(graph)
+    levels = [(u, v, np.ones(n))]
+    clusters = []
+    while n > COARSEST_SIZE:
+        cluster, n_coarse = _coarsen(u, v, n, rng)
+        if n_coarse > MIN_SHRINK * n:
+            break
+        cu, cv = cluster[u], cluster[v]
+        keep = cu != cv
+        pairs = np.unique(np.minimum(cu, cv)[keep] * n_coarse
+                          + np.maximum(cu, cv)[keep])
+        u, v = pairs // n_coarse, pairs % n_coarse
+        mass = np.bincount(cluster, weights=levels[-1][2],
+                           minlength=n_coarse)
+        levels.append((u, v, mass))
+        clusters.append(cluster)
+        n = n_coarse
+
+    u, v, mass = levels[-1]
+    level_k = k * math.sqrt(mass.mean())
+    size = math.sqrt(mass.sum()) * k
+    pos = rng.random((n, 2)) * size
+    pos = _force_layout(u, v, mass, pos, level_k, COARSEST_ITERATIONS,
+                        size / 10)
+    for (u, v, mass), cluster in zip(levels[-2::-1], clusters[::-1]):
+        level_k = k * math.sqrt(mass.mean())
+        pos = pos[cluster] + rng.normal(scale=level_k / 10,
+                                        size=(len(cluster), 2))
+        pos = _force_layout(u, v, mass, pos, level_k, LEVEL_ITERATIONS,
+                            2 * level_k)
+    return pos.astype('float32')
+
+
+class GraphLayout:
+    """Node positions of a graph with a grid index for level of detail
+    bounding box queries
+
+    Nodes are ranked by degree, so a query over a large area returns the
+    best connected artists in it and zooming in reveals the rest.
+    order holds the node indices sorted by index cell and then rank, and
+    the nodes of cell c are order[cell_ptr[c]:cell_ptr[c + 1]].
+
+    :positions: float32 array of shape (n_nodes, 2)
+    :rank: int32 array, rank[i] is node i's position by degree
+    :order: int32 array of node indices
+    :cell_ptr: int64 array of length INDEX_GRID ** 2 + 1
+    :bounds: (x min, y min, x max, y max)
+    :graph_hash: graph_hash of the graph laid out
+    """
+
+    def __init__(self, positions, rank, order, cell_ptr, bounds,
+                 graph_hash):
+        self.positions = positions
+        self.rank = rank
+        self.order = order
+        self.cell_ptr = cell_ptr
+        self.bounds = tuple(bounds)
+        self.graph_hash = graph_hash
+
+    @property
+    def grid(self):
+        return math.isqrt(len(self.cell_ptr) - 1)
+
+    @classmethod
+    def build(cls, graph, positions, grid=INDEX_GRID):
+        """Indexes positions of graph's nodes"""
+        by_degree = np.lexsort((np.arange(graph.n_nodes), -graph.degree()))
+        rank = np.empty(graph.n_nodes, dtype='int32')
+        rank[by_degree] = np.arange(graph.n_nodes)
+        bounds = (*positions.min(0).tolist(), *positions.max(0).tolist())
+        layout = cls(positions, rank, None, None, bounds, graph_hash(graph))
+        cells = layout._cells(positions, grid)
+        layout.order = np.lexsort((rank, cells)).astype('int32')
+        layout.cell_ptr = np.concatenate(
+            ([0], np.cumsum(np.bincount(cells, minlength=grid ** 2))))
+        return layout
+
+    def _cell_coords(self, xy, grid):
+        lo = np.asarray(self.bounds[:2])
+        span = np.maximum(np.asarray(self.bounds[2:]) - lo, 1e-9)
+        return np.clip(((np.asarray(xy) - lo) / span * grid).astype('int64'),
+                       0, grid - 1)
+
+    def _cells(self, positions, grid):
+        coords = self._cell_coords(positions, grid)
+        return coords[:, 0] * grid + coords[:, 1]
+
+    def query(self, bbox=None, limit=1000):
+        """Returns the indices of the at most limit best ranked nodes
+        inside bbox, best first
+
+        :bbox: (x min, y min, x max, y max), the whole layout by default
+        """
+        if limit < 1:
+            raise ValueError('limit must be at least 1')
+        bbox = self.bounds if bbox is None else bbox
+        grid = self.grid
+        (x0, y0), (x1, y1) = self._cell_coords(
+            [bbox[:2], bbox[2:]], grid)
+        candidates = []
+        for i in range(x0, x1 + 1):
+            for j in range(y0, y1 + 1):
+                c = i * grid + j
+                nodes = self.order[self.cell_ptr[c]:self.cell_ptr[c + 1]]
+                # cells on the border of the range may lie partly outside
+                # bbox, so they are filtered before keeping their best
+                if i in (x0, x1) or j in (y0, y1):
+                    nodes = nodes[self._inside(nodes, bbox)]
+                # only a cell's limit best nodes can make the overall top
+                # limit; nodes within a cell are in rank order
+                candidates.append(nodes[:limit])
+        nodes = np.concatenate(candidates)
+        return nodes[np.argsort(self.rank[nodes], kind='stable')[:limit]]
+
+    def _inside(self, nodes, bbox):
+        xy = self.positions[nodes]
+        return ((xy[:, 0] >= bbox[0]) & (xy[:, 0] <= bbox[2])
+                & (xy[:, 1] >= bbox[1]) & (xy[:, 1] <= bbox[3]))
+
+    def save(self, path):
+        """Writes the layout as .npy arrays plus a meta.json to the
+        directory path
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in LAYOUT_ARRAYS:
+            np.save(path / f'{name}.npy', getattr(self, name))
+        with open(path / 'meta.json', 'w') as f:
+            json.dump(dict(graph_hash=self.graph_hash, bounds=self.bounds,
+                           n_nodes=len(self.positions)), f, indent=4)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Loads a layout saved with save, memory mapping the arrays
+        unless mmap is False
+        """
+        path = Path(path)
+        with open(path / 'meta.json') as f:
+            meta = json.load(f)
+        mode = 'r' if mmap else None
+        arrays = {name: np.load(path / f'{name}.npy', mmap_mode=mode)
+                  for name in LAYOUT_ARRAYS}
+        return cls(bounds=meta['bounds'], graph_hash=meta['graph_hash'],
+                   **arrays)
+
+
+def layout_graph(graph, cache_dir=CACHE_DIR, seed=0):
+    """Returns the GraphLayout of graph, computing and caching it in
+    cache_dir/<graph hash>/ unless it is already there
+    """
+    layout_dir = Path(cache_dir) / graph_hash(graph)
+    if (layout_dir / 'meta.json').exists():
+        return GraphLayout.load(layout_dir)
+    layout = GraphLayout.build(graph, multilevel_layout(graph, seed))
+    layout.save(layout_dir)
+    return layout
+
+
+@click.command()
+@click.argument('graph_dir', type=click.Path(exists=True))
+@click.option('--cache-dir', type=click.Path(), default=str(CACHE_DIR),
+              show_default=True)
+@click.option('--seed', default=0, show_default=True)
+def main(graph_dir, cache_dir, seed):
+    """ Lays out a stored ArtistGraph (../processed/artist_graph) for the
+        dashboard.
+    """
+    start = time.perf_counter()
+    graph = ArtistGraph.load(graph_dir)
+    layout = layout_graph(graph, cache_dir, seed)
+    print(f'{graph.n_nodes} artists laid out in '
+          f'{time.perf_counter() - start:.1f}s, cached under '
+          f'{Path(cache_dir) / layout.graph_hash}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# small-world metrics over an ArtistGraph: shortest path lengths by
+# breadth first search from blocks of sources spread over worker
+# processes, and clustering from sparse-matrix triangle counts.
+import math
+import multiprocessing as mp
+import os
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+# two sided normal quantiles for the sampled path length estimate
+Z_SCORES = {0.9: 1.6449, 0.95: 1.96, 0.99: 2.5758}
+
+
+# BFS sources handled per scipy call; each returns a dense block of
+# SOURCE_BLOCK x n_nodes distances
+SOURCE_BLOCK = 32
+
+_worker_adjacency = None
+
+
+def _init_worker(indptr, indices):
+    global _worker_adjacency
+    _worker_adjacency = _csr(indptr, indices)
+
+
+def _source_path_stats(sources):
+    """Returns (sum of distances, reachable nodes) for each source"""
+    stats = np.empty((len(sources), 2), dtype='int64')
+    for start in range(0, len(sources), SOURCE_BLOCK):
+        block = sources[start:start + SOURCE_BLOCK]
+        dist = csgraph.shortest_path(_worker_adjacency, directed=False,
+                                     unweighted=True, indices=block)
+        reached = np.isfinite(dist) & (dist > 0)
+        stats[start:start + len(block), 0] = np.where(reached, dist, 0).sum(1)
+        stats[start:start + len(block), 1] = reached.sum(1)
+    return stats
+
+
+def source_path_stats(graph, sources, processes=None):
+    """Runs a BFS from every source across worker processes and returns
+    an (n_sources, 2) array of (sum of distances, reachable nodes)
+
+    :graph: ArtistGraph
+    :sources: array of node indices
+    :processes: worker processes, defaults to the number of cores
+    """
+    processes = processes or os.cpu_count()
+    sources = np.asarray(sources)
+    if processes == 1 or len(sources) < 2 * processes:
+        _init_worker(graph.indptr, graph.indices)
+        return _source_path_stats(sources)
+
+    chunks = np.array_split(sources, processes * 4)
+    # fork shares the (possibly memory mapped) arrays without copying
+    ctx = mp.get_context('fork')
+    with ctx.Pool(processes, initializer=_init_worker,
+                  initargs=(graph.indptr, graph.indices)) as pool:
+        return np.concatenate(pool.map(_source_path_stats, chunks))
+
+
+def average_shortest_path_length(graph, processes=None):
+    """Exact mean shortest path length over all reachable ordered pairs
+    (the networkx definition for a connected graph)
+
+    :graph: undirected ArtistGraph, usually the largest component
+    """
+    stats = source_path_stats(graph, np.arange(graph.n_nodes), processes)
+    return stats[:, 0].sum() / stats[:, 1].sum()
+
+
+def estimate_average_shortest_path_length(graph, n_sources=500,
+                                          confidence=0.95, seed=None,
+                                          processes=None):
+    """Estimates the mean shortest path length from a random sample of
+    BFS sources. Returns (estimate, (low, high)), the interval being a
+    normal approximation over the per-source mean distances.
+
+    :graph: undirected, connected ArtistGraph
+    :n_sources: number of sampled sources
+    :confidence: one of Z_SCORES
+    :seed: random seed for the source sample
+    """
+    rng = np.random.default_rng(seed)
+    n_sources = min(n_sources, graph.n_nodes)
+    sources = rng.choice(graph.n_nodes, n_sources, replace=False)
+    stats = source_path_stats(graph, sources, processes)
+    per_source = stats[:, 0] / np.maximum(stats[:, 1], 1)
+
+    estimate = per_source.mean()
+    if n_sources == graph.n_nodes or n_sources < 2:
+        return estimate, (estimate, estimate)
+    # finite population correction: sampling without replacement
+    fpc = math.sqrt((graph.n_nodes - n_sources) / (graph.n_nodes - 1))
+    half_width = (Z_SCORES[confidence] * per_source.std(ddof=1)
+                  / math.sqrt(n_sources) * fpc)
+    return estimate, (estimate - half_width, estimate + half_width)
+
+
+def _csr(indptr, indices):
+    n = len(indptr) - 1
+    data = np.ones(len(indices), dtype='int32')
+    return sparse.csr_matrix((data, indices, indptr), shape=(n, n))
+
+
+def adjacency_matrix(graph):
+    """Returns the graph as a scipy CSR matrix of ones"""
+    return _csr(graph.indptr, graph.indices)
+
+
+def triangles(graph):
+    """Returns the number of triangles through each node of an
+    undirected graph, from the diagonal of A^3 computed as the row sums
+    of (A @ A) * A
+    """
+    A = adjacency_matrix(graph)
+    return np.asarray((A @ A).multiply(A).sum(axis=1)).ravel() // 2
+
+
+def clustering(graph):
+    """Returns the local clustering coefficient of every node (0 for
+    nodes of degree below two, as networkx does)
+    """
+    degree = graph.degree()
+    possible = degree * (degree - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c = np.where(possible > 0, 2 * triangles(graph) / possible, 0.0)
+    return c
+
+
+def average_clustering(graph):
+    return clustering(graph).mean()
+
+
+def transitivity(graph):
+    """Global clustering: 3 x triangles / connected triples"""
+    degree = graph.degree()
+    triples = (degree * (degree - 1)).sum()
+    # each triangle closes three triples and is counted at all three
+    # of its nodes, so 3 x (sum / 3) / (triples / 2)
+    return 2 * triangles(graph).sum() / triples if triples else 0.0
+
+
+def largest_component(graph):
+    """Returns the largest connected component of an undirected graph"""
+    _, labels = csgraph.connected_components(adjacency_matrix(graph),
+                                             directed=False)
+    largest = np.bincount(labels).argmax()
+    return graph.subgraph(np.flatnonzero(labels == largest))
+
+
+def path_length_and_clustering(graph, n_sources=None, processes=None):
+    """Returns (average shortest path length, average clustering),
+    estimating the path length from n_sources sampled sources when
+    given, otherwise computing it exactly
+    """
+    if n_sources:
+        length, _ = estimate_average_shortest_path_length(
+            graph, n_sources, processes=processes, seed=0)
+    else:
+        length = average_shortest_path_length(graph, processes)
+    return length, average_clustering(graph)
+
+
+def sigma(c, length, c_r, l_r):
+    """Small-world coefficient (c / c_r) / (length / l_r); > 1 is
+    small-world
+    """
+    return (c / c_r) / (length / l_r)
+
+
+def omega(c, length, c_l, l_r):
+    """Small-world measure l_r / length - c / c_l; near 0 is small-world"""
+    return (l_r / length) - (c / c_l)
+
+
+def swi(c, length, c_r, l_r, c_l, l_l):
+    """Small-world index of Neal (2017), the product of how close the
+    path length is to the random reference's and the clustering to the
+    lattice's; near 1 is small-world, 0 for either reference itself
+    """
+    return ((length - l_l) / (l_r - l_l)) * ((c - c_r) / (c_l - c_r))
+
+
+def small_world(graph, random_graph, lattice_graph, n_sources=None,
+                processes=None):
+    """Returns sigma, omega and SWI of graph against a random and a
+    lattice reference graph, as computed in notebooks/artist_graph.py
+
+    :graph: undirected, connected ArtistGraph
+    :random_graph: degree preserving randomisation of graph
+    :lattice_graph: degree preserving latticisation of graph
+    :n_sources: sample this many BFS sources instead of all nodes
+    """
+    length, c = path_length_and_clustering(graph, n_sources, processes)
+    l_r, c_r = path_length_and_clustering(random_graph, n_sources, processes)
+    l_l, c_l = path_length_and_clustering(lattice_graph, n_sources, processes)
+
+    return dict(
+        sigma=sigma(c, length, c_r, l_r),
+        omega=omega(c, length, c_l, l_r),
+        swi=swi(c, length, c_r, l_r, c_l, l_l),
+    )
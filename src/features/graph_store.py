@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# compact on-disk store for the related-artist graph: artists are mapped
+# to int32 indices and the adjacency is kept as CSR arrays saved as .npy
+# files, so a stored graph loads via memory mapping in milliseconds.
+import json
+from pathlib import Path
+
+import click
+import numpy as np
+
+from src.features.edge_list import EdgeListBuilder, read_records
+
+ARRAYS = ('ids', 'names', 'followers', 'popularity', 'indptr', 'indices')
+
+
+class ArtistGraph:
+    """Artist graph in compressed sparse row form
+
+    The neighbours of node i are indices[indptr[i]:indptr[i + 1]].
+    ids[i] is the spotify artist id of node i and names[i] its name;
+    followers and popularity are -1 for artists that appear only as
+    someone's related artist and were never fetched themselves.
+
+    :ids: array of artist ids, one per node
+    :indptr: int64 array of length n_nodes + 1
+    :indices: int32 array of edge targets
+    :names: array of artist names
+    :followers: int64 array of follower counts
+    :popularity: int16 array of popularity scores
+    :directed: whether edges are directed
+    """
+
+    def __init__(self, ids, indptr, indices, names=None, followers=None,
+                 popularity=None, directed=True):
+        n = len(ids)
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self.names = names if names is not None else np.full(n, '')
+        self.followers = (followers if followers is not None
+                          else np.full(n, -1, dtype='int64'))
+        self.popularity = (popularity if popularity is not None
+                           else np.full(n, -1, dtype='int16'))
+        self.directed = directed
+        self._index = None
+
+    @property
+    def n_nodes(self):
+        return len(self.indptr) - 1
+
+    @property
+    def n_edges(self):
+        """Number of stored edges; for an undirected graph each edge is
+        stored in both directions and counted once
+        """
+        return len(self.indices) if self.directed else len(self.indices) // 2
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ARRAYS)
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def neighbors(self, node):
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def index_of(self, artist_id):
+        """Returns the node index of an artist id"""
+        if self._index is None:
+            self._index = {a: i for i, a in enumerate(self.ids.tolist())}
+        return self._index[artist_id]
+
+    def edges(self):
+        """Returns (source, target) int32 arrays of every stored edge"""
+        sources = np.repeat(np.arange(self.n_nodes, dtype='int32'),
+                            self.degree())
+        return sources, np.asarray(self.indices)
+
+    @classmethod
+    def from_index_edges(cls, sources, targets, ids, directed=True, **attrs):
+        """Builds a graph from int edge arrays over node indices
+
+        Self loops and duplicate edges are dropped. An undirected graph
+        stores each edge in both directions.
+
+        :sources: int array of edge sources
+        :targets: int array of edge targets
+        :ids: array of artist ids indexed by node
+        :attrs: names, followers and popularity arrays indexed by node
+        """
+        n = len(ids)
+        sources = np.asarray(sources, dtype='int64')
+        targets = np.asarray(targets, dtype='int64')
+        if not directed:
+            sources, targets = (np.concatenate([sources, targets]),
+                                np.concatenate([targets, sources]))
+        keep = sources != targets
+        keys = np.unique(sources[keep] * n + targets[keep])
+        sources, targets = np.divmod(keys, n)
+
+        indptr = np.zeros(n + 1, dtype='int64')
+        np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+
+        return cls(np.asarray(ids), indptr, targets.astype('int32'),
+                   directed=directed, **attrs)
+
+    @classmethod
+    def from_records(cls, records, directed=True):
+        """Builds a graph from crawl records (artist objects with a
+        'related_ids' list) as written by artist_networks
+
+        :records: iterable of record dicts
+        """
+        return EdgeListBuilder().add_records(records).build().to_graph(
+            directed=directed)
+
+    def to_undirected(self):
+        """Returns the undirected graph with an edge wherever either
+        direction exists
+        """
+        if not self.directed:
+            return self
+        sources, targets = self.edges()
+        return ArtistGraph.from_index_edges(
+            sources, targets, self.ids, directed=False, names=self.names,
+            followers=self.followers, popularity=self.popularity,
+        )
+
+    def subgraph(self, nodes):
+        """Returns the graph induced by an array of node indices,
+        renumbered 0..len(nodes) - 1 in the given order
+        """
+        nodes = np.asarray(nodes)
+        remap = np.full(self.n_nodes, -1, dtype='int64')
+        remap[nodes] = np.arange(len(nodes))
+        sources, targets = self.edges()
+        keep = (remap[sources] >= 0) & (remap[targets] >= 0)
+        graph = ArtistGraph.from_index_edges(
+            remap[sources[keep]], remap[targets[keep]], self.ids[nodes],
+            names=self.names[nodes], followers=self.followers[nodes],
+            popularity=self.popularity[nodes],
+        )
+        # edges were filtered from a stored graph, so they already are
+        # symmetric when it is undirected
+        graph.directed = self.directed
+        return graph
+
+    def to_networkx(self, label='name'):
+        """Returns the graph as a networkx (Di)Graph with followers and
+        popularity node attributes
+
+        :label: node attribute used as the networkx node key, 'name' as
+            in the notebooks or 'id'
+        """
+        import networkx as nx
+
+        G = nx.DiGraph() if self.directed else nx.Graph()
+        keys = (self.names if label == 'name' else self.ids).tolist()
+        G.add_nodes_from(
+            (key, dict(id=artist_id, followers=int(f), popularity=int(p)))
+            for key, artist_id, f, p in zip(keys, self.ids.tolist(),
+                                            self.followers, self.popularity)
+        )
+        sources, targets = self.edges()
+        G.add_edges_from(zip((keys[i] for i in sources),
+                             (keys[i] for i in targets)))
+        return G
+
+    def save(self, path):
+        """Writes the graph as .npy arrays plus a meta.json to the
+        directory path
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ARRAYS:
+            array = getattr(self, name)
+            if array.dtype == object:
+                array = array.astype(str)
+            np.save(path / f'{name}.npy', array)
+        with open(path / 'meta.json', 'w') as f:
+            json.dump(dict(directed=self.directed, n_nodes=self.n_nodes,
+                           n_edges=self.n_edges), f, indent=4)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Loads a graph saved with save, memory mapping the arrays
+        unless mmap is False
+        """
+        path = Path(path)
+        with open(path / 'meta.json') as f:
+            meta = json.load(f)
+        mode = 'r' if mmap else None
+        arrays = {name: np.load(path / f'{name}.npy', mmap_mode=mode)
+                  for name in ARRAYS}
+        return cls(directed=meta['directed'], **arrays)
+
+
+@click.command()
+@click.argument('crawl_filepath', type=click.Path(exists=True))
+@click.argument('output_dir', type=click.Path())
+@click.option('--undirected', is_flag=True)
+def main(crawl_filepath, output_dir, undirected):
+    """ Converts crawl output (../raw/followed_artists.jsonl or
+        ../raw/artist_graph.jsonl) into a stored ArtistGraph.
+    """
+    graph = ArtistGraph.from_records(read_records(crawl_filepath),
+                                     directed=not undirected)
+    graph.save(output_dir)
+    print(f'{graph.n_nodes} artists, {graph.n_edges} edges, '
+          f'{graph.nbytes / 1e6:.1f} MB written to {output_dir}')
+
+
+if __name__ == '__main__':
+    main()
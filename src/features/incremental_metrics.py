@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# graph metrics kept up to date as the crawler adds edges, so each
+# expansion round costs work proportional to the edges it added rather
+# than a recompute over the whole graph.
+from collections import Counter
+
+
+class IncrementalGraphMetrics:
+    """Undirected graph metrics maintained edge by edge
+
+    Adding edge (u, v) touches only u, v and their neighbourhoods:
+    triangle counts grow by |N(u) & N(v)|, connected triples by
+    deg(u) + deg(v), components merge in a union-find, and the degree
+    assortativity sums (Newman 2002) are corrected for the edges already
+    incident to u and v. Self loops and repeated edges are ignored.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.adj = []
+        self.triangles = []
+        self.clustering = []
+        self.neighbour_degree_sum = []
+        self.parent = []
+        self.size = []
+
+        self.n_edges = 0
+        self.n_triangles = 0
+        self.n_triples = 0
+        self.clustering_sum = 0.0
+        self.components = 0
+        self.largest_component = 0
+        self.degree_histogram = Counter()
+        # sums over every edge (j, k) of its end degrees: j * k, j + k
+        # and j^2 + k^2
+        self.sum_jk = 0
+        self.sum_j = 0
+        self.sum_j2 = 0
+
+    @property
+    def n_nodes(self):
+        return len(self.adj)
+
+    def add_node(self, node_id):
+        """Returns the index of node_id, adding it if it is new"""
+        i = self.index.get(node_id)
+        if i is None:
+            i = self.index[node_id] = len(self.adj)
+            self.adj.append(set())
+            self.triangles.append(0)
+            self.clustering.append(0.0)
+            self.neighbour_degree_sum.append(0)
+            self.parent.append(i)
+            self.size.append(1)
+            self.components += 1
+            self.largest_component = max(self.largest_component, 1)
+            self.degree_histogram[0] += 1
+        return i
+
+    def add_edge(self, source_id, target_id):
+        """Adds an undirected edge; returns False if it already existed"""
+        u = self.add_node(source_id)
+        v = self.add_node(target_id)
+        if u == v or v in self.adj[u]:
+            return False
+
+        small, large = sorted((self.adj[u], self.adj[v]), key=len)
+        common = [w for w in small if w in large]
+        for w in common:
+            self.triangles[w] += 1
+            self._update_clustering(w)
+        self.triangles[u] += len(common)
+        self.triangles[v] += len(common)
+        self.n_triangles += len(common)
+
+        self._increment_degree(u)
+        self._increment_degree(v)
+        self.adj[u].add(v)
+        self.adj[v].add(u)
+        self.n_edges += 1
+
+        du, dv = len(self.adj[u]), len(self.adj[v])
+        self.neighbour_degree_sum[u] += dv
+        self.neighbour_degree_sum[v] += du
+        self.sum_jk += du * dv
+        self.sum_j += du + dv
+        self.sum_j2 += du * du + dv * dv
+
+        self._update_clustering(u)
+        self._update_clustering(v)
+        self._union(u, v)
+
+        return True
+
+    def add_edges(self, edges):
+        """Adds (source id, target id) pairs; returns how many were new"""
+        return sum(self.add_edge(u, v) for u, v in edges)
+
+    def add_records(self, records):
+        """Adds the edges of crawl records (artist objects with a
+        'related_ids' list); returns how many were new
+        """
+        return self.add_edges((record['id'], related_id)
+                              for record in records
+                              for related_id in record['related_ids'])
+
+    def _increment_degree(self, x):
+        """Accounts for deg(x) growing by one, before the new edge is
+        added: every existing edge (x, y) changes its end degree
+        """
+        d = len(self.adj[x])
+        self.degree_histogram[d] -= 1
+        if not self.degree_histogram[d]:
+            del self.degree_histogram[d]
+        self.degree_histogram[d + 1] += 1
+        self.n_triples += d
+
+        # each existing edge (x, y) has x's end degree go from d to d + 1
+        self.sum_jk += self.neighbour_degree_sum[x]
+        self.sum_j += d
+        self.sum_j2 += d * (2 * d + 1)
+        for y in self.adj[x]:
+            self.neighbour_degree_sum[y] += 1
+
+    def _update_clustering(self, x):
+        d = len(self.adj[x])
+        c = 2 * self.triangles[x] / (d * (d - 1)) if d > 1 else 0.0
+        self.clustering_sum += c - self.clustering[x]
+        self.clustering[x] = c
+
+    def _find(self, x):
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def _union(self, u, v):
+        ru, rv = self._find(u), self._find(v)
+        if ru == rv:
+            return
+        if self.size[ru] < self.size[rv]:
+            ru, rv = rv, ru
+        self.parent[rv] = ru
+        self.size[ru] += self.size[rv]
+        self.components -= 1
+        self.largest_component = max(self.largest_component, self.size[ru])
+
+    def assortativity(self):
+        """Degree assortativity coefficient (networkx's
+        degree_assortativity_coefficient for an undirected graph)
+        """
+        m = self.n_edges
+        if not m:
+            return float('nan')
+        mean = self.sum_j / (2 * m)
+        variance = self.sum_j2 / (2 * m) - mean ** 2
+        if not variance:
+            return float('nan')
+        return (self.sum_jk / m - mean ** 2) / variance
+
+    def snapshot(self):
+        """Returns the current metrics as a dict"""
+        n = self.n_nodes
+        return dict(
+            nodes=n,
+            edges=self.n_edges,
+            density=2 * self.n_edges / (n * (n - 1)) if n > 1 else 0.0,
+            triangles=self.n_triangles,
+            transitivity=(3 * self.n_triangles / self.n_triples
+                          if self.n_triples else 0.0),
+            average_clustering=self.clustering_sum / n if n else 0.0,
+            assortativity=self.assortativity(),
+            components=self.components,
+            largest_component=self.largest_component,
+            degree_histogram=dict(sorted(self.degree_histogram.items())),
+        )
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+# random and lattice reference graphs for the small-world indices,
+# generated in parallel with explicit seeds and cached on disk under a
+# content hash of the source graph.
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import warnings
+from pathlib import Path
+
+import numpy as np
+from scipy.sparse import csgraph, linalg
+
+from src.features import graph_metrics as gm
+from src.features.graph_store import ArtistGraph
+
+project_dir = Path(__file__).resolve().parents[2]
+CACHE_DIR = project_dir / 'data/interim/reference_graphs'
+# attempted double edge swaps per edge, as in networkx's niter
+SWAPS_PER_EDGE = 10
+# latticisation carries on past SWAPS_PER_EDGE rounds of one attempt per
+# edge until a round accepts fewer than LATTICE_STALL_RATE of its
+# attempts, for at most MAX_LATTICE_SWAPS_PER_EDGE rounds
+LATTICE_STALL_RATE = 0.01
+MAX_LATTICE_SWAPS_PER_EDGE = 100
+# eigensolver iterations for the spectral ring order of the lattice, and
+# smoothing steps refining it
+SPECTRAL_ITERATIONS = 200
+RING_ORDER_STEPS = 50
+# cache file prefixes, changed whenever a reference's construction does
+# so stale cached references are not reused
+CACHE_NAMES = dict(random='random', lattice='lattice2')
+
+
+def graph_hash(graph):
+    """Returns a sha256 hex digest of the graph's adjacency, so cached
+    references are invalidated whenever the graph changes
+    """
+    h = hashlib.sha256()
+    h.update(np.asarray(graph.indptr, dtype='int64').tobytes())
+    h.update(np.asarray(graph.indices, dtype='int32').tobytes())
+    return h.hexdigest()
+
+
+def _undirected_edges(graph):
+    """Returns (u, v) arrays with each undirected edge once (u < v)"""
+    sources, targets = graph.edges()
+    once = sources < targets
+    return sources[once].astype('int64'), targets[once].astype('int64')
+
+
+def _swap_edges(graph, seed, swaps_per_edge, accept=None,
+                stall_rate=None, max_swaps_per_edge=None):
+    """Degree preserving double edge swaps: (a, b), (c, d) becomes
+    (a, d), (c, b) unless that creates a self loop or a duplicate edge,
+    or accept(old edges, new edges) rejects it. Connectivity is not
+    enforced; path lengths are averaged over reachable pairs.
+
+    Swaps are attempted in rounds of one per edge, swaps_per_edge rounds
+    in all or, with stall_rate, until a round after the first
+    swaps_per_edge accepts fewer than stall_rate of its attempts (at most
+    max_swaps_per_edge rounds).
+    """
+    u, v = _undirected_edges(graph)
+    n = graph.n_nodes
+    m = len(u)
+    rng = np.random.default_rng(seed)
+    existing = set((u * n + v).tolist())
+    # plain lists: element access in the swap loop is far faster than on
+    # numpy arrays
+    u, v = u.tolist(), v.tolist()
+
+    def key(a, b):
+        return a * n + b if a < b else b * n + a
+
+    def swap_round():
+        accepted = 0
+        picks = rng.integers(0, m, size=(m, 2))
+        flips = rng.random(m) < 0.5
+        for (i, j), flip in zip(picks.tolist(), flips.tolist()):
+            if i == j:
+                continue
+            a, b = u[i], v[i]
+            c, d = (v[j], u[j]) if flip else (u[j], v[j])
+            if a == d or c == b:
+                continue
+            new_1, new_2 = key(a, d), key(c, b)
+            if new_1 in existing or new_2 in existing:
+                continue
+            if accept is not None and not accept(a, b, c, d):
+                continue
+            existing.discard(key(a, b))
+            existing.discard(key(c, d))
+            existing.add(new_1)
+            existing.add(new_2)
+            u[i], v[i] = a, d
+            u[j], v[j] = c, b
+            accepted += 1
+        return accepted
+
+    rounds = max_swaps_per_edge if stall_rate else swaps_per_edge
+    for round_ in range(rounds if m > 1 else 0):
+        accepted = swap_round()
+        if (stall_rate and round_ + 1 >= swaps_per_edge
+                and accepted < stall_rate * m):
+            break
+
+    return ArtistGraph.from_index_edges(u, v, graph.ids, directed=False)
+
+
+def random_reference(graph, seed, swaps_per_edge=SWAPS_PER_EDGE):
+    """Degree preserving randomisation of an undirected graph"""
+    return _swap_edges(graph, seed, swaps_per_edge)
+
+
+def _ring_length(position, u, v, n):
+    gap = np.abs(position[u] - position[v])
+    return np.minimum(gap, n - gap).sum()
+
+
+def ring_order(graph, steps=RING_ORDER_STEPS):
+    """Returns the nodes in order around a ring on which neighbours lie
+    close together
+
+    Nodes start sorted by their angle in the plane of the two smallest
+    nontrivial Laplacian eigenvectors (for a ring lattice these are its
+    cosine and sine). Each step then moves every node to the circular
+    mean of its neighbours' positions and re-sorts; the order with the
+    shortest total edge ring distance is kept.
+    """
+    n = graph.n_nodes
+    A = gm.adjacency_matrix(graph).astype('float64')
+    # lobpcg orthogonal to the constant eigenvector scales to large
+    # graphs; a rough solution is enough as the smoothing refines it
+    start = np.random.default_rng(0).standard_normal((n, 2))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        _, vectors = linalg.lobpcg(csgraph.laplacian(A), start,
+                                   Y=np.ones((n, 1)), largest=False,
+                                   tol=1e-6, maxiter=SPECTRAL_ITERATIONS)
+    order = np.argsort(np.arctan2(vectors[:, 1], vectors[:, 0]),
+                       kind='stable')
+    u, v = _undirected_edges(graph)
+    best, best_length = order, np.inf
+    position = np.empty(n, dtype='int64')
+    for _ in range(steps + 1):
+        position[order] = np.arange(n)
+        length = _ring_length(position, u, v, n)
+        if length < best_length:
+            best, best_length = order, length
+        angles = A @ np.exp(2j * np.pi * position / n)
+        order = np.argsort(np.angle(angles), kind='stable')
+    return best
+
+
+def lattice_reference(graph, seed, swaps_per_edge=SWAPS_PER_EDGE,
+                      stall_rate=LATTICE_STALL_RATE,
+                      max_swaps_per_edge=MAX_LATTICE_SWAPS_PER_EDGE):
+    """Degree preserving latticisation: nodes are placed on a ring in
+    ring_order, which already keeps most edges short, and swaps are
+    accepted only when they shorten the edges' total ring distance,
+    until the acceptance rate stalls
+    """
+    n = graph.n_nodes
+    position = np.empty(n, dtype='int64')
+    position[ring_order(graph)] = np.arange(n)
+    position = position.tolist()
+
+    def ring(a, b):
+        gap = abs(position[a] - position[b])
+        return min(gap, n - gap)
+
+    def shortens(a, b, c, d):
+        return ring(a, d) + ring(c, b) < ring(a, b) + ring(c, d)
+
+    return _swap_edges(graph, seed, swaps_per_edge, accept=shortens,
+                       stall_rate=stall_rate,
+                       max_swaps_per_edge=max_swaps_per_edge)
+
+
+REFERENCES = dict(random=random_reference, lattice=lattice_reference)
+
+
+def _reference_job(args):
+    """Builds one reference graph and returns its path length and
+    clustering, caching both the graph and the metrics
+    """
+    graph_dir, kind, seed, swaps_per_edge, n_sources = args
+    name = f'{CACHE_NAMES[kind]}-seed{seed}-swaps{swaps_per_edge}'
+    metrics_path = graph_dir / f'{name}-src{n_sources or "all"}.json'
+    if metrics_path.exists():
+        with open(metrics_path) as f:
+            return json.load(f)
+
+    graph = ArtistGraph.load(graph_dir)
+    reference = REFERENCES[kind](graph, seed, swaps_per_edge)
+    reference.save(graph_dir / name)
+    length, c = gm.path_length_and_clustering(reference, n_sources,
+                                              processes=1)
+    metrics = dict(kind=kind, seed=seed, path_length=float(length),
+                   clustering=float(c))
+    with open(metrics_path, 'w') as f:
+        json.dump(metrics, f, indent=4)
+
+    return metrics
+
+
+def reference_metrics(graph, n_random=10, n_lattice=10, seed=0,
+                      swaps_per_edge=SWAPS_PER_EDGE, n_sources=None,
+                      cache_dir=CACHE_DIR, processes=None):
+    """Returns mean and variance of path length and clustering over
+    n_random random and n_lattice lattice references of graph
+
+    Each reference is built in a worker process with its own seed
+    (seed, seed + 1, ...). Graphs and metrics are cached in
+    cache_dir/<graph hash>/, so repeat calls only build references not
+    seen before.
+
+    :graph: undirected, connected ArtistGraph
+    :n_sources: sample this many BFS sources per reference for the path
+        length instead of using every node
+    """
+    graph_dir = Path(cache_dir) / graph_hash(graph)
+    if not (graph_dir / 'meta.json').exists():
+        graph.save(graph_dir)
+
+    jobs = [(graph_dir, kind, seed + i, swaps_per_edge, n_sources)
+            for kind, count in (('random', n_random), ('lattice', n_lattice))
+            for i in range(count)]
+    processes = min(processes or os.cpu_count(), len(jobs))
+    with mp.get_context('fork').Pool(processes) as pool:
+        results = pool.map(_reference_job, jobs)
+
+    summary = {}
+    for kind in REFERENCES:
+        runs = [r for r in results if r['kind'] == kind]
+        for metric in ('path_length', 'clustering'):
+            values = np.array([r[metric] for r in runs])
+            summary[f'{kind}_{metric}'] = dict(
+                mean=float(values.mean()) if len(values) else float('nan'),
+                var=float(values.var(ddof=1)) if len(values) > 1 else 0.0,
+                n=len(values),
+            )
+    return summary
+
+
+def small_world(graph, n_random=10, n_lattice=10, n_sources=None, **kwargs):
+    """Returns sigma, omega and SWI of graph against the averaged
+    reference metrics, together with the reference summary
+
+    :graph: undirected, connected ArtistGraph
+    :kwargs: passed to reference_metrics
+    """
+    refs = reference_metrics(graph, n_random, n_lattice,
+                             n_sources=n_sources, **kwargs)
+    length, c = gm.path_length_and_clustering(graph, n_sources)
+    l_r = refs['random_path_length']['mean']
+    c_r = refs['random_clustering']['mean']
+    l_l = refs['lattice_path_length']['mean']
+    c_l = refs['lattice_clustering']['mean']
+
+    return dict(
+        path_length=length,
+        clustering=c,
+        sigma=gm.sigma(c, length, c_r, l_r),
+        omega=gm.omega(c, length, c_l, l_r),
+        swi=gm.swi(c, length, c_r, l_r, c_l, l_l),
+        references=refs,
+    )
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# nearest neighbour index over the tracks' audio features: each feature is
+# standardised, small indexes are searched by brute force with one matrix
+# product per block of queries and large ones through a kd-tree. the
+# index is kept in a single .npz file and grows as new discover weekly
+# parts are combined.
+import logging
+import os
+from pathlib import Path
+
+import click
+import numpy as np
+from scipy.spatial import cKDTree
+
+from src.data.combine_discover_weekly import CombinedDiscoverWeekly
+
+project_dir = Path(__file__).resolve().parents[2]
+INDEX_PATH = project_dir / 'data/processed/track_similarity.npz'
+
+FEATURES = ['danceability', 'energy', 'speechiness', 'acousticness',
+            'instrumentalness', 'liveness', 'valence', 'loudness', 'tempo']
+# above this many tracks queries go through a kd-tree
+BRUTE_FORCE_MAX = 20000
+# queries per matrix product, bounding memory at QUERY_BLOCK x n floats
+QUERY_BLOCK = 256
+
+
+class SimilarityIndex:
+    """Standardised audio feature vectors of tracks
+
+    Vectors are standardised with the mean and standard deviation of the
+    tracks the index was built from; tracks added later reuse them, so
+    rebuild once the collection has drifted far from those.
+
+    :ids: array of spotify track ids
+    :vectors: float32 array of shape (n_tracks, len(FEATURES))
+    :mean: feature means used for standardising
+    :scale: feature standard deviations used for standardising
+    """
+
+    def __init__(self, ids, vectors, mean, scale):
+        self.ids = ids
+        self.vectors = vectors
+        self.mean = mean
+        self.scale = scale
+        self._index = None
+        self._tree = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _features(df):
+        """Returns (ids, raw feature matrix) of the rows of a
+        track_info_df frame with every feature present
+        """
+        df = df.dropna(subset=['song_id'] + FEATURES)
+        df = df.drop_duplicates('song_id', keep='last')
+        return (df['song_id'].to_numpy(dtype=str),
+                df[FEATURES].to_numpy(dtype='float64'))
+
+    @classmethod
+    def from_frame(cls, df):
+        """Builds an index from a track_info_df frame"""
+        ids, X = cls._features(df)
+        mean = X.mean(0) if len(X) else np.zeros(len(FEATURES))
+        scale = X.std(0) if len(X) else np.ones(len(FEATURES))
+        scale[scale == 0] = 1
+        return cls(ids, ((X - mean) / scale).astype('float32'), mean, scale)
+
+    def add(self, df):
+        """Adds the tracks of a track_info_df frame that are not in the
+        index yet; returns how many were added
+        """
+        ids, X = self._features(df)
+        new = ~np.isin(ids, self.ids)
+        if not new.any():
+            return 0
+        self.ids = np.concatenate([self.ids, ids[new]])
+        self.vectors = np.concatenate(
+            [self.vectors, ((X[new] - self.mean) / self.scale)
+             .astype('float32')])
+        self._index = self._tree = None
+        return int(new.sum())
+
+    def index_of(self, track_id):
+        """Returns the row of a track id, or None"""
+        if self._index is None:
+            self._index = {t: i for i, t in enumerate(self.ids.tolist())}
+        return self._index.get(track_id)
+
+    def _brute_force(self, Q, k):
+        norms = (self.vectors ** 2).sum(1)
+        distances = np.empty((len(Q), k), dtype='float32')
+        rows = np.empty((len(Q), k), dtype='int64')
+        for start in range(0, len(Q), QUERY_BLOCK):
+            block = Q[start:start + QUERY_BLOCK]
+            d2 = norms - 2 * block @ self.vectors.T \
+                + (block ** 2).sum(1)[:, None]
+            top = np.argpartition(d2, k - 1, axis=1)[:, :k]
+            order = np.take_along_axis(d2, top, 1).argsort(1)
+            top = np.take_along_axis(top, order, 1)
+            rows[start:start + len(block)] = top
+            distances[start:start + len(block)] = np.sqrt(np.maximum(
+                np.take_along_axis(d2, top, 1), 0))
+        return distances, rows
+
+    def search(self, Q, k=10):
+        """Returns (distances, rows) of the k nearest tracks to each
+        standardised query vector in Q, nearest first; raises ValueError
+        unless k is positive
+        """
+        if k < 1:
+            raise ValueError('k must be at least 1')
+        Q = np.atleast_2d(np.asarray(Q, dtype='float32'))
+        k = min(k, len(self))
+        if len(self) <= BRUTE_FORCE_MAX:
+            return self._brute_force(Q, k)
+        if self._tree is None:
+            self._tree = cKDTree(self.vectors)
+        distances, rows = self._tree.query(Q, k, workers=-1)
+        return (distances.reshape(len(Q), k).astype('float32'),
+                rows.reshape(len(Q), k))
+
+    def similar(self, track_ids, k=10):
+        """Returns {track id: [(similar track id, distance), ...]} with
+        the k tracks most like each of track_ids, None for ids not in the
+        index; raises ValueError unless k is positive
+        """
+        if k < 1:
+            raise ValueError('k must be at least 1')
+        rows = [self.index_of(t) for t in track_ids]
+        known = [r for r in rows if r is not None]
+        result = dict.fromkeys(track_ids)
+        if not known:
+            return result
+        # one extra neighbour, as a track is its own nearest
+        distances, neighbours = self.search(self.vectors[known], k + 1)
+        for row, d, n in zip(known, distances, neighbours):
+            keep = n != row
+            result[self.ids[row]] = list(zip(self.ids[n[keep]][:k].tolist(),
+                                             d[keep][:k].tolist()))
+        return result
+
+    def save(self, path=INDEX_PATH):
+        """Writes the index to an .npz file, replacing it atomically"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            np.savez(f, ids=self.ids, vectors=self.vectors, mean=self.mean,
+                     scale=self.scale)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in arrays.files})
+
+
+def update_index(path=INDEX_PATH, rebuild=False, combined=None):
+    """Adds the combined discover weekly tracks missing from the index at
+    path, one weekly part at a time, building the index if there is none
+    (or rebuild is set). Returns (index, tracks added).
+    """
+    combined = combined or CombinedDiscoverWeekly()
+    columns = ['song_id'] + FEATURES
+    if rebuild or not Path(path).exists():
+        index = SimilarityIndex.from_frame(combined.load(columns))
+        added = len(index)
+    else:
+        index = SimilarityIndex.load(path)
+        added = sum(index.add(df) for df in combined.iter_frames(columns))
+    if added:
+        index.save(path)
+    return index, added
+
+
+def similar_tracks(track_ids, k=10, path=INDEX_PATH):
+    """Returns the k tracks most like each of track_ids; see
+    SimilarityIndex.similar
+    """
+    return SimilarityIndex.load(path).similar(track_ids, k)
+
+
+@click.command()
+@click.option('--rebuild', is_flag=True,
+              help='rebuild from scratch, refitting the standardisation')
+@click.option('--query', 'track_ids', multiple=True,
+              help='print the tracks most like this id, repeatable')
+@click.option('-k', default=10, show_default=True,
+              type=click.IntRange(min=1))
+def main(rebuild, track_ids, k):
+    """ Adds newly combined discover weekly tracks to the similarity index
+        (../processed/track_similarity.npz).
+    """
+    logger = logging.getLogger(__name__)
+    index, added = update_index(rebuild=rebuild)
+    logger.info('%d tracks added, %d in the index', added, len(index))
+    for track_id, similar in index.similar(track_ids, k).items():
+        print(track_id)
+        for other, distance in similar or []:
+            print(f'    {other} {distance:.3f}')
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
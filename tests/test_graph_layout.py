@@ -0,0 +1,66 @@
+"""GraphLayout bounding box queries against brute force"""
+import numpy as np
+import pytest
+
+from src.features.graph_layout import GraphLayout
+from src.features.graph_store import ArtistGraph
+
+N_NODES = 20000
+
+
+@pytest.fixture(scope='module')
+def layout():
+    rng = np.random.default_rng(0)
+    graph = ArtistGraph.from_index_edges(
+        rng.integers(0, N_NODES, 5 * N_NODES),
+        rng.integers(0, N_NODES, 5 * N_NODES),
+        np.arange(N_NODES).astype(str), directed=False)
+    # a dense cluster in a sparse background, so some cells hold far
+    # more than limit nodes
+    positions = np.concatenate([
+        rng.random((N_NODES // 2, 2)) * 100,
+        rng.normal(50, 0.5, (N_NODES - N_NODES // 2, 2)),
+    ]).astype('float32')
+    return GraphLayout.build(graph, positions)
+
+
+def brute_force(layout, bbox, limit):
+    xy = layout.positions
+    inside = np.flatnonzero(
+        (xy[:, 0] >= bbox[0]) & (xy[:, 0] <= bbox[2])
+        & (xy[:, 1] >= bbox[1]) & (xy[:, 1] <= bbox[3]))
+    return inside[np.argsort(layout.rank[inside])[:limit]]
+
+
+def densest_cell_bbox(layout):
+    grid = layout.grid
+    c = np.argmax(np.diff(layout.cell_ptr))
+    lo = np.asarray(layout.bounds[:2])
+    width = (np.asarray(layout.bounds[2:]) - lo) / grid
+    x0, y0 = lo + width * (c // grid, c % grid)
+    return x0, y0, x0 + width[0], y0 + width[1]
+
+
+def test_part_of_a_dense_cell(layout):
+    x0, y0, x1, y1 = densest_cell_bbox(layout)
+    # the upper quarter of the cell
+    bbox = (x0, y0 + 0.75 * (y1 - y0), x1, y1)
+    expected = brute_force(layout, bbox, 5)
+    assert len(expected) == 5
+    assert layout.query(bbox, 5).tolist() == expected.tolist()
+
+
+@pytest.mark.parametrize('limit', [1, 5, 100, 5000])
+def test_random_boxes(layout, limit):
+    rng = np.random.default_rng(limit)
+    for _ in range(50):
+        corner = rng.uniform(0, 100, 2)
+        size = rng.uniform(0.1, 60, 2)
+        bbox = (*corner, *(corner + size))
+        assert layout.query(bbox, limit).tolist() == brute_force(
+            layout, bbox, limit).tolist()
+
+
+def test_whole_layout(layout):
+    assert layout.query(limit=50).tolist() == brute_force(
+        layout, layout.bounds, 50).tolist()
@@ -0,0 +1,55 @@
+"""Small-world indices against graphs whose answer is known"""
+import networkx as nx
+import numpy as np
+import pytest
+
+from src.features import graph_metrics as gm
+from src.features.graph_store import ArtistGraph
+
+N_NODES = 500
+NEIGHBOURS = 10
+
+
+def artist_graph(G):
+    edges = np.array(G.edges())
+    return ArtistGraph.from_index_edges(
+        edges[:, 0], edges[:, 1], np.arange(G.number_of_nodes()).astype(str),
+        directed=False)
+
+
+def watts_strogatz(p, seed=0):
+    return artist_graph(nx.connected_watts_strogatz_graph(
+        N_NODES, NEIGHBOURS, p, seed=seed))
+
+
+@pytest.fixture(scope='module')
+def references():
+    return watts_strogatz(1.0, seed=1), watts_strogatz(0.0)
+
+
+def test_swi_is_neals_product():
+    # ((3 - 10) / (2 - 10)) * ((0.5 - 0.1) / (0.7 - 0.1))
+    assert gm.swi(0.5, 3, 0.1, 2, 0.7, 10) == pytest.approx(0.875 * 2 / 3)
+
+
+def test_lattice_is_not_small_world(references):
+    random_graph, lattice_graph = references
+    result = gm.small_world(lattice_graph, random_graph, lattice_graph,
+                            processes=1)
+    assert result['swi'] == pytest.approx(0)
+
+
+def test_random_graph_is_not_small_world(references):
+    random_graph, lattice_graph = references
+    result = gm.small_world(random_graph, random_graph, lattice_graph,
+                            processes=1)
+    assert result['swi'] == pytest.approx(0)
+
+
+def test_rewired_lattice_is_small_world(references):
+    random_graph, lattice_graph = references
+    result = gm.small_world(watts_strogatz(0.05), random_graph,
+                            lattice_graph, processes=1)
+    assert 0.5 < result['swi'] <= 1
+    assert result['sigma'] > 1
+    assert abs(result['omega']) < 0.5
@@ -0,0 +1,53 @@
+"""Resuming the related-artist crawl with a larger max depth"""
+import asyncio
+
+from src.data.grow_artist_graph import ArtistGraphGrower
+
+
+class FakeClient:
+    """Related artists of a<i> are a<2i + 1> and a<2i + 2>: a binary tree
+    with 2 ** depth artists at each depth
+    """
+
+    def __init__(self):
+        self.fetched = []
+
+    async def map(self, func, args):
+        return [await func(arg) for arg in args]
+
+    async def artist_related_artists(self, artist_id):
+        self.fetched.append(artist_id)
+        i = int(artist_id[1:])
+        return {'artists': [{'id': f'a{2 * i + k}', 'name': f'Artist {k}'}
+                            for k in (1, 2)]}
+
+
+def grow(tmp_path, max_depth):
+    grower = ArtistGraphGrower(tmp_path / 'crawl.sqlite',
+                               tmp_path / 'crawl.jsonl', max_depth=max_depth)
+    grower.seed([{'id': 'a0', 'name': 'Seed'}])
+    client = FakeClient()
+    try:
+        asyncio.run(grower.grow(client))
+    finally:
+        grower.close()
+    return client.fetched
+
+
+def test_larger_max_depth_resumes_finished_crawl(tmp_path):
+    assert len(grow(tmp_path, max_depth=1)) == 3
+    assert grow(tmp_path, max_depth=1) == []
+    assert sorted(grow(tmp_path, max_depth=2)) == ['a3', 'a4', 'a5', 'a6']
+
+
+def test_neighbours_recovered_from_older_crawl_state(tmp_path):
+    grow(tmp_path, max_depth=1)
+    # state as written before neighbours beyond max_depth were stored
+    grower = ArtistGraphGrower(tmp_path / 'crawl.sqlite',
+                               tmp_path / 'crawl.jsonl')
+    grower.conn.execute('delete from artists where depth > 1')
+    grower.conn.execute("delete from meta where key = 'neighbours_stored'")
+    grower.conn.commit()
+    grower.close()
+
+    assert sorted(grow(tmp_path, max_depth=2)) == ['a3', 'a4', 'a5', 'a6']
@@ -0,0 +1,40 @@
+"""Random and lattice references of graphs whose structure is known"""
+import networkx as nx
+import pytest
+
+from src.features import graph_metrics as gm
+from src.features import reference_graphs as rg
+from tests.test_graph_metrics import N_NODES, NEIGHBOURS, artist_graph
+
+
+def watts_strogatz(p):
+    return artist_graph(nx.connected_watts_strogatz_graph(
+        N_NODES, NEIGHBOURS, p, seed=0))
+
+
+@pytest.fixture(scope='module')
+def ring_lattice():
+    return watts_strogatz(0.0)
+
+
+def test_references_preserve_degrees(ring_lattice):
+    for reference in (rg.random_reference, rg.lattice_reference):
+        graph = reference(ring_lattice, seed=0)
+        assert (graph.degree() == ring_lattice.degree()).all()
+        assert graph.n_edges == ring_lattice.n_edges
+
+
+def test_lattice_of_lattice_stays_clustered(ring_lattice):
+    lattice = rg.lattice_reference(ring_lattice, seed=0)
+    random = rg.random_reference(ring_lattice, seed=0)
+    assert gm.average_clustering(lattice) > 0.6
+    assert gm.average_clustering(lattice) > (
+        10 * gm.average_clustering(random))
+
+
+def test_small_world_graph_between_its_references():
+    graph = watts_strogatz(0.05)
+    result = gm.small_world(graph, rg.random_reference(graph, seed=0),
+                            rg.lattice_reference(graph, seed=0),
+                            processes=1)
+    assert 0 < result['swi'] <= 1
@@ -0,0 +1,127 @@
+"""AsyncSpotify against a local fake of the spotify web api"""
+import asyncio
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from src.data import spotify_client
+from src.data.spotify_client import AsyncSpotify, token_provider
+
+
+class FakeSpotify:
+    """Serves /audio-analysis/<id>, failing each id's first requests as
+    scripted: 'rate' answers 429 with Retry-After once, 'flaky' answers
+    503 twice and ids starting 'auth' answer 401 until the fresh token
+    is sent
+    """
+
+    def __init__(self, retry_after=0.2):
+        self.retry_after = retry_after
+        self.calls = {}
+        self.tokens = []
+
+    async def analysis(self, request):
+        track_id = request.match_info['track_id']
+        n = self.calls[track_id] = self.calls.get(track_id, 0) + 1
+        self.tokens.append(request.headers['Authorization'])
+        if track_id == 'rate' and n == 1:
+            return web.Response(status=429, headers={
+                'Retry-After': str(self.retry_after)})
+        if track_id == 'flaky' and n <= 2:
+            return web.Response(status=503)
+        if (track_id.startswith('auth')
+                and request.headers['Authorization'] != 'Bearer fresh'):
+            return web.Response(status=401)
+        return web.json_response({'track': {'id': track_id}})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/audio-analysis/{track_id}', self.analysis)
+        return app
+
+
+def fetch(fake, track_ids, get_token=lambda refresh=False: 'token'):
+    async def main():
+        async with TestServer(fake.app()) as server:
+            url = str(server.make_url('/'))
+            async with AsyncSpotify(get_token, base_url=url) as client:
+                return await client.map(client.audio_analysis, track_ids)
+
+    return asyncio.run(main())
+
+
+def test_429_waits_out_retry_after():
+    fake = FakeSpotify(retry_after=0.3)
+    start = time.monotonic()
+    assert fetch(fake, ['rate']) == [{'track': {'id': 'rate'}}]
+    assert time.monotonic() - start >= 0.3
+    assert fake.calls['rate'] == 2
+
+
+def test_5xx_retried_with_backoff(monkeypatch):
+    delays = []
+
+    def backoff(attempt):
+        delays.append(attempt)
+        return 0.01
+
+    monkeypatch.setattr(spotify_client, '_backoff', backoff)
+    fake = FakeSpotify()
+    assert fetch(fake, ['flaky', 'ok']) == [{'track': {'id': 'flaky'}},
+                                            {'track': {'id': 'ok'}}]
+    assert fake.calls == {'flaky': 3, 'ok': 1}
+    assert delays == [0, 1]
+
+
+class FakeAuthManager:
+    """Auth manager whose cached access token spotify has revoked; a
+    refresh caches the fresh one, as spotipy's does
+    """
+
+    def __init__(self):
+        self.token_info = {'access_token': 'stale', 'refresh_token': 'r'}
+        self.refreshed_with = []
+        self.cache_handler = self
+
+    def get_cached_token(self):
+        return self.token_info
+
+    def get_access_token(self, as_dict=True, check_cache=True):
+        return self.token_info['access_token']
+
+    def refresh_access_token(self, refresh_token):
+        # slow enough for every request in flight to see its 401
+        time.sleep(0.05)
+        self.refreshed_with.append(refresh_token)
+        self.token_info = {'access_token': 'fresh',
+                           'refresh_token': refresh_token}
+        return self.token_info
+
+
+def test_401_refreshes_the_token():
+    auth_manager = FakeAuthManager()
+    fake = FakeSpotify()
+    assert fetch(fake, ['auth'], token_provider(auth_manager)) == [
+        {'track': {'id': 'auth'}}]
+    assert auth_manager.refreshed_with == ['r']
+    assert fake.tokens == ['Bearer stale', 'Bearer fresh']
+
+
+def test_concurrent_401s_refresh_once():
+    auth_manager = FakeAuthManager()
+    fake = FakeSpotify()
+    track_ids = [f'auth{i}' for i in range(20)]
+    assert fetch(fake, track_ids, token_provider(auth_manager)) == [
+        {'track': {'id': track_id}} for track_id in track_ids]
+    assert auth_manager.refreshed_with == ['r']
+    assert fake.tokens.count('Bearer fresh') == len(track_ids)
+
+
+def test_token_asked_for_every_request():
+    # spotipy renews an expiring token on its own; the retry after the
+    # 429 must send the renewed one
+    tokens = iter(['first', 'second'])
+    fake = FakeSpotify(retry_after=0.01)
+    fetch(fake, ['rate'], lambda refresh=False: next(tokens))
+    assert fake.tokens == ['Bearer first', 'Bearer second']